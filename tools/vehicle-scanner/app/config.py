@@ -1,6 +1,7 @@
 """Configuration for the vehicle scanner pipeline."""
 
 import os
+import socket
 from pathlib import Path
 
 import torch
@@ -22,11 +23,52 @@ DEVICE = os.getenv("DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
 # --- Frame extraction ---
 MAX_FRAMES = 30
 SSIM_DEDUP_THRESHOLD = 0.85  # Frames more similar than this are dropped
+# Keyframe dedup method: "ssim" (640 px), "ssim_small" (160 px), "dhash" or "phash"
+DEDUP_METHODS = ("ssim", "ssim_small", "dhash", "phash")
+FRAME_DEDUP_METHOD = os.getenv("FRAME_DEDUP_METHOD", "ssim").lower()
+if FRAME_DEDUP_METHOD not in DEDUP_METHODS:
+    raise ValueError(
+        f"Unknown FRAME_DEDUP_METHOD: {FRAME_DEDUP_METHOD}. Allowed: {', '.join(DEDUP_METHODS)}"
+    )
+HASH_DEDUP_MAX_DISTANCE = 6  # dHash/pHash: Hamming distance (of 64 bits) at or below = duplicate
+VIDEO_SAMPLE_FPS = 2.0  # Frames per second of video kept for dedup
+VIDEO_DECODE_QUEUE_SIZE = 8  # Sampled frames buffered between decoder and dedup
+
+# --- Streaming pipeline ---
+# Frames flow through extract → preprocess/detect as soon as they are ready, then the
+# surviving detections are segmented; "false" runs each stage over all frames before the next one starts
+PIPELINE_STREAMING = os.getenv("PIPELINE_STREAMING", "true").lower() == "true"
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "8"))  # Frames buffered between stages
+
+# --- Decoded frame cache (per scan, shared by all stages) ---
+FRAME_CACHE_MB = int(os.getenv("FRAME_CACHE_MB", "256"))
+
+# --- Preprocessing (background removal, showroom composite, thumbnails) ---
+# Worker processes for per-frame preprocessing; 1 = run inline in the pipeline thread
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(min(os.cpu_count() or 1, 8))))
+
+# --- rembg / ONNX Runtime ---
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+# 0 = let ONNX Runtime decide (pool workers split the cores between them)
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+# Comma-separated, e.g. "CUDAExecutionProvider,CPUExecutionProvider"; empty = rembg default
+ORT_PROVIDERS = [p.strip() for p in os.getenv("ORT_PROVIDERS", "").split(",") if p.strip()]
 
 # --- YOLO damage detection ---
 YOLO_MODEL = os.getenv("YOLO_MODEL", "yolov8n.pt")
 YOLO_CONF_THRESHOLD = 0.25
 YOLO_IOU_THRESHOLD = 0.45
+# Inference backend: "pytorch" (Ultralytics .pt), "onnx" or "openvino" (exported and cached under
+# MODELS_DIR), or "onnx_int8" (fine-tuned model quantized by scripts/quantize_damage_model.py)
+YOLO_BACKEND = os.getenv("YOLO_BACKEND", "pytorch").lower()
+YOLO_EXPORT_IMGSZ = 640
+YOLO_BATCH_SIZE = int(os.getenv("YOLO_BATCH_SIZE", "8"))  # Frames per inference call
+YOLO_PREFETCH_FRAMES = int(os.getenv("YOLO_PREFETCH_FRAMES", "16"))  # Decoded frames buffered ahead
+# Visual anomaly heuristics (pre-trained model only) run on frames downscaled to this size.
+# Edge clusters change shape with resolution, so scratches differ from a full-resolution
+# run; 0 = full resolution (about 2x slower)
+ANOMALY_MAX_SIDE = int(os.getenv("ANOMALY_MAX_SIDE", "960"))
 
 # Vehicle damage classes (Phase 1: mapped from COCO pre-trained detections)
 # Phase 2: fine-tuned model with dedicated damage classes
@@ -41,9 +83,13 @@ DAMAGE_CLASS_MAP = {
     "missing_part": {"severity_weight": 1.0, "color": (128, 0, 128)},
 }
 
+# --- Exported inference models (ONNX / OpenVINO) ---
+EXPORTS_DIR = MODELS_DIR / "exports"
+
 # --- Fine-tuned damage model (Phase 2) ---
 YOLO_FINE_TUNED = os.getenv("YOLO_FINE_TUNED", "false").lower() == "true"
 FINE_TUNED_MODEL_PATH = MODELS_DIR / "fleet-damage-v1.pt"
+FINE_TUNED_INT8_MODEL_PATH = MODELS_DIR / "fleet-damage-v1-int8.onnx"
 FINE_TUNED_DAMAGE_CLASSES = [
     "dent", "scratch", "rust", "crack",
     "broken_light", "broken_glass", "paint_chip", "missing_part",
@@ -56,10 +102,18 @@ SAM_ENABLED = os.getenv("SAM_ENABLED", "false").lower() == "true"
 # --- Real-ESRGAN upscaling ---
 ESRGAN_SCALE = 4
 ESRGAN_ENABLED = os.getenv("ESRGAN_ENABLED", "false").lower() == "true"
+# Upscaling runs on demand (GET /scan/{id}/upscaled/...), tile by tile
+ESRGAN_TILE_SIZE = int(os.getenv("ESRGAN_TILE_SIZE", "256"))  # Input pixels per tile side
+ESRGAN_TILE_PAD = 10
+# Memory ceiling for one upscale: shrinks tiles and, if needed, the input image
+ESRGAN_MAX_MEMORY_MB = int(os.getenv("ESRGAN_MAX_MEMORY_MB", "1024"))
 
 # --- Comparison ---
 COMPARISON_SSIM_THRESHOLD = 0.90  # Below this = significant change
 ORB_FEATURES = 1000  # ORB feature count for alignment
+FRAME_MATCH_SHORTLIST = 3  # Previous frames per current frame sent to geometric verification
+FRAME_MATCH_MIN_INLIERS = 10  # RANSAC inliers needed to accept a frame pair
+HISTORY_COMPARE_MAX_SCANS = 20  # Upper bound for "compare against last N scans"
 
 # --- Damage scoring ---
 SEVERITY_THRESHOLDS = {
@@ -72,6 +126,46 @@ SEVERITY_THRESHOLDS = {
 STUDIO_BG_TOP = (26, 26, 26)      # #1a1a1a
 STUDIO_BG_BOTTOM = (10, 10, 10)   # #0a0a0a
 
+# --- Scan scheduling ---
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "2"))  # Pipelines run concurrently
+SCAN_QUEUE_MAX = int(os.getenv("SCAN_QUEUE_MAX", "100"))  # Waiting scans before HTTP 429
+
+# --- Scan state store ---
+SCAN_STORE_BACKEND = os.getenv("SCAN_STORE_BACKEND", "memory")  # memory | sqlite | redis
+# SQLite file path or Redis URL, depending on the backend
+SCAN_STORE_URL = os.getenv(
+    "SCAN_STORE_URL",
+    os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    if SCAN_STORE_BACKEND == "redis"
+    else str(DATA_DIR / "scan_state.db"),
+)
+SCAN_STATE_TTL_SECONDS = int(os.getenv("SCAN_STATE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Owner of this process's unfinished scans in the store: unique per replica and stable
+# across its restarts, so scans it was running are failed when it comes back
+SCAN_INSTANCE_ID = os.getenv("SCAN_INSTANCE_ID") or socket.gethostname()
+# Unfinished scans of an instance whose heartbeat is this old are failed by the others
+SCAN_OWNER_LEASE_SECONDS = int(os.getenv("SCAN_OWNER_LEASE_SECONDS", "60"))
+
+# --- Result cache (content-addressed, for re-uploaded inputs) ---
+RESULT_CACHE_DIR = DATA_DIR / "cache"
+RESULT_CACHE_MB = int(os.getenv("RESULT_CACHE_MB", "2048"))  # LRU-evicted on disk; 0 = disabled
+
+# --- Status push (server-sent events) ---
+STATUS_PUSH_INTERVAL_SECONDS = float(os.getenv("STATUS_PUSH_INTERVAL_SECONDS", "1.0"))  # Min gap within a stage
+STATUS_PUSH_MIN_PROGRESS = 1.0  # Progress points a within-stage update must move to be pushed
+STATUS_STREAM_POLL_SECONDS = 2.0  # Store re-read interval, for scans running on other replicas
+
+# --- Disk usage & retention ---
+DISK_USAGE_RECONCILE_SECONDS = int(os.getenv("DISK_USAGE_RECONCILE_SECONDS", "600"))  # Full re-walk of DATA_DIR
+DISK_QUOTA_MB = int(os.getenv("DISK_QUOTA_MB", "0"))  # Oldest finished scans deleted past this; 0 = no limit
+
+# --- Scan file serving ---
+IMAGE_VARIANT_WIDTHS = (256, 480, 960, 1440)  # ?w= is rounded up to one of these
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))  # WebP/AVIF quality, 1-100
+
 # --- Upload limits ---
-MAX_UPLOAD_SIZE_MB = 500
+MAX_UPLOAD_SIZE_MB = 500  # Per file
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", "50"))  # Per scan; with the size, bounds Content-Length
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes per disk write when streaming uploads to disk
+UPLOAD_HASH_ALGORITHM = os.getenv("UPLOAD_HASH_ALGORITHM", "sha256")  # Empty = no content hash
 ALLOWED_EXTENSIONS = {".mp4", ".mov", ".avi", ".webm", ".jpg", ".jpeg", ".png", ".heic", ".heif"}
@@ -3,36 +3,68 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import shutil
 import uuid
-from pathlib import Path
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-
-from app.config import ALLOWED_EXTENSIONS, DATA_DIR, MAX_UPLOAD_SIZE_MB, RESULTS_DIR, UPLOAD_DIR
+from pydantic import ValidationError
+
+from app.config import (
+    ALLOWED_EXTENSIONS,
+    ESRGAN_ENABLED,
+    HISTORY_COMPARE_MAX_SCANS,
+    MAX_UPLOAD_FILES,
+    MAX_UPLOAD_SIZE_MB,
+    RESULTS_DIR,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_DIR,
+    UPLOAD_HASH_ALGORITHM,
+)
 from app.models import (
     CompareRequest,
     ComparisonResult,
     DamageReport,
     HealthResponse,
+    HistoryComparisonResult,
+    HistoryCompareRequest,
     ScanResults,
     ScanStage,
     ScanStartResponse,
     ScanStatus,
+    ScanUploadForm,
 )
+from app.pipeline.history import read_scan_history
+from app.pipeline.metrics import render_prometheus
 from app.pipeline.orchestrator import (
+    compare_with_history,
+    disk_usage,
     get_scan_damages,
     get_scan_frames,
     get_scan_results,
     get_scan_status,
-    run_pipeline,
+    get_scan_timings,
+    scan_ownership,
+    scheduler,
+    status_events,
+    submit_scan,
+)
+from app.pipeline.scheduler import QueueFullError
+from app.pipeline.status_stream import stream_status
+from app.utils.file_serving import file_response
+from app.utils.image_variants import (
+    VARIANT_MEDIA_TYPES,
+    VARIANT_SOURCE_SUFFIXES,
+    get_image_variant,
+    variant_format,
+    variant_width,
 )
 from app.utils.model_loader import get_device, get_loaded_models, preload_models
+from app.utils.upload import UploadRejectedError, UploadTooLargeError, receive_upload
 
 # Configure logging
 logging.basicConfig(
@@ -62,82 +94,157 @@ async def startup():
     """Pre-load ML models on startup."""
     logger.info("Vehicle Scanner starting up...")
     await asyncio.to_thread(preload_models)
+    # Scans this instance had queued or running before it restarted are gone
+    await asyncio.to_thread(scan_ownership.start)
+    scheduler.start()
+    disk_usage.start()
     logger.info("Vehicle Scanner ready")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop background worker processes."""
+    from app.pipeline.preprocessing import shutdown_pool
+
+    shutdown_pool()
+    disk_usage.stop()
+    scan_ownership.stop()
+
+
 # ========================
 # Scan Endpoints
 # ========================
 
-@app.post("/scan", response_model=ScanStartResponse)
-async def start_scan(
-    files: list[UploadFile] = File(...),
-    vehicle_id: str = Form(default=None),
-    make: str = Form(default=None),
-    model: str = Form(default=None),
-    year: int = Form(default=None),
-    previous_scan_id: str = Form(default=None),
-):
-    """Upload video/photos and start the scanning pipeline."""
+@app.post(
+    "/scan",
+    response_model=ScanStartResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["files"],
+                        "properties": {
+                            "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                            **ScanUploadForm.model_json_schema()["properties"],
+                        },
+                    },
+                },
+            },
+        },
+    },
+)
+async def start_scan(request: Request):
+    """Upload video/photos and queue the scanning pipeline.
+
+    Multipart form: ``files`` plus the ScanUploadForm fields. The body is
+    parsed as it arrives and files are written straight to the scan's
+    upload directory; requests whose Content-Length is over the upload
+    limits are rejected with 413 before any of it is read.
+
+    Lower ``priority`` values run first; equal priorities run in upload order.
+    Returns 429 when the scan queue is full.
+    """
     scan_id = str(uuid.uuid4())
 
-    # Validate files
-    if not files:
-        raise HTTPException(status_code=400, detail="No files uploaded")
+    max_file_bytes = MAX_UPLOAD_SIZE_MB * 1024 * 1024
+    content_length = request.headers.get("content-length", "")
+    # Form fields and multipart framing get 1MB on top of the files
+    max_request_bytes = max_file_bytes * MAX_UPLOAD_FILES + 1024 * 1024
+    if content_length.isdigit() and int(content_length) > max_request_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload too large: {int(content_length) / (1024 * 1024):.1f}MB "
+                   f"(max: {MAX_UPLOAD_FILES} files of {MAX_UPLOAD_SIZE_MB}MB)",
+        )
+
+    # Reject before reading the body (parsed below, not by FastAPI) if we
+    # could not queue the scan anyway
+    if scheduler.is_full():
+        raise HTTPException(
+            status_code=429,
+            detail="Scan queue is full, retry later",
+            headers={"Retry-After": str(_retry_after_seconds())},
+        )
 
     # Create upload directory
     upload_dir = UPLOAD_DIR / scan_id
     upload_dir.mkdir(parents=True, exist_ok=True)
 
-    input_paths: list[Path] = []
-
-    for file in files:
-        # Validate extension
-        ext = Path(file.filename or "unknown").suffix.lower()
-        if ext not in ALLOWED_EXTENSIONS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported file type: {ext}. Allowed: {', '.join(ALLOWED_EXTENSIONS)}",
-            )
-
-        # Save file
-        file_path = upload_dir / (file.filename or f"upload_{len(input_paths)}{ext}")
-        content = await file.read()
+    # Stream files to disk, enforcing type and size limits as they arrive
+    try:
+        upload = await receive_upload(
+            request,
+            upload_dir,
+            file_field="files",
+            allowed_extensions=ALLOWED_EXTENSIONS,
+            max_file_bytes=max_file_bytes,
+            max_files=MAX_UPLOAD_FILES,
+            chunk_size=UPLOAD_CHUNK_SIZE,
+            hash_algorithm=UPLOAD_HASH_ALGORITHM or None,
+        )
+        if not upload.paths:
+            raise UploadRejectedError("No files uploaded")
+        # Empty form values count as not set, as with FastAPI's Form()
+        form = ScanUploadForm.model_validate({k: v for k, v in upload.fields.items() if v != ""})
+    except (UploadRejectedError, UploadTooLargeError) as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValidationError as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+    except BaseException:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise
+
+    input_paths = upload.paths
+    for path, digest in zip(input_paths, upload.digests):
+        logger.debug("Scan %s: %s %s=%s", scan_id, path.name, UPLOAD_HASH_ALGORITHM, digest)
 
-        # Check file size
-        size_mb = len(content) / (1024 * 1024)
-        if size_mb > MAX_UPLOAD_SIZE_MB:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large: {size_mb:.1f}MB (max: {MAX_UPLOAD_SIZE_MB}MB)",
-            )
+    logger.info("Scan %s: %d files uploaded (vehicle: %s %s %s %s)",
+                scan_id, len(input_paths), form.vehicle_id, form.make, form.model, form.year)
 
-        file_path.write_bytes(content)
-        input_paths.append(file_path)
+    disk_usage.add(scan_id, upload.size_bytes)
 
-    logger.info("Scan %s: %d files uploaded (vehicle: %s %s %s %s)",
-                scan_id, len(input_paths), vehicle_id, make, model, year)
-
-    # Start pipeline in background thread
-    asyncio.get_event_loop().run_in_executor(
-        None,
-        run_pipeline,
-        scan_id,
-        input_paths,
-        vehicle_id,
-        make,
-        model,
-        year,
-        previous_scan_id,
-    )
+    # Queue pipeline for the scan workers
+    try:
+        position = submit_scan(
+            scan_id,
+            input_paths,
+            form.vehicle_id,
+            form.make,
+            form.model,
+            form.year,
+            form.previous_scan_id,
+            priority=form.priority,
+            input_digests=upload.digests or None,
+        )
+    except QueueFullError as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        disk_usage.refresh_scan(scan_id)
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(_retry_after_seconds())},
+        )
 
     return ScanStartResponse(
         scan_id=scan_id,
-        status=ScanStage.uploading,
-        message=f"Scan started with {len(input_paths)} file(s)",
+        status=ScanStage.queued,
+        message=f"Scan queued with {len(input_paths)} file(s), {position} scan(s) ahead of it",
     )
 
 
+def _retry_after_seconds() -> int:
+    """Suggest a retry delay based on the average scan duration."""
+    avg = scheduler.average_duration
+    return max(int(avg / scheduler.workers), 1) if avg else 30
+
+
 @app.get("/scan/{scan_id}/status", response_model=ScanStatus)
 async def scan_status(scan_id: str):
     """Get current pipeline progress."""
@@ -147,6 +254,30 @@ async def scan_status(scan_id: str):
     return status
 
 
+@app.get("/scan/{scan_id}/events")
+async def scan_events(scan_id: str):
+    """Stream status changes as server-sent events until the scan ends.
+
+    Each ``status`` event carries a ScanStatus; stage changes are pushed at
+    once, progress ticks at most once per STATUS_PUSH_INTERVAL_SECONDS.
+    """
+    if get_scan_status(scan_id) is None:
+        raise HTTPException(status_code=404, detail=f"Scan not found: {scan_id}")
+
+    async def events():
+        async for status in stream_status(status_events, scan_id, get_scan_status):
+            if status is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: status\ndata: {status.model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/scan/{scan_id}/results", response_model=ScanResults)
 async def scan_results(scan_id: str):
     """Get complete scan results including damage report and processed images."""
@@ -161,6 +292,24 @@ async def scan_results(scan_id: str):
     return results
 
 
+@app.get("/scan/{scan_id}/timings")
+async def scan_timings(scan_id: str):
+    """Get per-stage wall/CPU time, peak RSS and throughput for a finished scan."""
+    timings = get_scan_timings(scan_id)
+    if timings is None:
+        raise HTTPException(status_code=404, detail="Timings not available")
+    return timings
+
+
+@app.get("/scan/{scan_id}/disk-usage")
+async def scan_disk_usage(scan_id: str):
+    """Get the disk space taken by a scan's uploads and results."""
+    size = disk_usage.scan_bytes(scan_id)
+    if size is None:
+        raise HTTPException(status_code=404, detail=f"Scan not found: {scan_id}")
+    return {"scan_id": scan_id, "disk_usage_mb": round(size / (1024 * 1024), 3)}
+
+
 @app.get("/scan/{scan_id}/damage-report", response_model=DamageReport)
 async def damage_report(scan_id: str):
     """Get damage report only."""
@@ -194,26 +343,46 @@ async def compare_scans_endpoint(request: CompareRequest):
         if status.status != ScanStage.complete:
             raise HTTPException(status_code=400, detail=f"Scan {sid} is not complete")
 
-    current_frames = get_scan_frames(request.current_scan_id)
-    previous_frames = get_scan_frames(request.previous_scan_id)
-    current_damages = get_scan_damages(request.current_scan_id)
-    previous_damages = get_scan_damages(request.previous_scan_id)
-
     from app.pipeline.comparison import compare_scans
 
-    comparison_dir = RESULTS_DIR / request.current_scan_id / "comparison"
-    result = await asyncio.to_thread(
-        compare_scans,
-        current_frames,
-        previous_frames,
-        current_damages,
-        previous_damages,
-        comparison_dir,
+    # Keep both scans from being evicted by the disk quota while comparing
+    with disk_usage.in_use(request.current_scan_id, request.previous_scan_id):
+        current_frames = get_scan_frames(request.current_scan_id)
+        previous_frames = get_scan_frames(request.previous_scan_id)
+        current_damages = get_scan_damages(request.current_scan_id)
+        previous_damages = get_scan_damages(request.previous_scan_id)
+
+        comparison_dir = RESULTS_DIR / request.current_scan_id / "comparison"
+        result = await asyncio.to_thread(
+            compare_scans,
+            current_frames,
+            previous_frames,
+            current_damages,
+            previous_damages,
+            comparison_dir,
+            request.current_scan_id,
+            request.previous_scan_id,
+            request.vehicle_id,
+        )
+    disk_usage.refresh_scan(request.current_scan_id)
+    return result
+
+
+@app.post("/compare/history", response_model=HistoryComparisonResult)
+async def compare_history_endpoint(request: HistoryCompareRequest):
+    """Compare a scan against the vehicle's last N scans and build a damage timeline."""
+    status = get_scan_status(request.current_scan_id)
+    if status is not None and status.status != ScanStage.complete:
+        raise HTTPException(status_code=400, detail=f"Scan {request.current_scan_id} is not complete")
+    if status is None and not get_scan_frames(request.current_scan_id):
+        raise HTTPException(status_code=404, detail=f"Scan not found: {request.current_scan_id}")
+
+    return await asyncio.to_thread(
+        compare_with_history,
         request.current_scan_id,
-        request.previous_scan_id,
         request.vehicle_id,
+        min(request.last_n, HISTORY_COMPARE_MAX_SCANS),
     )
-    return result
 
 
 # ========================
@@ -223,63 +392,123 @@ async def compare_scans_endpoint(request: CompareRequest):
 @app.get("/scan/history/{vehicle_id}")
 async def scan_history(vehicle_id: str):
     """Get scan history for a vehicle, sorted by timestamp ascending."""
-    history_path = DATA_DIR / "history" / f"{vehicle_id}.json"
-
-    scans: list[dict] = []
-    if history_path.exists():
-        try:
-            scans = json.loads(history_path.read_text())
-        except (json.JSONDecodeError, OSError):
-            scans = []
-
-    # Sort by timestamp ascending
-    scans.sort(key=lambda s: s.get("timestamp", ""))
-
-    return {"vehicle_id": vehicle_id, "scans": scans}
+    return {"vehicle_id": vehicle_id, "scans": read_scan_history(vehicle_id)}
 
 
 # ========================
 # Static File Serving
 # ========================
 
+# Scan artifact directories that are never rewritten once the scan has finished.
+# Upscaled renders are left out: they are produced on demand and revalidated.
+_FINAL_ARTIFACT_DIRS = {"frames", "nobg", "showroom", "thumbnails", "detections", "masks"}
+
+# Internal scan directories that are never served
+_PRIVATE_DIRS = {"features"}
+
+_MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".json": "application/json",
+}
+
+
+@app.get("/scan/{scan_id}/upscaled/{filename}")
+async def serve_upscaled_render(request: Request, scan_id: str, filename: str):
+    """Serve an upscaled render, running Real-ESRGAN on first request."""
+    if not ESRGAN_ENABLED:
+        raise HTTPException(status_code=503, detail="Upscaling is not enabled")
+
+    from app.pipeline.preprocessing import UpscaleError, get_upscaled_render
+
+    try:
+        file_path = await asyncio.to_thread(get_upscaled_render, RESULTS_DIR / scan_id, filename)
+    except UpscaleError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_response(request, file_path, "image/jpeg")
+
+
 @app.get("/scan/{scan_id}/{file_type}/{filename}")
-async def serve_scan_file(scan_id: str, file_type: str, filename: str):
-    """Serve processed scan files (images, masks, etc.)."""
-    file_path = RESULTS_DIR / scan_id / file_type / filename
-    if not file_path.exists():
+async def serve_scan_file(
+    request: Request,
+    scan_id: str,
+    file_type: str,
+    filename: str,
+    w: int | None = Query(default=None, ge=1, le=4096),
+):
+    """Serve processed scan files (images, masks, etc.).
+
+    Frame, render, detection and mask images are marked immutable once the
+    scan has finished. ``?w=`` serves an image scaled down to (at least)
+    that width, as AVIF or WebP when the client accepts them.
+    """
+    if file_type in _PRIVATE_DIRS:
+        raise HTTPException(status_code=404, detail="File not found")
+    scan_dir = RESULTS_DIR / scan_id
+    file_path = scan_dir / file_type / filename
+    if not file_path.is_file():
         # Also try direct under results dir
-        file_path = RESULTS_DIR / scan_id / filename
-    if not file_path.exists():
+        file_path = scan_dir / filename
+    if not file_path.is_file():
         raise HTTPException(status_code=404, detail="File not found")
 
-    media_types = {
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".png": "image/png",
-        ".json": "application/json",
-    }
-    media_type = media_types.get(file_path.suffix.lower(), "application/octet-stream")
-    return FileResponse(file_path, media_type=media_type)
+    immutable = (
+        file_path.parent.name == file_type
+        and file_type in _FINAL_ARTIFACT_DIRS
+        and _scan_finished(scan_id)
+    )
+
+    if w is not None and file_path.suffix.lower() in VARIANT_SOURCE_SUFFIXES:
+        fmt = variant_format(file_path, request.headers.get("accept", ""))
+        variant = await asyncio.to_thread(get_image_variant, scan_dir, file_path, variant_width(w), fmt)
+        if variant is not None:
+            return file_response(
+                request, variant, VARIANT_MEDIA_TYPES[fmt], immutable=immutable, headers={"Vary": "Accept"},
+            )
+
+    media_type = _MEDIA_TYPES.get(file_path.suffix.lower(), "application/octet-stream")
+    return file_response(request, file_path, media_type, immutable=immutable)
+
+
+def _scan_finished(scan_id: str) -> bool:
+    """Whether a scan has written its report, after which its artifacts are final."""
+    return (RESULTS_DIR / scan_id / "damage_report.json").exists()
 
 
 # ========================
-# Health Check
+# Health Check & Metrics
 # ========================
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Pipeline stage metrics in the Prometheus text format."""
+    return PlainTextResponse(
+        render_prometheus({
+            "scanner_queue_depth": ("Scans waiting for a worker.", scheduler.queued),
+            "scanner_scans_running": ("Scans currently running.", scheduler.running),
+            "scanner_status_subscribers": ("Open scan status event streams.", status_events.subscriber_count),
+            "scanner_disk_usage_bytes": ("Bytes used under the data directory.", disk_usage.total_bytes or 0),
+        }),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health():
-    """Service health check with model status."""
-    # Calculate disk usage of data directory
-    data_dir = RESULTS_DIR.parent
-    try:
-        usage = sum(f.stat().st_size for f in data_dir.rglob("*") if f.is_file())
-        disk_mb = usage / (1024 * 1024)
-    except Exception:
-        disk_mb = None
+    """Service health check with model status.
 
+    Disk usage comes from the tracked counters (None until the first
+    background reconcile has finished), so probes never walk the data dir.
+    """
+    usage = disk_usage.total_bytes
     return HealthResponse(
         status="ok",
         device=get_device(),
         models_loaded=get_loaded_models(),
-        disk_usage_mb=disk_mb,
+        disk_usage_mb=round(usage / (1024 * 1024), 3) if usage is not None else None,
+        disk_quota_mb=disk_usage.quota_bytes / (1024 * 1024) if disk_usage.quota_bytes else None,
+        scans_on_disk=disk_usage.scan_count,
     )
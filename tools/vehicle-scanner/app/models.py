@@ -11,6 +11,7 @@ from pydantic import BaseModel, Field
 
 class ScanStage(str, Enum):
     uploading = "uploading"
+    queued = "queued"
     extracting = "extracting"
     preprocessing = "preprocessing"
     detecting = "detecting"
@@ -29,12 +30,28 @@ class SeverityLevel(str, Enum):
 
 # --- Requests ---
 
+class ScanUploadForm(BaseModel):
+    """Text fields of the POST /scan multipart form (the files go alongside)."""
+    vehicle_id: Optional[str] = None
+    make: Optional[str] = None
+    model: Optional[str] = None
+    year: Optional[int] = None
+    previous_scan_id: Optional[str] = None
+    priority: int = 0
+
+
 class CompareRequest(BaseModel):
     current_scan_id: str
     previous_scan_id: str
     vehicle_id: Optional[str] = None
 
 
+class HistoryCompareRequest(BaseModel):
+    current_scan_id: str
+    vehicle_id: str
+    last_n: int = Field(default=5, ge=1, description="Number of previous scans to compare against")
+
+
 # --- Responses ---
 
 class ScanStartResponse(BaseModel):
@@ -50,6 +67,8 @@ class ScanStatus(BaseModel):
     stage_description: str = ""
     eta_seconds: Optional[float] = None
     error_message: Optional[str] = None
+    queue_position: Optional[int] = None  # Scans ahead of this one while queued
+    queue_wait_seconds: Optional[float] = None  # Estimated time until processing starts
 
 
 class BoundingBox(BaseModel):
@@ -90,6 +109,20 @@ class ProcessedImage(BaseModel):
     original_url: str
     processed_url: str
     thumbnail_url: Optional[str] = None
+    upscaled_url: Optional[str] = None  # Rendered on first request when ESRGAN is enabled
+
+
+class StageMetrics(BaseModel):
+    stage: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0  # Process-wide, includes helper threads
+    peak_rss_mb: float = 0.0
+    frames: int = 0
+    items: int = 0
+    frames_per_second: Optional[float] = None
+    # Overlapping parts of this stage (streamed extract/preprocess/detect/segment);
+    # their times are busy times inside this stage's wall time, not additive
+    substages: list[StageMetrics] = []
 
 
 class ScanResults(BaseModel):
@@ -98,6 +131,8 @@ class ScanResults(BaseModel):
     damage_report: Optional[DamageReport] = None
     processed_images: list[ProcessedImage] = []
     showroom_images: list[str] = []
+    stage_metrics: list[StageMetrics] = []
+    timings_url: Optional[str] = None
 
 
 class ComparisonItem(BaseModel):
@@ -105,6 +140,7 @@ class ComparisonItem(BaseModel):
     status: str  # "new", "resolved", "unchanged", "worsened"
     current: Optional[DamageItem] = None
     previous: Optional[DamageItem] = None
+    iou: Optional[float] = None  # Box overlap of a matched current/previous pair
 
 
 class ComparisonResult(BaseModel):
@@ -117,6 +153,25 @@ class ComparisonResult(BaseModel):
     worsened_damages: list[DamageItem] = []
     overall_change_score: float = Field(ge=-100, le=100, description="Negative=worse, Positive=improved")
     comparison_image_url: Optional[str] = None
+    matches: list[ComparisonItem] = []
+    matching_cost: float = Field(default=0.0, description="Sum of (1 - IoU) over matched damage pairs")
+
+
+class DamageTimelineEntry(BaseModel):
+    """History of one current damage across the vehicle's previous scans."""
+    damage: DamageItem
+    first_seen_scan_id: str
+    first_seen: Optional[datetime] = None
+    seen_in_scan_ids: list[str] = []  # Newest first, including the current scan
+    severity_history: list[SeverityLevel] = []  # Aligned with seen_in_scan_ids
+
+
+class HistoryComparisonResult(BaseModel):
+    current_scan_id: str
+    vehicle_id: Optional[str] = None
+    compared_scan_ids: list[str] = []  # Newest first
+    comparisons: list[ComparisonResult] = []  # One per compared scan, same order
+    timeline: list[DamageTimelineEntry] = []
 
 
 class HealthResponse(BaseModel):
@@ -124,3 +179,5 @@ class HealthResponse(BaseModel):
     device: str
     models_loaded: dict[str, bool] = {}
     disk_usage_mb: Optional[float] = None
+    disk_quota_mb: Optional[float] = None
+    scans_on_disk: int = 0
@@ -3,24 +3,40 @@
 from __future__ import annotations
 
 import logging
+from dataclasses import dataclass
 from pathlib import Path
 
 import cv2
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 from skimage.metrics import structural_similarity as ssim
 
-from app.config import COMPARISON_SSIM_THRESHOLD, ORB_FEATURES
+from app.config import (
+    COMPARISON_SSIM_THRESHOLD,
+    FRAME_MATCH_MIN_INLIERS,
+    FRAME_MATCH_SHORTLIST,
+)
 from app.models import (
     BoundingBox,
     ComparisonItem,
     ComparisonResult,
     DamageItem,
+    DamageTimelineEntry,
+    HistoryComparisonResult,
     SeverityLevel,
 )
-from app.utils.image_utils import load_image, resize_max, save_image
+from app.pipeline.frame_features import load_frame_features
+from app.utils.box_utils import boxes_to_array, iou_matrix
+from app.utils.frame_cache import FrameCache, load_frame
+from app.utils.image_utils import resize_max, save_image
 
 logger = logging.getLogger(__name__)
 
+FLANN_INDEX_LSH = 6
+
+# Minimum IoU for a current and previous damage to count as the same damage
+MATCH_MIN_IOU = 0.3
+
 
 def compare_scans(
     current_frames: list[Path],
@@ -31,60 +47,74 @@ def compare_scans(
     current_scan_id: str,
     previous_scan_id: str,
     vehicle_id: str | None = None,
+    frame_cache: FrameCache | None = None,
 ) -> ComparisonResult:
     """
     Compare two scans of the same vehicle to detect changes.
 
     1. Aligns frames using ORB feature matching
     2. Computes SSIM difference maps
-    3. Cross-references damage detections
+    3. Cross-references damage detections: within each matched frame pair,
+       current and previous boxes are paired by an optimal assignment on
+       IoU (linear_sum_assignment, cost = 1 - IoU, IoU must exceed 0.3)
     4. Classifies changes as new/resolved/unchanged/worsened
+
+    Frames are read through ``frame_cache`` when one is given.
     """
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # Find best frame pairs (align current frames to previous frames)
-    frame_pairs = _match_frames(current_frames, previous_frames)
+    frame_pairs = _match_frames(current_frames, previous_frames, frame_cache)
 
     # Compute structural differences
     diff_regions = []
     for curr_path, prev_path in frame_pairs:
-        regions = _compute_ssim_diff(curr_path, prev_path, output_dir)
+        regions = _compute_ssim_diff(curr_path, prev_path, output_dir, frame_cache)
         diff_regions.extend(regions)
 
-    # Cross-reference damage detections
+    # Cross-reference damage detections (optimal assignment within matched frames)
+    matches, matching_cost = _match_damages(
+        current_frames, previous_frames, frame_pairs, current_damages, previous_damages
+    )
+
     new_damages = []
     resolved_damages = []
     unchanged_damages = []
     worsened_damages = []
+    comparison_items = []
 
-    # Match current damages against previous
-    matched_prev = set()
-    for curr_item in current_damages:
-        best_match = None
-        best_iou = 0.0
-
-        for prev_item in previous_damages:
-            if prev_item.id in matched_prev:
-                continue
-            iou = _compute_iou(curr_item.bbox, prev_item.bbox)
-            if iou > best_iou and iou > 0.3:
-                best_iou = iou
-                best_match = prev_item
-
-        if best_match:
-            matched_prev.add(best_match.id)
-            # Compare severity
-            if _severity_value(curr_item.severity) > _severity_value(best_match.severity):
-                worsened_damages.append(curr_item)
-            else:
-                unchanged_damages.append(curr_item)
-        else:
+    matched_curr = {ci: (pj, iou) for ci, pj, iou in matches}
+    matched_prev = {pj for _, pj, _ in matches}
+
+    for ci, curr_item in enumerate(current_damages):
+        if ci not in matched_curr:
             new_damages.append(curr_item)
+            comparison_items.append(ComparisonItem(
+                damage_type=curr_item.damage_type, status="new", current=curr_item,
+            ))
+            continue
+
+        pj, iou = matched_curr[ci]
+        prev_item = previous_damages[pj]
+        # Compare severity
+        if _severity_value(curr_item.severity) > _severity_value(prev_item.severity):
+            worsened_damages.append(curr_item)
+            status = "worsened"
+        else:
+            unchanged_damages.append(curr_item)
+            status = "unchanged"
+        comparison_items.append(ComparisonItem(
+            damage_type=curr_item.damage_type, status=status,
+            current=curr_item, previous=prev_item, iou=round(iou, 4),
+        ))
 
     # Previous damages not matched → resolved
-    for prev_item in previous_damages:
-        if prev_item.id not in matched_prev:
+    for pj, prev_item in enumerate(previous_damages):
+        if pj not in matched_prev:
             resolved_damages.append(prev_item)
+            comparison_items.append(ComparisonItem(
+                damage_type=prev_item.damage_type, status="resolved", previous=prev_item,
+            ))
 
     # Calculate overall change score
     # Negative = vehicle got worse, Positive = vehicle improved
@@ -96,7 +126,7 @@ def compare_scans(
     # Generate comparison image
     comparison_image_url = None
     if frame_pairs:
-        comp_path = _create_comparison_image(frame_pairs[0], output_dir)
+        comp_path = _create_comparison_image(frame_pairs[0], output_dir, frame_cache)
         if comp_path:
             comparison_image_url = f"/scan/{current_scan_id}/comparison.jpg"
 
@@ -110,6 +140,8 @@ def compare_scans(
         worsened_damages=worsened_damages,
         overall_change_score=overall_change,
         comparison_image_url=comparison_image_url,
+        matches=comparison_items,
+        matching_cost=round(matching_cost, 6),
     )
 
     logger.info(
@@ -120,61 +152,228 @@ def compare_scans(
     return result
 
 
+@dataclass
+class PreviousScan:
+    """A previous scan's artifacts as needed for history comparison."""
+
+    scan_id: str
+    timestamp: str | None
+    frames: list[Path]
+    damages: list[DamageItem]
+
+
+def compare_history(
+    current_frames: list[Path],
+    current_damages: list[DamageItem],
+    previous_scans: list[PreviousScan],
+    output_dir: Path,
+    current_scan_id: str,
+    vehicle_id: str | None = None,
+    frame_cache: FrameCache | None = None,
+) -> HistoryComparisonResult:
+    """
+    Compare a scan against several previous scans (newest first) and build a
+    damage timeline.
+
+    Each previous scan is compared with ``compare_scans`` (frame features
+    come from the on-disk caches, frames from ``frame_cache``). A current
+    damage's timeline lists every compared scan in which it was matched;
+    its first sighting is the oldest of those.
+    """
+    comparisons: list[ComparisonResult] = []
+    seen: dict[str, list[tuple[PreviousScan, DamageItem]]] = {
+        d.id: [] for d in current_damages
+    }
+
+    for prev in previous_scans:
+        result = compare_scans(
+            current_frames=current_frames,
+            previous_frames=prev.frames,
+            current_damages=current_damages,
+            previous_damages=prev.damages,
+            output_dir=output_dir / prev.scan_id,
+            current_scan_id=current_scan_id,
+            previous_scan_id=prev.scan_id,
+            vehicle_id=vehicle_id,
+            frame_cache=frame_cache,
+        )
+        comparisons.append(result)
+        for match in result.matches:
+            if match.current is not None and match.previous is not None:
+                seen[match.current.id].append((prev, match.previous))
+
+    timeline = []
+    for damage in current_damages:
+        sightings = seen[damage.id]
+        first_scan = sightings[-1][0] if sightings else None
+        timeline.append(DamageTimelineEntry(
+            damage=damage,
+            first_seen_scan_id=first_scan.scan_id if first_scan else current_scan_id,
+            first_seen=first_scan.timestamp if first_scan else None,
+            seen_in_scan_ids=[current_scan_id] + [p.scan_id for p, _ in sightings],
+            severity_history=[damage.severity] + [d.severity for _, d in sightings],
+        ))
+
+    logger.info("History comparison for %s: %d previous scans, %d damages tracked",
+                current_scan_id, len(previous_scans), len(timeline))
+    return HistoryComparisonResult(
+        current_scan_id=current_scan_id,
+        vehicle_id=vehicle_id,
+        compared_scan_ids=[p.scan_id for p in previous_scans],
+        comparisons=comparisons,
+        timeline=timeline,
+    )
+
+
+def _match_damages(
+    current_frames: list[Path],
+    previous_frames: list[Path],
+    frame_pairs: list[tuple[Path, Path]],
+    current_damages: list[DamageItem],
+    previous_damages: list[DamageItem],
+    min_iou: float = MATCH_MIN_IOU,
+) -> tuple[list[tuple[int, int, float]], float]:
+    """Pair current with previous damages by optimal IoU assignment.
+
+    Boxes can only match if their frames were paired by ``_match_frames``
+    (any frames, if no pairs were found). The IoU matrix is filled per frame
+    pair and solved once; pairs at or below ``min_iou`` are discarded.
+
+    Returns ([(current_idx, previous_idx, iou), ...], total cost) where the
+    cost is the sum of (1 - IoU) over the returned pairs.
+    """
+    if not current_damages or not previous_damages:
+        return [], 0.0
+
+    curr_boxes = boxes_to_array([d.bbox for d in current_damages])
+    prev_boxes = boxes_to_array([d.bbox for d in previous_damages])
+    ious = np.zeros((len(current_damages), len(previous_damages)))
+
+    if frame_pairs:
+        curr_frame_idx = {p: i for i, p in enumerate(current_frames)}
+        prev_frame_idx = {p: i for i, p in enumerate(previous_frames)}
+        curr_by_frame = _indices_by_frame(current_damages)
+        prev_by_frame = _indices_by_frame(previous_damages)
+
+        for curr_path, prev_path in frame_pairs:
+            rows = curr_by_frame.get(curr_frame_idx.get(curr_path), [])
+            cols = prev_by_frame.get(prev_frame_idx.get(prev_path), [])
+            if rows and cols:
+                block = iou_matrix(curr_boxes[rows], prev_boxes[cols])
+                ious[np.ix_(rows, cols)] = np.maximum(ious[np.ix_(rows, cols)], block)
+    else:
+        ious = iou_matrix(curr_boxes, prev_boxes)
+
+    valid = ious > min_iou
+    if not valid.any():
+        return [], 0.0
+
+    # Invalid pairs get a cost no valid assignment can beat, then are dropped
+    cost = np.where(valid, 1.0 - ious, 2.0)
+    rows, cols = linear_sum_assignment(cost)
+
+    matches = [
+        (int(r), int(c), float(ious[r, c]))
+        for r, c in zip(rows, cols)
+        if valid[r, c]
+    ]
+    total_cost = float(sum(1.0 - iou for _, _, iou in matches))
+    return matches, total_cost
+
+
+def _indices_by_frame(items: list[DamageItem]) -> dict[int, list[int]]:
+    """Map frame_index → positions of items detected in that frame."""
+    by_frame: dict[int, list[int]] = {}
+    for i, item in enumerate(items):
+        by_frame.setdefault(item.frame_index, []).append(i)
+    return by_frame
+
+
 def _match_frames(
-    current_frames: list[Path], previous_frames: list[Path]
+    current_frames: list[Path],
+    previous_frames: list[Path],
+    frame_cache: FrameCache | None = None,
 ) -> list[tuple[Path, Path]]:
-    """Match current frames to previous frames using ORB feature matching."""
+    """Match current frames to previous frames using ORB feature matching.
+
+    Features come from the per-frame ``features/*.orb.npz`` caches
+    (extracted on first use). All previous descriptors go into one FLANN LSH
+    index; each current frame votes for previous frames via ratio-tested
+    nearest neighbours, and the top FRAME_MATCH_SHORTLIST candidates are
+    verified with a RANSAC homography. The candidate with the most inliers
+    wins.
+    """
     if not current_frames or not previous_frames:
         return []
 
-    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-
-    pairs = []
+    prev_features = [load_frame_features(p, frame_cache) for p in previous_frames]
+    indexed = [i for i, f in enumerate(prev_features) if f.descriptors is not None]
+    if not indexed:
+        return []
 
-    # For each current frame, find best matching previous frame
-    prev_descriptors = []
-    for prev_path in previous_frames:
-        img = load_image(prev_path)
-        gray = cv2.cvtColor(resize_max(img, 640), cv2.COLOR_BGR2GRAY)
-        kp, des = orb.detectAndCompute(gray, None)
-        prev_descriptors.append((prev_path, des))
+    matcher = cv2.FlannBasedMatcher(
+        dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1),
+        dict(checks=50),
+    )
+    matcher.add([prev_features[i].descriptors for i in indexed])
+    matcher.train()
 
+    pairs = []
     for curr_path in current_frames:
-        img = load_image(curr_path)
-        gray = cv2.cvtColor(resize_max(img, 640), cv2.COLOR_BGR2GRAY)
-        kp_curr, des_curr = orb.detectAndCompute(gray, None)
+        curr = load_frame_features(curr_path, frame_cache)
+        if curr.descriptors is None:
+            continue
 
-        if des_curr is None:
+        try:
+            knn = matcher.knnMatch(curr.descriptors, k=2)
+        except cv2.error:
             continue
 
+        # Lowe ratio test, grouped by the previous frame each match points into
+        good: dict[int, list[cv2.DMatch]] = {}
+        for candidates in knn:
+            if len(candidates) == 2 and candidates[0].distance < 0.75 * candidates[1].distance:
+                good.setdefault(candidates[0].imgIdx, []).append(candidates[0])
+
+        shortlist = sorted(good, key=lambda k: len(good[k]), reverse=True)[:FRAME_MATCH_SHORTLIST]
+
         best_match_path = None
-        best_match_count = 0
-
-        for prev_path, des_prev in prev_descriptors:
-            if des_prev is None:
-                continue
-            try:
-                matches = bf.match(des_curr, des_prev)
-                if len(matches) > best_match_count:
-                    best_match_count = len(matches)
-                    best_match_path = prev_path
-            except cv2.error:
-                continue
-
-        if best_match_path and best_match_count > 10:
+        best_inliers = 0
+        for img_idx in shortlist:
+            prev = prev_features[indexed[img_idx]]
+            inliers = _count_inliers(curr.points, prev.points, good[img_idx])
+            if inliers > best_inliers:
+                best_inliers = inliers
+                best_match_path = previous_frames[indexed[img_idx]]
+
+        if best_match_path and best_inliers > FRAME_MATCH_MIN_INLIERS:
             pairs.append((curr_path, best_match_path))
 
     logger.info("Matched %d frame pairs", len(pairs))
     return pairs
 
 
+def _count_inliers(
+    curr_points: np.ndarray, prev_points: np.ndarray, matches: list[cv2.DMatch]
+) -> int:
+    """Number of matches consistent with a single RANSAC homography."""
+    if len(matches) < 4:
+        return 0
+    src = curr_points[[m.queryIdx for m in matches]].reshape(-1, 1, 2)
+    dst = prev_points[[m.trainIdx for m in matches]].reshape(-1, 1, 2)
+    _, mask = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+    return int(mask.sum()) if mask is not None else 0
+
+
 def _compute_ssim_diff(
-    curr_path: Path, prev_path: Path, output_dir: Path
+    curr_path: Path,
+    prev_path: Path,
+    output_dir: Path,
+    frame_cache: FrameCache | None = None,
 ) -> list[dict]:
     """Compute SSIM difference between two aligned frames."""
-    curr_img = resize_max(load_image(curr_path), 1024)
-    prev_img = resize_max(load_image(prev_path), 1024)
+    curr_img = resize_max(load_frame(curr_path, frame_cache), 1024)
+    prev_img = resize_max(load_frame(prev_path, frame_cache), 1024)
 
     # Ensure same dimensions
     h = min(curr_img.shape[0], prev_img.shape[0])
@@ -221,18 +420,20 @@ def _compute_ssim_diff(
 
 
 def _create_comparison_image(
-    frame_pair: tuple[Path, Path], output_dir: Path
+    frame_pair: tuple[Path, Path],
+    output_dir: Path,
+    frame_cache: FrameCache | None = None,
 ) -> Path | None:
     """Create a side-by-side comparison image."""
     curr_path, prev_path = frame_pair
 
-    curr_img = resize_max(load_image(curr_path), 960)
-    prev_img = resize_max(load_image(prev_path), 960)
+    curr_img = resize_max(load_frame(curr_path, frame_cache), 960)
+    prev_img = resize_max(load_frame(prev_path, frame_cache), 960)
 
-    # Match heights
+    # Match heights (copy: cached frames are read-only and we draw labels below)
     h = min(curr_img.shape[0], prev_img.shape[0])
-    curr_img = curr_img[:h, :]
-    prev_img = prev_img[:h, :]
+    curr_img = curr_img[:h, :].copy()
+    prev_img = prev_img[:h, :].copy()
 
     # Add labels
     cv2.putText(prev_img, "Previous", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 200, 0), 2)
@@ -245,23 +446,6 @@ def _create_comparison_image(
     return comp_path
 
 
-def _compute_iou(a: BoundingBox, b: BoundingBox) -> float:
-    """Compute Intersection over Union."""
-    x1 = max(a.x1, b.x1)
-    y1 = max(a.y1, b.y1)
-    x2 = min(a.x2, b.x2)
-    y2 = min(a.y2, b.y2)
-
-    if x2 <= x1 or y2 <= y1:
-        return 0.0
-
-    intersection = (x2 - x1) * (y2 - y1)
-    area_a = (a.x2 - a.x1) * (a.y2 - a.y1)
-    area_b = (b.x2 - b.x1) * (b.y2 - b.y1)
-    union = area_a + area_b - intersection
-    return intersection / max(union, 1e-6)
-
-
 def _severity_value(severity: SeverityLevel) -> float:
     """Convert severity to numeric value for scoring."""
     return {"minor": 1.0, "moderate": 2.0, "severe": 3.0}.get(severity, 0.0)
@@ -5,20 +5,29 @@ from __future__ import annotations
 import logging
 import uuid
 from pathlib import Path
+from typing import Iterable, Iterator
 
 import cv2
 import numpy as np
 
 from app.config import (
+    ANOMALY_MAX_SIDE,
     YOLO_CONF_THRESHOLD,
     YOLO_IOU_THRESHOLD,
+    YOLO_BATCH_SIZE,
+    YOLO_PREFETCH_FRAMES,
     YOLO_FINE_TUNED,
     FINE_TUNED_DAMAGE_CLASSES,
     DAMAGE_CLASS_MAP,
     SEVERITY_THRESHOLDS,
 )
 from app.models import BoundingBox, DamageItem, SeverityLevel
+from app.pipeline import result_cache
+from app.utils.box_utils import boxes_to_array, iou_matrix
+from app.utils.frame_cache import FrameCache, load_frame
+from app.utils.image_utils import resize_max
 from app.utils.model_loader import load_yolo
+from app.utils.threaded_iter import threaded_iter
 
 logger = logging.getLogger(__name__)
 
@@ -30,11 +39,17 @@ COCO_DAMAGE_INDICATORS = {
     # We focus on visual anomaly detection instead
 }
 
+# Orange-brown hue range flagged as potential rust
+_RUST_HSV_LOWER = np.array([5, 80, 80])
+_RUST_HSV_UPPER = np.array([25, 255, 200])
+
 
 def detect_damage(
     frame_paths: list[Path],
     output_dir: Path,
     on_progress: callable = None,
+    batch_size: int = YOLO_BATCH_SIZE,
+    frame_cache: FrameCache | None = None,
 ) -> list[DamageItem]:
     """
     Run YOLOv8 damage detection on all frames.
@@ -46,55 +61,136 @@ def detect_damage(
 
     Phase 2: Will use a fine-tuned model with dedicated damage classes.
 
+    Frames are decoded by a prefetch thread and sent to the model in
+    mini-batches of ``batch_size`` so each inference call covers several
+    frames. Results are mapped back to their source frame index.
+
+    Frames are read through ``frame_cache`` when one is given.
+
     Returns list of DamageItem instances.
     """
     output_dir.mkdir(parents=True, exist_ok=True)
-    yolo = load_yolo()
-    all_items: list[DamageItem] = []
+    per_frame: list[list[DamageItem]] = []
 
     total = len(frame_paths)
-    for frame_idx, frame_path in enumerate(frame_paths):
-        img = cv2.imread(str(frame_path))
-        if img is None:
-            continue
+    for batch in _iter_batches(_prefetch_frames(frame_paths, frame_cache), max(batch_size, 1)):
+        per_frame.extend(items for _, items in detect_batch(batch, output_dir))
+
+        done = batch[-1][0] + 1
+        if on_progress:
+            on_progress(done / total * 100)
 
-        h, w = img.shape[:2]
+    return merge_detections(per_frame)
 
-        # Run YOLO inference
-        results = yolo(
-            img,
+
+def detect_batch(
+    batch: list[tuple[int, np.ndarray]], output_dir: Path
+) -> list[tuple[int, list[DamageItem]]]:
+    """Run one YOLO inference call over a mini-batch of (frame_index, BGR image).
+
+    Frames whose detections are in the result cache (same pixels, same
+    model and settings) are not sent to the model. Saves an annotated image
+    per frame and returns each frame's detections (not yet deduplicated
+    across frames), in batch order.
+    """
+    found: dict[int, list[DamageItem]] = {}
+    keys: dict[int, str] = {}
+    if result_cache.enabled():
+        for frame_idx, img in batch:
+            keys[frame_idx] = result_cache.frame_key(img)
+            cached = result_cache.load_frame_detections(keys[frame_idx], frame_idx)
+            if cached is not None:
+                found[frame_idx] = cached
+    misses = [(frame_idx, img) for frame_idx, img in batch if frame_idx not in found]
+
+    if misses:
+        # Run YOLO inference on the whole mini-batch (one Results per image)
+        results = load_yolo()(
+            [img for _, img in misses],
             conf=YOLO_CONF_THRESHOLD,
             iou=YOLO_IOU_THRESHOLD,
             verbose=False,
         )
 
-        frame_items = _process_detections(results, frame_idx, w, h)
-        all_items.extend(frame_items)
+        for (frame_idx, img), result in zip(misses, results):
+            h, w = img.shape[:2]
 
-        # Skip visual anomaly detection when using the fine-tuned model
-        # to avoid double-counting damage (the fine-tuned model already
-        # detects our 8 damage classes directly).
-        if not YOLO_FINE_TUNED:
-            anomaly_items = _detect_visual_anomalies(img, frame_idx, w, h)
-            all_items.extend(anomaly_items)
-        else:
-            anomaly_items = []
+            frame_items = _process_detections([result], frame_idx, w, h)
 
+            # Skip visual anomaly detection when using the fine-tuned model
+            # to avoid double-counting damage (the fine-tuned model already
+            # detects our 8 damage classes directly).
+            if not YOLO_FINE_TUNED:
+                frame_items += _detect_visual_anomalies(img, frame_idx, w, h)
+
+            found[frame_idx] = frame_items
+            if frame_idx in keys:
+                result_cache.store_frame_detections(keys[frame_idx], frame_items)
+
+    detections = []
+    for frame_idx, img in batch:
         # Save annotated frame
-        annotated = _draw_detections(img, frame_items + anomaly_items)
+        annotated = _draw_detections(img, found[frame_idx])
         annotated_path = output_dir / f"frame_{frame_idx:04d}_detections.jpg"
         cv2.imwrite(str(annotated_path), annotated)
 
-        if on_progress:
-            on_progress((frame_idx + 1) / total * 100)
+        detections.append((frame_idx, found[frame_idx]))
+    return detections
+
+
+def merge_detections(per_frame: list[list[DamageItem]]) -> list[DamageItem]:
+    """Concatenate per-frame detections (in frame order) and deduplicate them."""
+    all_items = [item for items in per_frame for item in items]
 
     # Deduplicate similar detections across frames
     all_items = _deduplicate_items(all_items)
 
-    logger.info("Detected %d damage items across %d frames", len(all_items), total)
+    logger.info("Detected %d damage items across %d frames", len(all_items), len(per_frame))
     return all_items
 
 
+def _prefetch_frames(
+    frame_paths: list[Path],
+    frame_cache: FrameCache | None = None,
+    depth: int = YOLO_PREFETCH_FRAMES,
+) -> Iterator[tuple[int, np.ndarray]]:
+    """Decode frames in a background thread, yielding (frame_index, BGR image).
+
+    Unreadable frames are skipped. At most ``depth`` decoded frames are
+    buffered ahead of inference.
+    """
+    return threaded_iter(
+        _read_frames(frame_paths, frame_cache), maxsize=depth, name="detect-prefetch"
+    )
+
+
+def _read_frames(
+    frame_paths: list[Path], frame_cache: FrameCache | None = None
+) -> Iterator[tuple[int, np.ndarray]]:
+    """Decode frames (or fetch them from the cache), skipping unreadable files."""
+    for frame_idx, frame_path in enumerate(frame_paths):
+        try:
+            img = load_frame(frame_path, frame_cache)
+        except ValueError:
+            logger.warning("Failed to load frame for detection: %s", frame_path)
+            continue
+        yield frame_idx, img
+
+
+def _iter_batches(
+    items: Iterable[tuple[int, np.ndarray]], size: int
+) -> Iterator[list[tuple[int, np.ndarray]]]:
+    """Group an iterable into lists of at most ``size`` items."""
+    batch: list[tuple[int, np.ndarray]] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def _process_detections(
     results, frame_idx: int, img_w: int, img_h: int
 ) -> list[DamageItem]:
@@ -172,74 +268,107 @@ def _detect_visual_anomalies(
     - Color discontinuities (paint damage, rust spots)
     - Texture anomalies (dents cause lighting irregularities)
     - Edge discontinuities (cracks, scratches)
+
+    Runs on a copy downscaled to ANOMALY_MAX_SIDE (0 = full resolution).
+    Candidate regions are the connected components of each hole-filled
+    mask, so area, bbox and aspect filters are array operations; boxes are
+    scaled back to full resolution.
     """
-    items: list[DamageItem] = []
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = resize_max(img, ANOMALY_MAX_SIDE) if ANOMALY_MAX_SIDE > 0 else img
+    small_h, small_w = small.shape[:2]
+    scale_x, scale_y = img_w / small_w, img_h / small_h
+    total_area = small_w * small_h
+    kernel = np.ones((3, 3), np.uint8)
+    # Morphology passes scaled to cover ~2 full-resolution pixels
+    iterations = max(round(2 * small_w / img_w), 1)
 
     # --- Edge-based scratch/crack detection ---
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
     edges = cv2.Canny(gray, 50, 150)
     # Dilate to connect nearby edges
-    kernel = np.ones((3, 3), np.uint8)
-    edges_dilated = cv2.dilate(edges, kernel, iterations=2)
-
-    # Find contours of edge regions
-    contours, _ = cv2.findContours(edges_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    edges_dilated = cv2.dilate(edges, kernel, iterations=iterations)
+    boxes, area_ratio = _outline_stats(edges_dilated, total_area)
 
-    for contour in contours:
-        area = cv2.contourArea(contour)
-        total_area = img_w * img_h
-        area_ratio = area / total_area
-
-        # Filter: only significant edge clusters (0.1% - 5% of image)
-        if 0.001 < area_ratio < 0.05:
-            x, y, w, h = cv2.boundingRect(contour)
-            aspect = max(w, h) / max(min(w, h), 1)
-
-            # Long thin contours → likely scratches
-            if aspect > 4:
-                conf = min(area_ratio * 20, 0.8)  # Scale confidence by area
-                items.append(DamageItem(
-                    id=str(uuid.uuid4())[:8],
-                    damage_type="scratch",
-                    severity=_classify_severity(conf, area_ratio),
-                    confidence=conf,
-                    bbox=BoundingBox(x1=float(x), y1=float(y), x2=float(x + w), y2=float(y + h)),
-                    frame_index=frame_idx,
-                    description="Linear edge pattern detected (potential scratch)",
-                ))
+    # Only significant edge clusters (0.1% - 5% of image) that are long and
+    # thin (likely scratches)
+    w, h = boxes[:, 2], boxes[:, 3]
+    aspect = np.maximum(w, h) / np.maximum(np.minimum(w, h), 1)
+    scratch = (area_ratio > 0.001) & (area_ratio < 0.05) & (aspect > 4)
+    scratch_conf = np.minimum(area_ratio * 20, 0.8)  # Scale confidence by area
 
     # --- Color anomaly detection (rust/paint damage) ---
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
 
     # Rust detection: orange-brown hue range
-    rust_lower = np.array([5, 80, 80])
-    rust_upper = np.array([25, 255, 200])
-    rust_mask = cv2.inRange(hsv, rust_lower, rust_upper)
-
+    rust_mask = cv2.inRange(hsv, _RUST_HSV_LOWER, _RUST_HSV_UPPER)
     # Clean up noise
-    rust_mask = cv2.morphologyEx(rust_mask, cv2.MORPH_OPEN, kernel, iterations=2)
-    rust_contours, _ = cv2.findContours(rust_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    for contour in rust_contours:
-        area = cv2.contourArea(contour)
-        area_ratio = area / (img_w * img_h)
-
-        if area_ratio > 0.0005:  # At least 0.05% of image
-            x, y, w, h = cv2.boundingRect(contour)
-            conf = min(area_ratio * 30 + 0.3, 0.85)
-            items.append(DamageItem(
-                id=str(uuid.uuid4())[:8],
-                damage_type="rust",
-                severity=_classify_severity(conf, area_ratio),
-                confidence=conf,
-                bbox=BoundingBox(x1=float(x), y1=float(y), x2=float(x + w), y2=float(y + h)),
-                frame_index=frame_idx,
-                description="Orange-brown color anomaly detected (potential rust)",
-            ))
-
+    rust_mask = cv2.morphologyEx(rust_mask, cv2.MORPH_OPEN, kernel, iterations=iterations)
+    rust_boxes, rust_ratio = _outline_stats(rust_mask, total_area)
+
+    rust = rust_ratio > 0.0005  # At least 0.05% of image
+    rust_conf = np.minimum(rust_ratio * 30 + 0.3, 0.85)
+
+    scale = np.array([scale_x, scale_y, scale_x, scale_y])
+    items = _anomaly_items(
+        boxes[scratch] * scale, scratch_conf[scratch], area_ratio[scratch], frame_idx,
+        "scratch", "Linear edge pattern detected (potential scratch)",
+    )
+    items += _anomaly_items(
+        rust_boxes[rust] * scale, rust_conf[rust], rust_ratio[rust], frame_idx,
+        "rust", "Orange-brown color anomaly detected (potential rust)",
+    )
     return items
 
 
+def _outline_stats(mask: np.ndarray, total_area: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return (N, 4) [x, y, w, h] boxes and area ratios of a mask's outer outlines.
+
+    Holes are filled first (everything the background cannot reach from the
+    image border, 4-connected, as findContours sees it), so rings and
+    rectangle outlines (panel gaps, trim) measure as the region they
+    enclose. Areas approximate ``contourArea`` of each outline (pixel count
+    minus half the perimeter, taken as w + h), which the thresholds were
+    tuned on.
+    """
+    # Pad so the outside is one connected region, flood it, and keep the rest
+    padded = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    cv2.floodFill(padded, None, (0, 0), 128)
+    filled = cv2.compare(padded[1:-1, 1:-1], 128, cv2.CMP_NE)
+
+    # Both masks are dilated/opened with a 3x3 kernel, so blobs are at least
+    # 3x3 and sit on a 4x4 grid at worst; 16-bit labels are enough (and much
+    # cheaper to write) below 16 * 65535 pixels
+    ltype = cv2.CV_16U if total_area <= 16 * 65535 else cv2.CV_32S
+    _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(filled, 8, ltype, cv2.CCL_GRANA)
+    stats = stats[1:]  # Label 0 is the background
+    boxes = stats[:, :4].astype(np.float64)
+    area = stats[:, cv2.CC_STAT_AREA] - stats[:, cv2.CC_STAT_WIDTH] - stats[:, cv2.CC_STAT_HEIGHT]
+    return boxes, np.maximum(area, 0) / total_area
+
+
+def _anomaly_items(
+    boxes: np.ndarray,
+    confidences: np.ndarray,
+    area_ratios: np.ndarray,
+    frame_idx: int,
+    damage_type: str,
+    description: str,
+) -> list[DamageItem]:
+    """Build DamageItems from full-resolution [x, y, w, h] boxes."""
+    return [
+        DamageItem(
+            id=str(uuid.uuid4())[:8],
+            damage_type=damage_type,
+            severity=_classify_severity(conf, ratio),
+            confidence=conf,
+            bbox=BoundingBox(x1=x, y1=y, x2=x + w, y2=y + h),
+            frame_index=frame_idx,
+            description=description,
+        )
+        for (x, y, w, h), conf, ratio in zip(boxes.tolist(), confidences.tolist(), area_ratios.tolist())
+    ]
+
+
 def _classify_severity(confidence: float, area_ratio: float) -> SeverityLevel:
     """Classify damage severity based on confidence and area."""
     # Combine confidence and area into a severity score
@@ -292,43 +421,63 @@ def _draw_detections(img: np.ndarray, items: list[DamageItem]) -> np.ndarray:
 
 
 def _deduplicate_items(items: list[DamageItem], iou_threshold: float = 0.5) -> list[DamageItem]:
-    """Remove duplicate detections across frames using IoU."""
+    """Remove duplicate detections across frames using IoU.
+
+    Items are visited in order; an item overlapping an already-kept item of
+    the same damage type (IoU > threshold) replaces it if more confident and
+    is dropped otherwise. Each visit checks all kept boxes of that type with
+    one vectorized IoU row instead of a Python loop.
+    """
     if len(items) <= 1:
         return items
 
-    unique: list[DamageItem] = []
+    kept: dict[str, _KeptBoxes] = {}
+    stamp = 0
 
     for item in items:
-        is_dup = False
-        for existing in unique:
-            if item.damage_type == existing.damage_type:
-                iou = _compute_iou(item.bbox, existing.bbox)
-                if iou > iou_threshold:
-                    # Keep the higher-confidence one
-                    if item.confidence > existing.confidence:
-                        unique.remove(existing)
-                        unique.append(item)
-                    is_dup = True
-                    break
-        if not is_dup:
-            unique.append(item)
-
-    return unique
-
-
-def _compute_iou(a: BoundingBox, b: BoundingBox) -> float:
-    """Compute Intersection over Union between two bounding boxes."""
-    x1 = max(a.x1, b.x1)
-    y1 = max(a.y1, b.y1)
-    x2 = min(a.x2, b.x2)
-    y2 = min(a.y2, b.y2)
-
-    if x2 <= x1 or y2 <= y1:
-        return 0.0
-
-    intersection = (x2 - x1) * (y2 - y1)
-    area_a = (a.x2 - a.x1) * (a.y2 - a.y1)
-    area_b = (b.x2 - b.x1) * (b.y2 - b.y1)
-    union = area_a + area_b - intersection
-
-    return intersection / max(union, 1e-6)
+        group = kept.setdefault(item.damage_type, _KeptBoxes(len(items)))
+        box = boxes_to_array([item.bbox])
+
+        match = -1
+        if group.count:
+            ious = iou_matrix(box, group.boxes[:group.count])[0]
+            candidates = np.flatnonzero(ious > iou_threshold)
+            if candidates.size:
+                # First kept item in list order (oldest stamp) wins the match
+                match = int(candidates[np.argmin(group.stamps[candidates])])
+
+        if match < 0:
+            group.add(item, box[0], stamp)
+        elif item.confidence > group.items[match].confidence:
+            # Keep the higher-confidence one (it moves to the end of the list)
+            group.replace(match, item, box[0], stamp)
+        stamp += 1
+
+    unique = [
+        (group.stamps[i], group.items[i])
+        for group in kept.values()
+        for i in range(group.count)
+    ]
+    unique.sort(key=lambda pair: pair[0])
+    return [item for _, item in unique]
+
+
+class _KeptBoxes:
+    """Kept detections of one damage type, with boxes in a NumPy array."""
+
+    def __init__(self, capacity: int):
+        self.boxes = np.zeros((capacity, 4), dtype=np.float64)
+        self.stamps = np.zeros(capacity, dtype=np.int64)
+        self.items: list[DamageItem] = []
+        self.count = 0
+
+    def add(self, item: DamageItem, box: np.ndarray, stamp: int) -> None:
+        self.boxes[self.count] = box
+        self.stamps[self.count] = stamp
+        self.items.append(item)
+        self.count += 1
+
+    def replace(self, index: int, item: DamageItem, box: np.ndarray, stamp: int) -> None:
+        self.boxes[index] = box
+        self.stamps[index] = stamp
+        self.items[index] = item
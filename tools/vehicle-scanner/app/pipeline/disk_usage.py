@@ -0,0 +1,295 @@
+"""Disk usage of DATA_DIR, tracked per scan, with a retention quota."""
+
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from app.config import (
+    DATA_DIR,
+    DISK_QUOTA_MB,
+    DISK_USAGE_RECONCILE_SECONDS,
+    RESULTS_DIR,
+    UPLOAD_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+# Files a scan writes once it has ended, successfully or not
+FINISHED_MARKERS = ("timings.json", "damage_report.json")
+
+# Fraction of the quota the scans are trimmed down to once it is exceeded
+_QUOTA_LOW_WATER = 0.9
+
+
+class DiskUsageTracker:
+    """Bytes on disk per scan (uploads + results) and for everything else.
+
+    Counters are updated whenever a scan's files change, so reading them
+    never walks the tree. A background thread re-walks DATA_DIR every
+    ``reconcile_seconds`` to pick up writes made elsewhere (result cache,
+    history, on-demand renders) and then applies the quota: the oldest
+    finished scans are deleted until usage is back under it. Scans marked
+    with ``acquire`` / ``in_use`` (running pipelines and the scans they or
+    a compare request read) are never deleted.
+    """
+
+    def __init__(
+        self,
+        data_dir: Path = DATA_DIR,
+        upload_dir: Path = UPLOAD_DIR,
+        results_dir: Path = RESULTS_DIR,
+        quota_bytes: int = DISK_QUOTA_MB * 1024 * 1024,
+        reconcile_seconds: float = DISK_USAGE_RECONCILE_SECONDS,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ):
+        self.data_dir = data_dir
+        self.upload_dir = upload_dir
+        self.results_dir = results_dir
+        self.quota_bytes = max(quota_bytes, 0)
+        self.reconcile_seconds = reconcile_seconds
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._quota_lock = threading.Lock()  # One eviction pass at a time
+        self._scans: dict[str, int] = {}
+        self._in_use: dict[str, int] = {}  # scan id -> number of holders
+        self._other = 0
+        self._reconciled = False
+        self._changed_during_reconcile: set[str] = set()
+        self._reconciling = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the background reconcile thread (idempotent)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="disk-usage", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # --- Reads ---
+
+    @property
+    def total_bytes(self) -> Optional[int]:
+        """Bytes under DATA_DIR, or None before the first reconcile."""
+        with self._lock:
+            if not self._reconciled:
+                return None
+            return self._other + sum(self._scans.values())
+
+    @property
+    def scan_count(self) -> int:
+        with self._lock:
+            return len(self._scans)
+
+    def scan_bytes(self, scan_id: str) -> Optional[int]:
+        """Bytes of one scan's uploads and results, or None if it has none."""
+        with self._lock:
+            return self._scans.get(scan_id)
+
+    # --- Scans in use ---
+
+    def acquire(self, *scan_ids: Optional[str]) -> None:
+        """Protect scans from quota eviction until ``release``; None ids are ignored."""
+        with self._lock:
+            for scan_id in filter(None, scan_ids):
+                self._in_use[scan_id] = self._in_use.get(scan_id, 0) + 1
+
+    def release(self, *scan_ids: Optional[str]) -> None:
+        with self._lock:
+            for scan_id in filter(None, scan_ids):
+                holders = self._in_use.get(scan_id, 0) - 1
+                if holders > 0:
+                    self._in_use[scan_id] = holders
+                else:
+                    self._in_use.pop(scan_id, None)
+
+    @contextmanager
+    def in_use(self, *scan_ids: Optional[str]) -> Iterator[None]:
+        """Protect scans from quota eviction for the duration of the block."""
+        self.acquire(*scan_ids)
+        try:
+            yield
+        finally:
+            self.release(*scan_ids)
+
+    # --- Updates ---
+
+    def add(self, scan_id: str, nbytes: int) -> None:
+        """Count ``nbytes`` just written for ``scan_id``."""
+        with self._lock:
+            self._scans[scan_id] = self._scans.get(scan_id, 0) + nbytes
+            self._note_change(scan_id)
+
+    def refresh_scan(self, scan_id: str) -> int:
+        """Re-measure one scan's directories after it wrote or removed files."""
+        size = sum(_tree_size(d / scan_id)[0] for d in (self.upload_dir, self.results_dir))
+        with self._lock:
+            if size:
+                self._scans[scan_id] = size
+            else:
+                self._scans.pop(scan_id, None)
+            self._note_change(scan_id)
+        return size
+
+    def remove_scan(self, scan_id: str) -> int:
+        """Delete a scan's uploads and results; returns the bytes freed."""
+        for d in (self.upload_dir, self.results_dir):
+            shutil.rmtree(d / scan_id, ignore_errors=True)
+        with self._lock:
+            freed = self._scans.pop(scan_id, 0)
+            self._note_change(scan_id)
+        if self.on_evict is not None:
+            try:
+                self.on_evict(scan_id)
+            except Exception as e:
+                logger.warning("Eviction callback failed for scan %s: %s", scan_id, e)
+        return freed
+
+    def _note_change(self, scan_id: str) -> None:
+        if self._reconciling:
+            self._changed_during_reconcile.add(scan_id)
+
+    # --- Reconcile & retention ---
+
+    def reconcile(self) -> None:
+        """Walk DATA_DIR and replace the counters with what is on disk.
+
+        Hard-linked files (scan artifacts shared with the result cache) are
+        counted once, for the scan.
+        """
+        with self._lock:
+            self._reconciling = True
+            self._changed_during_reconcile.clear()
+
+        start = time.perf_counter()
+        seen: set[tuple[int, int]] = set()
+        scans: dict[str, int] = {}
+        for d in (self.upload_dir, self.results_dir):
+            for entry in _scandir(d):
+                if entry.is_dir(follow_symlinks=False):
+                    size, _ = _tree_size(Path(entry.path), seen)
+                    scans[entry.name] = scans.get(entry.name, 0) + size
+        skip = {self.upload_dir.resolve(), self.results_dir.resolve()}
+        other, files = _tree_size(self.data_dir, seen, skip)
+
+        with self._lock:
+            # Keep counts for scans that changed while we were walking
+            for scan_id in self._changed_during_reconcile:
+                if scan_id in self._scans:
+                    scans[scan_id] = self._scans[scan_id]
+                else:
+                    scans.pop(scan_id, None)
+            self._scans = scans
+            self._other = other
+            self._reconciled = True
+            self._reconciling = False
+        logger.debug("Disk usage reconciled in %.2fs: %d scans, %d other files",
+                     time.perf_counter() - start, len(scans), files)
+
+    def enforce_quota(self) -> list[str]:
+        """Delete the oldest finished scans while usage is over the quota.
+
+        Scans that have not finished or are in use are never deleted.
+        Concurrent calls are serialised. Returns the evicted scan ids.
+        """
+        with self._quota_lock:
+            total = self.total_bytes
+            if not self.quota_bytes or total is None or total <= self.quota_bytes:
+                return []
+
+            target = int(self.quota_bytes * _QUOTA_LOW_WATER)
+            evicted = []
+            for _, scan_id in self._finished_scans():
+                if total <= target:
+                    break
+                with self._lock:
+                    # Checked under the lock so a scan acquired from now on
+                    # is either kept or already on its way out
+                    if scan_id in self._in_use:
+                        continue
+                    if scan_id not in self._scans:
+                        continue
+                    total -= self._scans.pop(scan_id)
+                    self._note_change(scan_id)
+                self.remove_scan(scan_id)
+                evicted.append(scan_id)
+
+        if evicted:
+            logger.info("Disk quota: evicted %d oldest scans (now %.1f MB of %.0f MB)",
+                        len(evicted), total / (1024 * 1024), self.quota_bytes / (1024 * 1024))
+        elif total > self.quota_bytes:
+            logger.warning("Disk usage %.1f MB is over the %.0f MB quota with no finished scans to evict",
+                           total / (1024 * 1024), self.quota_bytes / (1024 * 1024))
+        return evicted
+
+    def _finished_scans(self) -> list[tuple[float, str]]:
+        """(finish time, scan id) of scans that have ended, oldest first."""
+        with self._lock:
+            scan_ids = list(self._scans)
+        finished = []
+        for scan_id in scan_ids:
+            for marker in FINISHED_MARKERS:
+                try:
+                    finished.append((os.stat(self.results_dir / scan_id / marker).st_mtime, scan_id))
+                    break
+                except FileNotFoundError:
+                    continue
+        return sorted(finished)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.reconcile()
+                self.enforce_quota()
+            except Exception as e:
+                logger.warning("Disk usage reconcile failed: %s", e)
+            if self._stop.wait(max(self.reconcile_seconds, 1)):
+                return
+
+
+def _scandir(path: Path) -> list[os.DirEntry]:
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def _tree_size(
+    root: Path,
+    seen: Optional[set[tuple[int, int]]] = None,
+    skip: Optional[set[Path]] = None,
+) -> tuple[int, int]:
+    """(bytes, files) under ``root``; inodes in ``seen`` are counted once."""
+    total = files = 0
+    stack = [root]
+    while stack:
+        for entry in _scandir(stack.pop()):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    path = Path(entry.path)
+                    if not skip or path.resolve() not in skip:
+                        stack.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    if seen is not None and stat.st_nlink > 1:
+                        inode = (stat.st_dev, stat.st_ino)
+                        if inode in seen:
+                            continue
+                        seen.add(inode)
+                    total += stat.st_size
+                    files += 1
+            except FileNotFoundError:
+                continue  # Deleted while walking
+    return total, files
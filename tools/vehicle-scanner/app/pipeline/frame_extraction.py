@@ -4,13 +4,23 @@ from __future__ import annotations
 
 import logging
 from pathlib import Path
+from typing import Iterator
 
 import cv2
 import numpy as np
 from skimage.metrics import structural_similarity as ssim
 
-from app.config import MAX_FRAMES, SSIM_DEDUP_THRESHOLD
+from app.config import (
+    DEDUP_METHODS,
+    FRAME_DEDUP_METHOD,
+    HASH_DEDUP_MAX_DISTANCE,
+    MAX_FRAMES,
+    SSIM_DEDUP_THRESHOLD,
+    VIDEO_DECODE_QUEUE_SIZE,
+    VIDEO_SAMPLE_FPS,
+)
 from app.utils.image_utils import resize_max, save_image
+from app.utils.threaded_iter import threaded_iter
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +29,66 @@ PHOTO_EXTENSIONS = {".jpg", ".jpeg", ".png", ".heic", ".heif", ".bmp", ".tiff",
 VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi", ".webm", ".mkv"}
 
 
+class FrameDeduplicator:
+    """Decide whether a sampled frame differs enough from the last kept one.
+
+    Methods:
+    - ``ssim``: SSIM on a 640 px grayscale frame (most precise, slowest)
+    - ``ssim_small``: SSIM on a 160 px grayscale frame
+    - ``dhash`` / ``phash``: 64-bit difference / DCT perceptual hash compared
+      by Hamming distance
+    """
+
+    def __init__(
+        self,
+        method: str = FRAME_DEDUP_METHOD,
+        ssim_threshold: float = SSIM_DEDUP_THRESHOLD,
+        max_hash_distance: int = HASH_DEDUP_MAX_DISTANCE,
+    ):
+        if method not in DEDUP_METHODS:
+            raise ValueError(f"Unknown dedup method: {method}. Allowed: {', '.join(DEDUP_METHODS)}")
+        self.method = method
+        self.ssim_threshold = ssim_threshold
+        self.max_hash_distance = max_hash_distance
+        self._prev = None
+
+    def is_unique(self, frame: np.ndarray) -> bool:
+        """Return True (and remember the frame) if it is not a near-duplicate."""
+        signature = self._signature(frame)
+        if self._prev is not None and self._is_duplicate(self._prev, signature):
+            return False
+        self._prev = signature
+        return True
+
+    def _signature(self, frame: np.ndarray) -> np.ndarray:
+        if self.method == "ssim":
+            return cv2.cvtColor(resize_max(frame, 640), cv2.COLOR_BGR2GRAY)
+        if self.method == "ssim_small":
+            return cv2.cvtColor(resize_max(frame, 160), cv2.COLOR_BGR2GRAY)
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.method == "dhash":
+            small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+            return (small[:, 1:] > small[:, :-1]).ravel()
+
+        # phash: low-frequency 8x8 DCT block against its median (DC excluded)
+        small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+        low = cv2.dct(small)[:8, :8].ravel()
+        return low > np.median(low[1:])
+
+    def _is_duplicate(self, prev: np.ndarray, curr: np.ndarray) -> bool:
+        if self.method in ("dhash", "phash"):
+            return int(np.count_nonzero(prev != curr)) <= self.max_hash_distance
+
+        # Ensure same dimensions for SSIM
+        if prev.shape != curr.shape:
+            return False
+        try:
+            return ssim(prev, curr) > self.ssim_threshold
+        except Exception:
+            return False
+
+
 def extract_frames(
     input_paths: list[Path],
     output_dir: Path,
@@ -32,97 +102,105 @@ def extract_frames(
 
     Returns list of frame file paths.
     """
-    output_dir.mkdir(parents=True, exist_ok=True)
     frames: list[Path] = []
+    for frame_path in iter_frames(input_paths, output_dir):
+        frames.append(frame_path)
+        if on_progress:
+            on_progress(min(len(frames) / max(MAX_FRAMES, 1) * 100, 100))
+
+    frames = select_frames(frames)
+    logger.info("Extracted %d keyframes from %d input files", len(frames), len(input_paths))
+    return frames
+
+
+def iter_frames(input_paths: list[Path], output_dir: Path) -> Iterator[Path]:
+    """Yield keyframe paths as each one is saved, in extraction order.
+
+    Up to ``MAX_FRAMES * 2`` frames are kept per video; pass the collected
+    list through ``select_frames`` to apply the overall cap.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    count = 0
 
     for file_path in input_paths:
         ext = file_path.suffix.lower()
 
         if ext in VIDEO_EXTENSIONS:
-            video_frames = _extract_video_frames(file_path, output_dir, len(frames))
-            frames.extend(video_frames)
+            for frame_path in _iter_video_frames(file_path, output_dir, count):
+                count += 1
+                yield frame_path
         elif ext in PHOTO_EXTENSIONS:
-            frame_path = _process_photo(file_path, output_dir, len(frames))
+            frame_path = _process_photo(file_path, output_dir, count)
             if frame_path:
-                frames.append(frame_path)
+                count += 1
+                yield frame_path
 
-        if on_progress:
-            on_progress(min(len(frames) / max(MAX_FRAMES, 1) * 100, 100))
 
-    # Cap total frames
+def select_frames(frames: list[Path]) -> list[Path]:
+    """Cap the extracted frames at MAX_FRAMES, spread evenly over the input."""
     if len(frames) > MAX_FRAMES:
         indices = np.linspace(0, len(frames) - 1, MAX_FRAMES, dtype=int)
         frames = [frames[i] for i in indices]
-
-    logger.info("Extracted %d keyframes from %d input files", len(frames), len(input_paths))
     return frames
 
 
-def _extract_video_frames(
+def _iter_video_frames(
     video_path: Path, output_dir: Path, start_index: int
-) -> list[Path]:
-    """Extract unique keyframes from a video using SSIM deduplication."""
+) -> Iterator[Path]:
+    """Extract unique keyframes from a video (FRAME_DEDUP_METHOD deduplication).
+
+    A decoder thread samples the video (``grab()`` for skipped frames,
+    ``retrieve()`` only for sampled ones) into a bounded queue; this thread
+    deduplicates and saves, yielding each frame path as it is written.
+    """
     cap = cv2.VideoCapture(str(video_path))
     if not cap.isOpened():
         logger.error("Failed to open video: %s", video_path)
-        return []
+        return
 
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
 
     # Sample at ~2 fps for efficiency
-    sample_interval = max(int(fps / 2), 1)
+    sample_interval = max(int(fps / VIDEO_SAMPLE_FPS), 1)
+
+    saved = 0
+    dedup = FrameDeduplicator()
+
+    try:
+        for frame in threaded_iter(
+            _sample_video_frames(cap, sample_interval),
+            maxsize=VIDEO_DECODE_QUEUE_SIZE,
+            name="video-decode",
+        ):
+            if dedup.is_unique(frame):
+                # Save full-resolution frame
+                resized = resize_max(frame, 1920)
+                frame_path = output_dir / f"frame_{start_index + saved:04d}.jpg"
+                save_image(resized, frame_path)
+                saved += 1
+                yield frame_path
+
+                if saved >= MAX_FRAMES * 2:  # Collect extra, trim later
+                    break
+    finally:
+        # threaded_iter joins the decoder before we get here
+        cap.release()
 
-    frames: list[Path] = []
-    prev_gray = None
-    frame_idx = 0
+    logger.info("Extracted %d unique frames from video (%d total frames, %.1f fps)",
+                saved, total_frames, fps)
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        if frame_idx % sample_interval != 0:
-            frame_idx += 1
-            continue
-
-        # Resize for faster SSIM comparison
-        small = resize_max(frame, 640)
-        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
-
-        # SSIM deduplication
-        is_unique = True
-        if prev_gray is not None:
-            try:
-                # Ensure same dimensions for SSIM
-                if gray.shape == prev_gray.shape:
-                    score = ssim(prev_gray, gray)
-                    if score > SSIM_DEDUP_THRESHOLD:
-                        is_unique = False
-                else:
-                    is_unique = True
-            except Exception:
-                is_unique = True
-
-        if is_unique:
-            # Save full-resolution frame
-            resized = resize_max(frame, 1920)
-            idx = start_index + len(frames)
-            frame_path = output_dir / f"frame_{idx:04d}.jpg"
-            save_image(resized, frame_path)
-            frames.append(frame_path)
-            prev_gray = gray
-
-            if len(frames) >= MAX_FRAMES * 2:  # Collect extra, trim later
-                break
 
+def _sample_video_frames(cap: cv2.VideoCapture, sample_interval: int) -> Iterator[np.ndarray]:
+    """Yield every ``sample_interval``-th frame, decoding only those frames."""
+    frame_idx = 0
+    while cap.grab():
+        if frame_idx % sample_interval == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                yield frame
         frame_idx += 1
 
-    cap.release()
-    logger.info("Extracted %d unique frames from video (%d total frames, %.1f fps)",
-                len(frames), total_frames, fps)
-    return frames
-
 
 def _process_photo(photo_path: Path, output_dir: Path, index: int) -> Path | None:
     """Load, resize, and save a photo as a frame."""
@@ -0,0 +1,104 @@
+"""ORB frame features cached on disk per frame (``<scan>/features/frame_0000.orb.npz``).
+
+The caches live beside ``frames/`` rather than in it: frame directories are
+served to clients and copied into the result cache, the features are not.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.config import ORB_FEATURES
+from app.utils.frame_cache import FrameCache, load_frame
+from app.utils.image_utils import resize_max
+
+logger = logging.getLogger(__name__)
+
+FEATURE_SUFFIX = ".orb.npz"
+FEATURES_DIR = "features"  # Sibling of the scan's frames/ directory
+FEATURE_MAX_DIM = 640  # Frames are downscaled to this before ORB extraction
+
+
+@dataclass
+class FrameFeatures:
+    """ORB keypoint coordinates (N, 2) and binary descriptors (N, 32)."""
+
+    points: np.ndarray
+    descriptors: np.ndarray | None
+
+
+def feature_path(frame_path: Path) -> Path:
+    """Where the features of a frame are stored."""
+    return frame_path.parent.parent / FEATURES_DIR / (frame_path.stem + FEATURE_SUFFIX)
+
+
+def _legacy_feature_path(frame_path: Path) -> Path:
+    """Where older scans kept them: next to the frame, inside frames/."""
+    return frame_path.with_name(frame_path.stem + FEATURE_SUFFIX)
+
+
+def compute_frame_features(frame_path: Path, frame_cache: FrameCache | None = None) -> FrameFeatures:
+    """Extract ORB keypoints/descriptors from a downscaled grayscale frame."""
+    img = load_frame(frame_path, frame_cache)
+    gray = cv2.cvtColor(resize_max(img, FEATURE_MAX_DIM), cv2.COLOR_BGR2GRAY)
+    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
+    keypoints, descriptors = orb.detectAndCompute(gray, None)
+    points = np.array([kp.pt for kp in keypoints], dtype=np.float32).reshape(-1, 2)
+    return FrameFeatures(points=points, descriptors=descriptors)
+
+
+def save_frame_features(frame_path: Path, features: FrameFeatures) -> Path:
+    """Write features to the scan's features directory."""
+    path = feature_path(frame_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptors = features.descriptors if features.descriptors is not None else np.zeros((0, 32), np.uint8)
+    # Write via a file handle so numpy does not append its own .npz suffix
+    with open(path, "wb") as f:
+        np.savez(f, points=features.points, descriptors=descriptors)
+    return path
+
+
+def load_frame_features(frame_path: Path, frame_cache: FrameCache | None = None) -> FrameFeatures:
+    """Load cached features for a frame, extracting and saving them if missing."""
+    path = feature_path(frame_path)
+    legacy = _legacy_feature_path(frame_path)
+    if not path.exists() and legacy.exists():
+        # Move it out of the served frames directory
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(legacy, path)
+        except OSError as e:
+            logger.warning("Could not move feature cache %s: %s", legacy.name, e)
+    if path.exists():
+        try:
+            with np.load(path) as data:
+                descriptors = data["descriptors"]
+                return FrameFeatures(
+                    points=data["points"],
+                    descriptors=descriptors if len(descriptors) else None,
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Unreadable feature cache %s, recomputing: %s", path.name, e)
+
+    features = compute_frame_features(frame_path, frame_cache)
+    try:
+        save_frame_features(frame_path, features)
+    except OSError as e:
+        logger.warning("Could not cache features for %s: %s", frame_path.name, e)
+    return features
+
+
+def persist_scan_features(frame_paths: list[Path], frame_cache: FrameCache | None = None) -> int:
+    """Make sure every frame of a completed scan has cached features."""
+    written = 0
+    for frame_path in frame_paths:
+        if not feature_path(frame_path).exists():
+            load_frame_features(frame_path, frame_cache)
+            written += 1
+    return written
@@ -0,0 +1,91 @@
+"""Per-vehicle scan history, stored append-only as JSON Lines."""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+from app.config import DATA_DIR
+from app.models import DamageReport
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = DATA_DIR / "history"
+
+_append_lock = threading.Lock()
+
+
+def history_path(vehicle_id: str) -> Path:
+    """JSON Lines history file for a vehicle (one scan summary per line)."""
+    return HISTORY_DIR / f"{vehicle_id}.jsonl"
+
+
+def _legacy_history_path(vehicle_id: str) -> Path:
+    """Pre-JSONL history file (a single JSON array), still read if present."""
+    return HISTORY_DIR / f"{vehicle_id}.json"
+
+
+def append_scan_history(vehicle_id: str, scan_id: str, report: DamageReport) -> None:
+    """Append a scan summary to the vehicle's history.
+
+    Only the new line is written, so the cost does not grow with history
+    length. Each line is written with a single append call so readers never
+    see a partial entry from this process.
+    """
+    HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+
+    entry = {
+        "scan_id": scan_id,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "overall_score": report.overall_score,
+        "damage_count": len(report.items),
+        "total_damage_area_percent": report.total_damage_area_percent,
+    }
+    line = json.dumps(entry) + "\n"
+
+    try:
+        with _append_lock, open(history_path(vehicle_id), "a", encoding="utf-8") as f:
+            f.write(line)
+        logger.info("[%s] Appended scan history for vehicle %s", scan_id, vehicle_id)
+    except OSError as exc:
+        logger.error("Failed to persist scan history: %s", exc)
+
+
+def read_scan_history(vehicle_id: str) -> list[dict]:
+    """Return all scan summaries for a vehicle, sorted by timestamp ascending."""
+    scans: list[dict] = []
+
+    legacy = _legacy_history_path(vehicle_id)
+    if legacy.exists():
+        try:
+            scans.extend(json.loads(legacy.read_text()))
+        except (json.JSONDecodeError, OSError) as exc:
+            logger.warning("Could not read legacy history file %s: %s", legacy, exc)
+
+    path = history_path(vehicle_id)
+    if path.exists():
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        scans.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        logger.warning("Skipping malformed history line in %s", path)
+        except OSError as exc:
+            logger.warning("Could not read history file %s: %s", path, exc)
+
+    # Sort by timestamp ascending
+    scans.sort(key=lambda s: s.get("timestamp", ""))
+    return scans
+
+
+def last_scans(vehicle_id: str, n: int, exclude_scan_id: str | None = None) -> list[dict]:
+    """The ``n`` most recent scan summaries, newest first."""
+    scans = [s for s in read_scan_history(vehicle_id) if s.get("scan_id") != exclude_scan_id]
+    return list(reversed(scans))[:n]
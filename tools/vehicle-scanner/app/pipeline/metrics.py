@@ -0,0 +1,256 @@
+"""Per-stage pipeline metrics, Prometheus exposition and history-based ETA."""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import resource
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from app.config import DATA_DIR
+from app.models import StageMetrics
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages in execution order
+STAGES = ("extract", "preprocess", "detect", "segment", "compare", "report")
+# With PIPELINE_STREAMING, extract → segment run concurrently as one "stream" stage
+STREAMING_STAGES = ("stream", "compare", "report")
+# Stages whose duration scales with the number of frames (rates are per frame)
+PER_FRAME_STAGES = {"preprocess", "detect", "segment", "stream", "compare"}
+
+RATES_PATH = DATA_DIR / "stage_rates.json"
+_RATE_SMOOTHING = 0.2  # Weight of the newest scan in the moving average
+
+_lock = threading.Lock()
+_rates: dict[str, float] = {}  # stage → seconds (per frame for PER_FRAME_STAGES)
+_totals: dict[str, dict[str, float]] = {}  # stage → Prometheus aggregates
+_scans_total: dict[str, int] = {}  # outcome → count
+
+
+def _load_rates() -> None:
+    try:
+        _rates.update({k: float(v) for k, v in json.loads(RATES_PATH.read_text()).items()})
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable stage rate history %s: %s", RATES_PATH, e)
+
+
+_load_rates()
+
+
+def _current_rss_bytes() -> int:
+    """Resident set size of this process (Linux /proc; falls back to peak RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _RssSampler:
+    """Track the highest RSS seen while a stage runs."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak = _current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss_bytes())
+
+    def __enter__(self) -> "_RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss_bytes())
+
+
+class ScanMetrics:
+    """Collects StageMetrics for one scan and estimates its remaining time."""
+
+    def __init__(self, scan_id: str, planned: tuple[str, ...] = STAGES):
+        self.scan_id = scan_id
+        self.planned = planned  # Stages this scan will run, in order
+        self.stages: list[StageMetrics] = []
+        self.frames = 0  # Set once extraction knows the frame count
+        self._start = time.time()
+        self._current: Optional[str] = None
+        self._current_start = 0.0
+
+    @contextmanager
+    def stage(self, name: str, frames: int = 0) -> Iterator[StageMetrics]:
+        """Measure a stage. Set ``items`` on the yielded metrics inside the block.
+
+        CPU time is process-wide (it includes helper threads, and any other
+        scan running at the same time).
+        """
+        metrics = StageMetrics(stage=name, frames=frames)
+        self._current = name
+        self._current_start = time.time()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            with _RssSampler() as rss:
+                yield metrics
+        finally:
+            metrics.wall_seconds = round(time.perf_counter() - wall_start, 4)
+            metrics.cpu_seconds = round(time.process_time() - cpu_start, 4)
+            metrics.peak_rss_mb = round(rss.peak / (1024 * 1024), 1)
+            if metrics.frames and metrics.wall_seconds > 0:
+                metrics.frames_per_second = round(metrics.frames / metrics.wall_seconds, 3)
+            self.stages.append(metrics)
+            self._current = None
+            _record_stage(metrics)
+
+    def eta(self, stage_progress: float, overall_progress: float) -> Optional[float]:
+        """Seconds remaining, from historical per-stage rates.
+
+        ``stage_progress`` (0-100) is the progress within the current stage,
+        ``overall_progress`` (0-100) the scan's progress bar value.
+        Falls back to extrapolating overall elapsed time when any stage has
+        no history yet, or the frame count is still unknown.
+        """
+        if self._current is None:
+            return None
+        remaining_stages = self.planned[self.planned.index(self._current):]
+        if not self.frames and PER_FRAME_STAGES.intersection(remaining_stages):
+            return self._linear_eta(overall_progress)
+        with _lock:
+            rates = dict(_rates)
+
+        remaining = 0.0
+        for name in remaining_stages:
+            rate = rates.get(name)
+            if rate is None:
+                return self._linear_eta(overall_progress)
+            expected = rate * self.frames if name in PER_FRAME_STAGES else rate
+            if name == self._current:
+                elapsed = time.time() - self._current_start
+                if stage_progress > 0:
+                    # Blend the historical expectation with this stage's own pace
+                    observed = elapsed / (stage_progress / 100)
+                    expected = 0.5 * expected + 0.5 * observed
+                expected = max(expected - elapsed, 0.0)
+            remaining += expected
+        return remaining
+
+    def _linear_eta(self, overall_progress: float) -> Optional[float]:
+        """Extrapolate elapsed time linearly from overall progress."""
+        if overall_progress <= 0:
+            return None
+        elapsed = time.time() - self._start
+        return max(0.0, elapsed / (overall_progress / 100) - elapsed)
+
+    def save(self, path: Path) -> None:
+        """Write the per-stage timings of this scan as JSON.
+
+        Only top-level stages run one after another, so only they are summed;
+        the overlapping substages of "stream" are already in its wall time.
+        """
+        path.write_text(json.dumps({
+            "scan_id": self.scan_id,
+            "frames": self.frames,
+            "total_wall_seconds": round(sum(s.wall_seconds for s in self.stages), 4),
+            "stages": [s.model_dump() for s in self.stages],
+        }, indent=2))
+
+
+def _record_stage(metrics: StageMetrics) -> None:
+    """Update Prometheus aggregates and the moving-average stage rate.
+
+    Substages are not recorded: their busy times overlap, and the
+    sequential stages of the same name feed the ETA.
+    """
+    with _lock:
+        totals = _totals.setdefault(metrics.stage, {
+            "count": 0, "wall": 0.0, "cpu": 0.0, "frames": 0, "items": 0, "peak_rss": 0.0,
+        })
+        totals["count"] += 1
+        totals["wall"] += metrics.wall_seconds
+        totals["cpu"] += metrics.cpu_seconds
+        totals["frames"] += metrics.frames
+        totals["items"] += metrics.items
+        totals["peak_rss"] = int(metrics.peak_rss_mb * 1024 * 1024)
+
+        if metrics.stage in PER_FRAME_STAGES:
+            if not metrics.frames:
+                return
+            rate = metrics.wall_seconds / metrics.frames
+        else:
+            rate = metrics.wall_seconds
+        previous = _rates.get(metrics.stage)
+        _rates[metrics.stage] = rate if previous is None else (
+            (1 - _RATE_SMOOTHING) * previous + _RATE_SMOOTHING * rate
+        )
+
+
+def record_scan(outcome: str) -> None:
+    """Count a finished scan ("complete" or "error") and persist stage rates."""
+    with _lock:
+        _scans_total[outcome] = _scans_total.get(outcome, 0) + 1
+        rates = dict(_rates)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=str(RATES_PATH.parent), suffix=".tmp")
+        with open(fd, "w") as f:
+            json.dump(rates, f)
+        Path(tmp_path).replace(RATES_PATH)
+    except OSError as e:
+        logger.warning("Failed to persist stage rates: %s", e)
+
+
+def render_prometheus(extra_gauges: dict[str, tuple[str, float]] | None = None) -> str:
+    """Render all metrics in the Prometheus text exposition format.
+
+    ``extra_gauges`` maps metric name → (help text, value).
+    """
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples: list[tuple[str, float]]) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {value}")
+
+    with _lock:
+        totals = {k: dict(v) for k, v in _totals.items()}
+        scans = dict(_scans_total)
+        rates = dict(_rates)
+
+    def per_stage(key: str) -> list[tuple[str, float]]:
+        return [(f'{{stage="{s}"}}', t[key]) for s, t in totals.items()]
+
+    metric("scanner_scans_total", "counter", "Finished scans by outcome.",
+           [(f'{{outcome="{o}"}}', n) for o, n in scans.items()])
+    metric("scanner_stage_runs_total", "counter", "Completed runs of each pipeline stage.",
+           per_stage("count"))
+    metric("scanner_stage_wall_seconds_total", "counter", "Wall-clock time spent in each stage.",
+           per_stage("wall"))
+    metric("scanner_stage_cpu_seconds_total", "counter", "Process CPU time spent in each stage.",
+           per_stage("cpu"))
+    metric("scanner_stage_frames_total", "counter", "Frames processed by each stage.",
+           per_stage("frames"))
+    metric("scanner_stage_items_total", "counter", "Items (damages, outputs) produced by each stage.",
+           per_stage("items"))
+    metric("scanner_stage_peak_rss_bytes", "gauge", "Peak RSS during the latest run of each stage.",
+           per_stage("peak_rss"))
+    metric("scanner_stage_rate_seconds", "gauge",
+           "Moving-average stage duration (per frame for frame-scaled stages).",
+           [(f'{{stage="{s}"}}', r) for s, r in rates.items()])
+    for name, (help_text, value) in (extra_gauges or {}).items():
+        metric(name, "gauge", help_text, [("", value)])
+
+    return "\n".join(lines) + "\n"
@@ -4,50 +4,229 @@ from __future__ import annotations
 
 import json
 import logging
-import tempfile
 import time
-from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional
 
-from app.config import DATA_DIR, RESULTS_DIR, UPLOAD_DIR
+from app.config import (
+    ESRGAN_ENABLED,
+    FRAME_CACHE_MB,
+    MAX_FRAMES,
+    PIPELINE_STREAMING,
+    RESULTS_DIR,
+    SCAN_QUEUE_MAX,
+    SCAN_WORKERS,
+    UPLOAD_DIR,
+)
 from app.models import (
     ComparisonResult,
     DamageItem,
     DamageReport,
+    HistoryComparisonResult,
     ProcessedImage,
     ScanResults,
     ScanStage,
     ScanStatus,
 )
+from app.pipeline.disk_usage import DiskUsageTracker
+from app.pipeline.history import append_scan_history, last_scans
+from app.pipeline.metrics import STAGES, STREAMING_STAGES, ScanMetrics, record_scan
+from app.pipeline.scan_ownership import ScanOwnership
+from app.pipeline.scan_store import create_scan_store
+from app.pipeline.scheduler import QueueFullError, ScanScheduler
+from app.pipeline.status_stream import TERMINAL_STAGES, StatusBroadcaster
+from app.utils.frame_cache import FrameCache
 
 logger = logging.getLogger(__name__)
 
-# In-memory scan tracking (production: Redis)
-_scans: dict[str, ScanStatus] = {}
-_scan_results: dict[str, ScanResults] = {}
-_scan_damages: dict[str, list[DamageItem]] = {}
-_scan_frames: dict[str, list[Path]] = {}
+# Ordered frame filenames, kept on disk so comparisons work after store TTL
+FRAMES_INDEX = "frames.json"
+# Per-stage wall/CPU/RSS timings of a scan
+TIMINGS_FILE = "timings.json"
+
+# Streamed stages → (status while it is the earliest one running, share of the progress bar)
+_STREAM_STAGE_PROGRESS = {
+    "extract": (ScanStage.extracting, 15),
+    "preprocess": (ScanStage.preprocessing, 25),
+    "detect": (ScanStage.detecting, 20),
+    "segment": (ScanStage.segmenting, 15),
+}
+
+# Scan state (status, results, damages, frames) — backend set by SCAN_STORE_BACKEND
+_store = create_scan_store()
+
+# Bounded pool of pipeline workers shared by all scans
+scheduler = ScanScheduler(workers=SCAN_WORKERS, max_queue=SCAN_QUEUE_MAX)
+
+# Wakes SSE subscribers of a scan on every status write
+status_events = StatusBroadcaster()
+
+# Fails unfinished scans left behind by a restart or a dead replica
+scan_ownership = ScanOwnership(
+    _store,
+    on_interrupted=lambda status: _update_status(
+        status.scan_id, ScanStage.error, status.progress,
+        error="Interrupted by a restart before it finished",
+    ),
+)
+
+# Bytes on disk per scan; evicted scans also leave the state store
+disk_usage = DiskUsageTracker(on_evict=lambda scan_id: _store.delete(scan_id))
 
 
 def get_scan_status(scan_id: str) -> Optional[ScanStatus]:
-    """Get current status of a scan."""
-    return _scans.get(scan_id)
+    """Get current status of a scan.
+
+    Queued scans get their live queue position and wait/ETA estimates.
+    """
+    status = _store.get_status(scan_id)
+    if status is None or status.status != ScanStage.queued:
+        return status
+
+    position = scheduler.position(scan_id)
+    if position is None:
+        return status
+    wait = scheduler.estimate_wait(scan_id)
+    avg = scheduler.average_duration
+    return status.model_copy(update={
+        "queue_position": position,
+        "queue_wait_seconds": wait,
+        "eta_seconds": wait + avg if wait is not None and avg is not None else None,
+        "stage_description": f"Queued ({position} scan(s) ahead)",
+    })
+
+
+def submit_scan(
+    scan_id: str,
+    input_paths: list[Path],
+    vehicle_id: str | None = None,
+    make: str | None = None,
+    model: str | None = None,
+    year: int | None = None,
+    previous_scan_id: str | None = None,
+    priority: int = 0,
+    input_digests: list[str] | None = None,
+) -> int:
+    """Queue a scan for the pipeline workers and return the number of scans ahead of it.
+
+    ``input_digests`` are the upload-time content hashes of ``input_paths``
+    (used as the result cache key). Raises QueueFullError when
+    SCAN_QUEUE_MAX scans are already waiting.
+    """
+    _update_status(scan_id, ScanStage.queued, 0, "Queued")
+    scan_ownership.claim(scan_id)
+    # Released at the end of run_pipeline
+    disk_usage.acquire(scan_id, previous_scan_id)
+    try:
+        position = scheduler.submit(
+            scan_id,
+            run_pipeline,
+            scan_id, input_paths, vehicle_id, make, model, year, previous_scan_id, input_digests,
+            priority=priority,
+        )
+    except QueueFullError:
+        disk_usage.release(scan_id, previous_scan_id)
+        _store.delete(scan_id)
+        raise
+    logger.info("[%s] Queued with %d scans ahead (priority %d)", scan_id, position, priority)
+    return position
 
 
 def get_scan_results(scan_id: str) -> Optional[ScanResults]:
     """Get completed scan results."""
-    return _scan_results.get(scan_id)
+    return _store.get_results(scan_id)
 
 
 def get_scan_damages(scan_id: str) -> list[DamageItem]:
-    """Get damage items for a scan."""
-    return _scan_damages.get(scan_id, [])
+    """Get damage items for a scan.
+
+    Falls back to the saved damage report once the scan has left the store.
+    """
+    items = _store.get_damages(scan_id)
+    if items:
+        return items
+    report_path = RESULTS_DIR / scan_id / "damage_report.json"
+    if report_path.exists():
+        try:
+            return DamageReport.model_validate_json(report_path.read_text()).items
+        except (OSError, ValueError) as e:
+            logger.warning("[%s] Unreadable damage report: %s", scan_id, e)
+    return []
 
 
 def get_scan_frames(scan_id: str) -> list[Path]:
-    """Get frame paths for a scan."""
-    return _scan_frames.get(scan_id, [])
+    """Get frame paths for a scan.
+
+    Falls back to the saved frame list once the scan has left the store.
+    """
+    frames = _store.get_frames(scan_id)
+    if frames:
+        return frames
+    frames_index = RESULTS_DIR / scan_id / FRAMES_INDEX
+    if frames_index.exists():
+        try:
+            frames_dir = frames_index.parent / "frames"
+            return [frames_dir / name for name in json.loads(frames_index.read_text())]
+        except (OSError, ValueError) as e:
+            logger.warning("[%s] Unreadable frame index: %s", scan_id, e)
+    return []
+
+
+def get_scan_timings(scan_id: str) -> Optional[dict]:
+    """Get the per-stage timings written when a scan finished."""
+    timings_path = RESULTS_DIR / scan_id / TIMINGS_FILE
+    if not timings_path.exists():
+        return None
+    try:
+        return json.loads(timings_path.read_text())
+    except (OSError, ValueError) as e:
+        logger.warning("[%s] Unreadable stage timings: %s", scan_id, e)
+        return None
+
+
+def compare_with_history(
+    current_scan_id: str,
+    vehicle_id: str,
+    last_n: int,
+) -> HistoryComparisonResult:
+    """Compare a scan against the vehicle's ``last_n`` previous scans.
+
+    Uses stored (or on-disk) frames and damages and the cached per-frame
+    ORB features, so previous scans are never re-analysed.
+    """
+    from app.pipeline.comparison import PreviousScan, compare_history
+
+    entries = last_scans(vehicle_id, last_n, exclude_scan_id=current_scan_id)
+    with disk_usage.in_use(current_scan_id, *(entry["scan_id"] for entry in entries)):
+        previous = []
+        for entry in entries:
+            prev_id = entry["scan_id"]
+            frames = get_scan_frames(prev_id)
+            if not frames:
+                logger.info("[%s] Skipping history scan %s: frames no longer available",
+                            current_scan_id, prev_id)
+                continue
+            previous.append(PreviousScan(
+                scan_id=prev_id,
+                timestamp=entry.get("timestamp"),
+                frames=frames,
+                damages=get_scan_damages(prev_id),
+            ))
+
+        frame_cache = FrameCache(FRAME_CACHE_MB * 1024 * 1024)
+        try:
+            return compare_history(
+                current_frames=get_scan_frames(current_scan_id),
+                current_damages=get_scan_damages(current_scan_id),
+                previous_scans=previous,
+                output_dir=RESULTS_DIR / current_scan_id / "history",
+                current_scan_id=current_scan_id,
+                vehicle_id=vehicle_id,
+                frame_cache=frame_cache,
+            )
+        finally:
+            frame_cache.clear()
+            disk_usage.refresh_scan(current_scan_id)
 
 
 def _update_status(
@@ -58,8 +237,8 @@ def _update_status(
     eta: float | None = None,
     error: str | None = None,
 ):
-    """Update scan status in the tracking dict."""
-    _scans[scan_id] = ScanStatus(
+    """Write the latest scan status to the store and notify subscribers."""
+    status = ScanStatus(
         scan_id=scan_id,
         status=stage,
         progress=min(progress, 100.0),
@@ -67,103 +246,95 @@ def _update_status(
         eta_seconds=eta,
         error_message=error,
     )
+    _store.set_status(status)
+    if stage in TERMINAL_STAGES:
+        scan_ownership.release(scan_id)
+    status_events.publish(status)
 
 
-def run_pipeline(
+def _run_frame_stages(
     scan_id: str,
     input_paths: list[Path],
-    vehicle_id: str | None = None,
-    make: str | None = None,
-    model: str | None = None,
-    year: int | None = None,
-    previous_scan_id: str | None = None,
-) -> None:
-    """
-    Run the full 7-stage pipeline. Called in a background thread.
-
-    Stages:
-    1. Frame Extraction (0-15%)
-    2. Preprocessing / Background Removal (15-30%)
-    3. Enhancement / Upscaling (30-40%)
-    4. Damage Detection (40-60%)
-    5. Damage Segmentation (60-75%)
-    6. Change Comparison (75-85%)
-    7. Report Generation (85-100%)
-    """
-    start_time = time.time()
-    upload_dir = UPLOAD_DIR / scan_id
-    results_dir = RESULTS_DIR / scan_id
-    results_dir.mkdir(parents=True, exist_ok=True)
-
+    results_dir: Path,
+    frame_cache: FrameCache,
+    metrics: ScanMetrics,
+) -> tuple[list[Path], list[DamageItem]]:
+    """Stages 1-5, each over all frames before the next one starts."""
     frames_dir = results_dir / "frames"
 
-    try:
-        # ===== STAGE 1: Frame Extraction =====
-        _update_status(scan_id, ScanStage.extracting, 0, "Extracting keyframes from input...")
-        logger.info("[%s] Stage 1: Frame extraction", scan_id)
+    # ===== STAGE 1: Frame Extraction =====
+    _update_status(scan_id, ScanStage.extracting, 0, "Extracting keyframes from input...")
+    logger.info("[%s] Stage 1: Frame extraction", scan_id)
 
-        from app.pipeline.frame_extraction import extract_frames
+    from app.pipeline.frame_extraction import extract_frames
 
+    with metrics.stage("extract") as stage:
         frame_paths = extract_frames(
             input_paths,
             frames_dir,
             on_progress=lambda p: _update_status(
                 scan_id, ScanStage.extracting, p * 0.15,
                 f"Extracting frames ({p:.0f}%)",
-                eta=_estimate_eta(start_time, p * 0.15),
+                eta=metrics.eta(p, p * 0.15),
             ),
         )
-        _scan_frames[scan_id] = frame_paths
+        stage.frames = stage.items = len(frame_paths)
+    metrics.frames = len(frame_paths)
 
-        if not frame_paths:
-            _update_status(scan_id, ScanStage.error, 0, error="No valid frames extracted from input")
-            return
+    if not frame_paths:
+        return [], []
 
-        _update_status(scan_id, ScanStage.preprocessing, 15,
-                        f"Extracted {len(frame_paths)} keyframes")
+    _update_status(scan_id, ScanStage.preprocessing, 15,
+                    f"Extracted {len(frame_paths)} keyframes")
 
-        # ===== STAGE 2-3: Preprocessing + Enhancement =====
-        logger.info("[%s] Stage 2-3: Preprocessing (%d frames)", scan_id, len(frame_paths))
+    # ===== STAGE 2-3: Preprocessing + Enhancement =====
+    logger.info("[%s] Stage 2-3: Preprocessing (%d frames)", scan_id, len(frame_paths))
 
-        from app.pipeline.preprocessing import preprocess_frames
+    from app.pipeline.preprocessing import preprocess_frames
 
+    with metrics.stage("preprocess", frames=len(frame_paths)) as stage:
         preprocess_results = preprocess_frames(
             frame_paths,
             results_dir,
             on_progress=lambda p: _update_status(
                 scan_id, ScanStage.preprocessing, 15 + p * 0.25,
                 f"Removing backgrounds & enhancing ({p:.0f}%)",
-                eta=_estimate_eta(start_time, 15 + p * 0.25),
+                eta=metrics.eta(p, 15 + p * 0.25),
             ),
         )
+        stage.items = len(preprocess_results["showroom"])
 
-        _update_status(scan_id, ScanStage.detecting, 40, "Preprocessing complete")
+    _update_status(scan_id, ScanStage.detecting, 40, "Preprocessing complete")
 
-        # ===== STAGE 4: Damage Detection =====
-        logger.info("[%s] Stage 4: Damage detection", scan_id)
+    # ===== STAGE 4: Damage Detection =====
+    logger.info("[%s] Stage 4: Damage detection", scan_id)
 
-        from app.pipeline.detection import detect_damage
+    from app.pipeline.detection import detect_damage
 
-        detections_dir = results_dir / "detections"
+    detections_dir = results_dir / "detections"
+    with metrics.stage("detect", frames=len(frame_paths)) as stage:
         damage_items = detect_damage(
             frame_paths,
             detections_dir,
             on_progress=lambda p: _update_status(
                 scan_id, ScanStage.detecting, 40 + p * 0.20,
                 f"Analyzing for damage ({p:.0f}%)",
-                eta=_estimate_eta(start_time, 40 + p * 0.20),
+                eta=metrics.eta(p, 40 + p * 0.20),
             ),
+            frame_cache=frame_cache,
         )
-        _scan_damages[scan_id] = damage_items
+        stage.items = len(damage_items)
+    _store.set_damages(scan_id, damage_items)
 
-        _update_status(scan_id, ScanStage.segmenting, 60,
-                        f"Detected {len(damage_items)} potential damages")
+    _update_status(scan_id, ScanStage.segmenting, 60,
+                    f"Detected {len(damage_items)} potential damages")
 
-        # ===== STAGE 5: Segmentation =====
-        logger.info("[%s] Stage 5: Damage segmentation (%d items)", scan_id, len(damage_items))
+    # ===== STAGE 5: Segmentation =====
+    logger.info("[%s] Stage 5: Damage segmentation (%d items)", scan_id, len(damage_items))
 
-        from app.pipeline.segmentation import segment_damages
+    from app.pipeline.segmentation import segment_damages
 
+    with metrics.stage("segment", frames=len(frame_paths)) as stage:
         damage_items = segment_damages(
             frame_paths,
             damage_items,
@@ -171,33 +342,187 @@ def run_pipeline(
             on_progress=lambda p: _update_status(
                 scan_id, ScanStage.segmenting, 60 + p * 0.15,
                 f"Segmenting damage regions ({p:.0f}%)",
-                eta=_estimate_eta(start_time, 60 + p * 0.15),
+                eta=metrics.eta(p, 60 + p * 0.15),
             ),
+            frame_cache=frame_cache,
+        )
+        stage.items = sum(1 for d in damage_items if d.mask_url)
+
+    return frame_paths, damage_items
+
+
+def _run_streamed_frame_stages(
+    scan_id: str,
+    input_paths: list[Path],
+    results_dir: Path,
+    frame_cache: FrameCache,
+    metrics: ScanMetrics,
+) -> tuple[list[Path], list[DamageItem]]:
+    """Stages 1-5 with frames flowing through them as soon as they are ready."""
+    from app.pipeline.streaming import run_streaming_stages
+
+    _update_status(scan_id, ScanStage.extracting, 0, "Extracting keyframes from input...")
+    logger.info("[%s] Stages 1-5: Streaming frames (extract → preprocess/detect), then segment", scan_id)
+
+    with metrics.stage("stream") as stage:
+        result = run_streaming_stages(
+            input_paths,
+            results_dir,
+            frame_cache=frame_cache,
+            on_progress=lambda counts, totals: _update_stream_status(scan_id, metrics, counts, totals),
         )
-        _scan_damages[scan_id] = damage_items
+        stage.substages = result.stage_metrics
+        stage.frames = result.streamed_frames
+        stage.items = len(result.damage_items)
+    metrics.frames = len(result.frame_paths)
+
+    return result.frame_paths, result.damage_items
+
+
+def _update_stream_status(
+    scan_id: str,
+    metrics: ScanMetrics,
+    counts: dict[str, int],
+    totals: dict[str, int],
+) -> None:
+    """Report streamed progress, naming the earliest stage still running.
+
+    Each stage fills the same share of the progress bar as in a sequential
+    run; until a stage's frame count is known, MAX_FRAMES stands in for it.
+    """
+    if "extract" in totals:
+        metrics.frames = totals["extract"]
+
+    progress = 0.0
+    current = None
+    for stage, (scan_stage, share) in _STREAM_STAGE_PROGRESS.items():
+        total = totals.get(stage)
+        finished = total is not None and counts[stage] >= total
+        if total is None:
+            total = max(counts["extract"], MAX_FRAMES)
+        progress += share * (1.0 if finished else counts[stage] / max(total, 1))
+        if current is None and not finished:
+            current = scan_stage
+
+    _update_status(
+        scan_id, current or ScanStage.segmenting, progress,
+        f"Streaming frames — {counts['extract']} extracted, {counts['preprocess']} preprocessed, "
+        f"{counts['detect']} analyzed, {counts['segment']} segmented",
+        eta=metrics.eta(progress / 75 * 100, progress),
+    )
+
+
+def run_pipeline(
+    scan_id: str,
+    input_paths: list[Path],
+    vehicle_id: str | None = None,
+    make: str | None = None,
+    model: str | None = None,
+    year: int | None = None,
+    previous_scan_id: str | None = None,
+    input_digests: list[str] | None = None,
+) -> None:
+    """
+    Run the full 7-stage pipeline. Called in a background thread.
+
+    Stages:
+    1. Frame Extraction (0-15%)
+    2. Preprocessing / Background Removal (15-30%)
+    3. Enhancement (30-40%) — upscaling itself is deferred to on-demand renders
+    4. Damage Detection (40-60%)
+    5. Damage Segmentation (60-75%)
+    6. Change Comparison (75-85%)
+    7. Report Generation (85-100%)
+
+    With PIPELINE_STREAMING, stages 1-4 run concurrently with frames
+    streamed between them and stage 5 follows (see ``streaming.py``); each
+    keeps its band of the progress bar.
+
+    If the same inputs were scanned before with the same models and
+    settings, stages 1-5 are restored from the result cache instead.
+
+    Per-stage wall/CPU time, peak RSS and throughput are recorded in
+    ``ScanResults.stage_metrics`` and ``timings.json``, and feed the ETA.
+    """
+    start_time = time.time()
+    upload_dir = UPLOAD_DIR / scan_id
+    results_dir = RESULTS_DIR / scan_id
+    results_dir.mkdir(parents=True, exist_ok=True)
+
+    # Each frame is decoded once and shared by detection, segmentation,
+    # comparison and reporting
+    frame_cache = FrameCache(FRAME_CACHE_MB * 1024 * 1024)
+
+    stages = STREAMING_STAGES if PIPELINE_STREAMING else STAGES
+    planned = stages if previous_scan_id else tuple(s for s in stages if s != "compare")
+    metrics = ScanMetrics(scan_id, planned)
+    outcome = "error"
+
+    try:
+        from app.pipeline import result_cache
+
+        cache_key = None
+        cached = None
+        if result_cache.enabled():
+            try:
+                cache_key = result_cache.scan_key(input_paths, input_digests)
+                cached = result_cache.restore_scan(cache_key, results_dir)
+            except OSError as e:
+                logger.warning("[%s] Result cache lookup failed: %s", scan_id, e)
+
+        if cached is not None:
+            logger.info("[%s] Stages 1-5: reusing cached results of identical input", scan_id)
+            frame_paths, damage_items = cached
+            metrics.frames = len(frame_paths)
+            _update_status(scan_id, ScanStage.segmenting, 75,
+                            f"Reused results of an identical earlier upload ({len(frame_paths)} frames)")
+        elif PIPELINE_STREAMING:
+            frame_paths, damage_items = _run_streamed_frame_stages(
+                scan_id, input_paths, results_dir, frame_cache, metrics,
+            )
+        else:
+            frame_paths, damage_items = _run_frame_stages(
+                scan_id, input_paths, results_dir, frame_cache, metrics,
+            )
+        _store.set_frames(scan_id, frame_paths)
+        (results_dir / FRAMES_INDEX).write_text(json.dumps([p.name for p in frame_paths]))
+
+        if not frame_paths:
+            _update_status(scan_id, ScanStage.error, 0, error="No valid frames extracted from input")
+            return
+        _store.set_damages(scan_id, damage_items)
+
+        if cache_key and cached is None:
+            try:
+                result_cache.store_scan(cache_key, results_dir, frame_paths, damage_items)
+            except Exception as e:
+                logger.warning("[%s] Failed to cache scan results: %s", scan_id, e)
 
         # ===== STAGE 6: Comparison (optional) =====
         comparison: ComparisonResult | None = None
-        if previous_scan_id and previous_scan_id in _scan_frames:
+        prev_frames = get_scan_frames(previous_scan_id) if previous_scan_id else []
+        if prev_frames:
             logger.info("[%s] Stage 6: Comparing with previous scan %s", scan_id, previous_scan_id)
             _update_status(scan_id, ScanStage.comparing, 75, "Comparing with previous scan...")
 
             from app.pipeline.comparison import compare_scans
 
-            prev_frames = _scan_frames[previous_scan_id]
-            prev_damages = _scan_damages.get(previous_scan_id, [])
+            prev_damages = get_scan_damages(previous_scan_id)
             comparison_dir = results_dir / "comparison"
 
-            comparison = compare_scans(
-                current_frames=frame_paths,
-                previous_frames=prev_frames,
-                current_damages=damage_items,
-                previous_damages=prev_damages,
-                output_dir=comparison_dir,
-                current_scan_id=scan_id,
-                previous_scan_id=previous_scan_id,
-                vehicle_id=vehicle_id,
-            )
+            with metrics.stage("compare", frames=len(frame_paths)) as stage:
+                comparison = compare_scans(
+                    current_frames=frame_paths,
+                    previous_frames=prev_frames,
+                    current_damages=damage_items,
+                    previous_damages=prev_damages,
+                    output_dir=comparison_dir,
+                    current_scan_id=scan_id,
+                    previous_scan_id=previous_scan_id,
+                    vehicle_id=vehicle_id,
+                    frame_cache=frame_cache,
+                )
+                stage.items = len(comparison.matches)
         else:
             _update_status(scan_id, ScanStage.comparing, 85, "No previous scan to compare")
 
@@ -207,21 +532,24 @@ def run_pipeline(
 
         from app.pipeline.report import generate_report
 
-        damage_report = generate_report(
-            scan_id=scan_id,
-            vehicle_id=vehicle_id,
-            make=make,
-            model=model,
-            year=year,
-            frame_paths=frame_paths,
-            damage_items=damage_items,
-            results_dir=results_dir,
-            on_progress=lambda p: _update_status(
-                scan_id, ScanStage.reporting, 85 + p * 0.15,
-                f"Generating report ({p:.0f}%)",
-                eta=_estimate_eta(start_time, 85 + p * 0.15),
-            ),
-        )
+        with metrics.stage("report", frames=len(frame_paths)) as stage:
+            damage_report = generate_report(
+                scan_id=scan_id,
+                vehicle_id=vehicle_id,
+                make=make,
+                model=model,
+                year=year,
+                frame_paths=frame_paths,
+                damage_items=damage_items,
+                results_dir=results_dir,
+                on_progress=lambda p: _update_status(
+                    scan_id, ScanStage.reporting, 85 + p * 0.15,
+                    f"Generating report ({p:.0f}%)",
+                    eta=metrics.eta(p, 85 + p * 0.15),
+                ),
+                frame_cache=frame_cache,
+            )
+            stage.items = len(damage_report.items)
 
         # ===== Build final results =====
         processed_images = []
@@ -232,10 +560,17 @@ def run_pipeline(
             processed_url = original_url
 
             # Check for showroom image
+            render_stem = frame_path.stem
             showroom_path = results_dir / "showroom" / f"{frame_path.stem}_nobg_showroom.jpg"
             if showroom_path.exists():
                 processed_url = f"/scan/{scan_id}/showroom/{showroom_path.name}"
                 showroom_images.append(processed_url)
+                render_stem = showroom_path.stem
+
+            # Upscaled renders are produced lazily when first requested
+            upscaled_url = (
+                f"/scan/{scan_id}/upscaled/{render_stem}_upscaled.jpg" if ESRGAN_ENABLED else None
+            )
 
             thumb_path = results_dir / "thumbnails" / f"{frame_path.stem}_thumb.jpg"
             thumb_url = f"/scan/{scan_id}/thumbnails/{thumb_path.name}" if thumb_path.exists() else None
@@ -245,6 +580,7 @@ def run_pipeline(
                 original_url=original_url,
                 processed_url=processed_url,
                 thumbnail_url=thumb_url,
+                upscaled_url=upscaled_url,
             ))
 
         scan_results = ScanResults(
@@ -253,13 +589,24 @@ def run_pipeline(
             damage_report=damage_report,
             processed_images=processed_images,
             showroom_images=showroom_images,
+            stage_metrics=metrics.stages,
+            timings_url=f"/scan/{scan_id}/timings",
         )
-        _scan_results[scan_id] = scan_results
+        _store.set_results(scan_results)
+
+        # ===== Cache frame features for future comparisons =====
+        from app.pipeline.frame_features import persist_scan_features
+
+        try:
+            persist_scan_features(frame_paths, frame_cache)
+        except Exception as e:
+            logger.warning("[%s] Failed to cache frame features: %s", scan_id, e)
 
         # ===== Persist scan history =====
         if vehicle_id:
-            _persist_scan_history(vehicle_id, scan_id, damage_report)
+            append_scan_history(vehicle_id, scan_id, damage_report)
 
+        outcome = "complete"
         elapsed = time.time() - start_time
         _update_status(scan_id, ScanStage.complete, 100,
                         f"Scan complete — {len(damage_items)} damages found ({elapsed:.1f}s)")
@@ -272,66 +619,26 @@ def run_pipeline(
         logger.exception("[%s] Pipeline failed: %s", scan_id, e)
         _update_status(scan_id, ScanStage.error, 0, error=str(e))
 
+    finally:
+        frame_cache.clear()
 
-def _persist_scan_history(
-    vehicle_id: str, scan_id: str, report: DamageReport
-) -> None:
-    """Append a scan summary to the vehicle's JSON history file.
-
-    Uses an atomic-write pattern (write to temp file then rename) so that
-    concurrent readers never see a partially written file.
-    """
-    history_dir = DATA_DIR / "history"
-    history_dir.mkdir(parents=True, exist_ok=True)
-
-    history_path = history_dir / f"{vehicle_id}.json"
-
-    # Read existing history
-    scans: list[dict] = []
-    if history_path.exists():
         try:
-            scans = json.loads(history_path.read_text())
-        except (json.JSONDecodeError, OSError) as exc:
-            logger.warning(
-                "Could not read history file %s, starting fresh: %s",
-                history_path,
-                exc,
-            )
-            scans = []
-
-    # Append new entry
-    entry = {
-        "scan_id": scan_id,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "overall_score": report.overall_score,
-        "damage_count": len(report.items),
-        "total_damage_area_percent": report.total_damage_area_percent,
-    }
-    scans.append(entry)
-
-    # Atomic write: write to a temp file in the same directory then rename
-    try:
-        fd, tmp_path = tempfile.mkstemp(
-            dir=str(history_dir), suffix=".tmp", prefix=f"{vehicle_id}_"
-        )
-        with open(fd, "w") as f:
-            json.dump(scans, f, indent=2)
-        Path(tmp_path).replace(history_path)
-        logger.info(
-            "[%s] Persisted scan history for vehicle %s (%d total scans)",
-            scan_id,
-            vehicle_id,
-            len(scans),
-        )
-    except OSError as exc:
-        logger.error("Failed to persist scan history: %s", exc)
+            metrics.save(results_dir / TIMINGS_FILE)
+        except OSError as e:
+            logger.warning("[%s] Failed to write stage timings: %s", scan_id, e)
+        record_scan(outcome)
 
+        try:
+            # Acquired in submit_scan
+            disk_usage.release(scan_id, previous_scan_id)
+            disk_usage.refresh_scan(scan_id)
+            disk_usage.enforce_quota()
+        except Exception as e:
+            logger.warning("[%s] Disk usage update failed: %s", scan_id, e)
+
+        # Opportunistic TTL eviction (Redis expires keys on its own)
+        try:
+            _store.purge_expired()
+        except Exception as e:
+            logger.warning("Scan state purge failed: %s", e)
 
-def _estimate_eta(start_time: float, progress: float) -> float | None:
-    """Estimate remaining time based on elapsed time and progress."""
-    if progress <= 0:
-        return None
-    elapsed = time.time() - start_time
-    total_estimated = elapsed / (progress / 100)
-    remaining = total_estimated - elapsed
-    return max(0, remaining)
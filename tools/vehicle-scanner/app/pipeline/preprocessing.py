@@ -3,32 +3,54 @@
 from __future__ import annotations
 
 import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import Any, Optional
 
 import cv2
 import numpy as np
 from PIL import Image
 
+from app.config import ESRGAN_SCALE, ORT_INTRA_OP_THREADS, PREPROCESS_WORKERS
 from app.utils.image_utils import (
     composite_on_studio_bg,
     create_thumbnail,
+    resize_max,
     save_image,
     to_pil,
 )
-from app.utils.model_loader import load_esrgan
+from app.utils.model_loader import esrgan_max_input_pixels, load_esrgan, load_rembg
 
 logger = logging.getLogger(__name__)
 
+# Shared worker pool (created on first use, reused across scans)
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
 
-def remove_background(frame_path: Path, output_dir: Path) -> Path:
-    """Remove background from a vehicle image using rembg (U2-Net)."""
+# On-demand upscaling: one model call at a time, one computation per render
+_esrgan_lock = threading.Lock()
+_render_locks: dict[str, threading.Lock] = {}
+_render_locks_guard = threading.Lock()
+
+
+def remove_background(frame_path: Path, output_dir: Path, session: Any = None) -> Path:
+    """Remove background from a vehicle image using rembg (U2-Net).
+
+    Uses the cached session from ``load_rembg()`` unless ``session`` is given.
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
 
     try:
         from rembg import remove
 
+        if session is None:
+            session = load_rembg()
         input_img = Image.open(frame_path)
-        result = remove(input_img)  # Returns RGBA PIL Image
+        result = remove(input_img, session=session)  # Returns RGBA PIL Image
 
         output_path = output_dir / f"{frame_path.stem}_nobg.png"
         result.save(str(output_path))
@@ -59,85 +81,252 @@ def create_showroom_image(nobg_path: Path, output_dir: Path) -> Path:
     return output_path
 
 
+class UpscaleError(Exception):
+    """Raised when a render cannot be upscaled (model unavailable or failed)."""
+
+
 def upscale_image(image_path: Path, output_dir: Path) -> Path:
-    """Upscale image using Real-ESRGAN if available."""
-    output_dir.mkdir(parents=True, exist_ok=True)
+    """Upscale image using Real-ESRGAN.
 
+    Raises UpscaleError if the model is unavailable or fails; nothing is
+    written in that case, so a later request can try again.
+    """
     esrgan = load_esrgan()
     if esrgan is None:
-        # No upscaling available — just copy
-        output_path = output_dir / f"{image_path.stem}_upscaled.jpg"
-        img = cv2.imread(str(image_path))
-        save_image(img, output_path)
-        return output_path
+        raise UpscaleError("Real-ESRGAN is not available")
+
+    img = cv2.imread(str(image_path), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise UpscaleError(f"Failed to load image: {image_path.name}")
 
     try:
-        img = cv2.imread(str(image_path), cv2.IMREAD_UNCHANGED)
-        output, _ = esrgan.enhance(img, outscale=4)
-        output_path = output_dir / f"{image_path.stem}_upscaled.jpg"
-        save_image(output, output_path)
-        logger.debug("Upscaled: %s", output_path.name)
-        return output_path
+        # Keep the upscaled output buffer within ESRGAN_MAX_MEMORY_MB
+        max_pixels = esrgan_max_input_pixels()
+        h, w = img.shape[:2]
+        if h * w > max_pixels:
+            img = resize_max(img, int(max(h, w) * (max_pixels / (h * w)) ** 0.5))
+            logger.info("Downscaled %s to %dx%d before upscaling (memory ceiling)",
+                        image_path.name, img.shape[1], img.shape[0])
+
+        # The shared model is tiled per call; serialise calls so peak memory
+        # stays at one tile working set
+        with _esrgan_lock:
+            output, _ = esrgan.enhance(img, outscale=ESRGAN_SCALE)
     except Exception as e:
         logger.error("Upscaling failed for %s: %s", image_path.name, e)
-        output_path = output_dir / f"{image_path.stem}_upscaled.jpg"
-        img = cv2.imread(str(image_path))
-        save_image(img, output_path)
+        raise UpscaleError(f"Upscaling failed for {image_path.name}: {e}") from e
+
+    # Write-then-rename so a cached render is never a partial file
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / f"{image_path.stem}_upscaled.jpg"
+    tmp_path = output_dir / f".{image_path.stem}_upscaled.tmp.jpg"
+    if not cv2.imwrite(str(tmp_path), output):
+        tmp_path.unlink(missing_ok=True)
+        raise UpscaleError(f"Failed to write upscaled render: {output_path.name}")
+    os.replace(tmp_path, output_path)
+    logger.debug("Upscaled: %s", output_path.name)
+    return output_path
+
+
+def get_upscaled_render(results_dir: Path, filename: str) -> Path | None:
+    """Return an upscaled render, creating and caching it on first request.
+
+    ``filename`` is ``{stem}_upscaled.jpg`` where ``{stem}`` names a showroom
+    image or an extracted frame of the scan. Returns None if the source does
+    not exist and raises UpscaleError if upscaling fails (nothing is cached,
+    so the next request retries). Concurrent requests for the same render
+    compute it once.
+    """
+    upscaled_dir = results_dir / "upscaled"
+    output_path = upscaled_dir / filename
+    if output_path.exists():
         return output_path
 
+    stem = filename.removesuffix("_upscaled.jpg")
+    if stem == filename:
+        return None
+    source = next(
+        (p for p in (results_dir / "showroom" / f"{stem}.jpg", results_dir / "frames" / f"{stem}.jpg")
+         if p.exists()),
+        None,
+    )
+    if source is None:
+        return None
+
+    with _render_locks_guard:
+        lock = _render_locks.setdefault(str(output_path), threading.Lock())
+    try:
+        with lock:
+            if not output_path.exists():
+                upscale_image(source, upscaled_dir)
+    finally:
+        with _render_locks_guard:
+            _render_locks.pop(str(output_path), None)
+    return output_path
+
 
 def preprocess_frames(
     frame_paths: list[Path],
     output_dir: Path,
     on_progress: callable = None,
+    workers: int = PREPROCESS_WORKERS,
 ) -> dict:
     """
     Run preprocessing on all frames:
     1. Background removal
     2. Showroom composite
-    3. Upscaling (if enabled)
-    4. Thumbnails
+    3. Thumbnails
+
+    Upscaling is not part of the scan: renders are upscaled on demand by
+    ``get_upscaled_render``.
+
+    Frames are spread over a process pool (``workers`` processes, each with
+    its own rembg session). Results are collected in frame order regardless
+    of completion order; ``workers <= 1`` runs everything inline.
 
     Returns dict with paths to processed outputs.
     """
-    nobg_dir = output_dir / "nobg"
-    showroom_dir = output_dir / "showroom"
-    upscaled_dir = output_dir / "upscaled"
-    thumb_dir = output_dir / "thumbnails"
+    total = len(frame_paths)
+    per_frame: list[dict | None] = [None] * total
+
+    done = 0
+    pending = list(range(total))
+    if workers > 1 and total > 1:
+        try:
+            pool = _get_pool(workers)
+            futures = {
+                pool.submit(_preprocess_frame, frame_paths[i], output_dir): i
+                for i in pending
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                per_frame[i] = future.result()
+                pending.remove(i)
+                done += 1
+                if on_progress:
+                    on_progress(done / total * 100)
+        except BrokenProcessPool:
+            logger.error("Preprocessing pool crashed — finishing %d frames inline", len(pending))
+            _reset_pool()
+
+    for i in list(pending):
+        per_frame[i] = _preprocess_frame(frame_paths[i], output_dir)
+        done += 1
+        if on_progress:
+            on_progress(done / total * 100)
+
+    return merge_preprocess_results(per_frame)
+
 
+def submit_frame(
+    frame_path: Path, output_dir: Path, workers: int = PREPROCESS_WORKERS
+) -> Future:
+    """Queue one frame on the shared pool; runs it inline when ``workers <= 1``.
+
+    Pass the future to ``frame_result`` to collect it.
+    """
+    if workers > 1:
+        try:
+            return _get_pool(workers).submit(_preprocess_frame, frame_path, output_dir)
+        except BrokenProcessPool:
+            _reset_pool()
+
+    future: Future = Future()
+    try:
+        future.set_result(_preprocess_frame(frame_path, output_dir))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def frame_result(future: Future, frame_path: Path, output_dir: Path) -> dict[str, Path | None]:
+    """Wait for a ``submit_frame`` future, redoing the frame inline if the pool crashed."""
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        logger.error("Preprocessing pool crashed — finishing %s inline", frame_path.name)
+        _reset_pool()
+        return _preprocess_frame(frame_path, output_dir)
+
+
+def merge_preprocess_results(per_frame: list[dict[str, Path | None]]) -> dict:
+    """Combine per-frame outputs (in frame order) into lists per output kind."""
     results = {
         "nobg": [],
         "showroom": [],
-        "upscaled": [],
         "thumbnails": [],
     }
-
-    total = len(frame_paths)
-    for i, frame_path in enumerate(frame_paths):
-        # Background removal
-        nobg_path = remove_background(frame_path, nobg_dir)
-        results["nobg"].append(nobg_path)
-
-        # Showroom composite
-        showroom_path = create_showroom_image(nobg_path, showroom_dir)
-        results["showroom"].append(showroom_path)
-
-        # Upscale (Phase 2)
-        upscaled_path = upscale_image(frame_path, upscaled_dir)
-        results["upscaled"].append(upscaled_path)
-
-        # Thumbnail
-        thumb_dir.mkdir(parents=True, exist_ok=True)
-        img = cv2.imread(str(frame_path))
-        if img is not None:
-            thumb = create_thumbnail(img, 256)
-            thumb_path = thumb_dir / f"{frame_path.stem}_thumb.jpg"
-            save_image(thumb, thumb_path)
-            results["thumbnails"].append(thumb_path)
-
-        if on_progress:
-            on_progress((i + 1) / total * 100)
+    for outputs in per_frame:
+        for key, path in outputs.items():
+            if path is not None:
+                results[key].append(path)
 
     logger.info("Preprocessed %d frames: %d showroom, %d thumbnails",
-                total, len(results["showroom"]), len(results["thumbnails"]))
+                len(per_frame), len(results["showroom"]), len(results["thumbnails"]))
     return results
+
+
+def _preprocess_frame(frame_path: Path, output_dir: Path) -> dict[str, Path | None]:
+    """Run all preprocessing steps for a single frame."""
+    nobg_dir = output_dir / "nobg"
+    showroom_dir = output_dir / "showroom"
+    thumb_dir = output_dir / "thumbnails"
+
+    # Background removal
+    nobg_path = remove_background(frame_path, nobg_dir)
+
+    # Showroom composite
+    showroom_path = create_showroom_image(nobg_path, showroom_dir)
+
+    # Thumbnail
+    thumb_path = None
+    thumb_dir.mkdir(parents=True, exist_ok=True)
+    img = cv2.imread(str(frame_path))
+    if img is not None:
+        thumb = create_thumbnail(img, 256)
+        thumb_path = thumb_dir / f"{frame_path.stem}_thumb.jpg"
+        save_image(thumb, thumb_path)
+
+    return {
+        "nobg": nobg_path,
+        "showroom": showroom_path,
+        "thumbnails": thumb_path,
+    }
+
+
+def _init_worker(intra_op_threads: int) -> None:
+    """Process-pool initializer: load this worker's rembg session once."""
+    load_rembg(intra_op_threads)
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Return the shared preprocessing pool, creating it on first use.
+
+    Uses the ``spawn`` start method so workers never inherit CUDA or ONNX
+    Runtime state from the API process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            logger.info("Starting preprocessing pool with %d workers", workers)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(ORT_INTRA_OP_THREADS or max((os.cpu_count() or 1) // workers, 1),),
+            )
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """Stop the preprocessing worker processes (called on API shutdown)."""
+    _reset_pool()
+
+
+def _reset_pool() -> None:
+    """Drop the pool so the next scan starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -12,7 +12,8 @@ import numpy as np
 
 from app.models import DamageItem, DamageReport, SeverityLevel
 from app.pipeline.segmentation import create_damage_overlay
-from app.utils.image_utils import load_image, save_image
+from app.utils.frame_cache import FrameCache, load_frame
+from app.utils.image_utils import save_image
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +35,7 @@ def generate_report(
     damage_items: list[DamageItem],
     results_dir: Path,
     on_progress: callable = None,
+    frame_cache: FrameCache | None = None,
 ) -> DamageReport:
     """
     Generate the final damage report with:
@@ -58,7 +60,7 @@ def generate_report(
     annotated_url = None
     if frame_paths:
         annotated_path = _create_annotated_composite(
-            frame_paths, damage_items, masks_dir, results_dir, scan_id
+            frame_paths, damage_items, masks_dir, results_dir, scan_id, frame_cache
         )
         if annotated_path:
             annotated_url = f"/scan/{scan_id}/annotated.jpg"
@@ -94,6 +96,7 @@ def _create_annotated_composite(
     masks_dir: Path,
     output_dir: Path,
     scan_id: str,
+    frame_cache: FrameCache | None = None,
 ) -> Path | None:
     """Create a composite annotated image showing all damage detections."""
     if not frame_paths:
@@ -101,7 +104,7 @@ def _create_annotated_composite(
 
     # Use the first frame as the primary annotated image
     primary_frame = frame_paths[0]
-    img = load_image(primary_frame)
+    img = load_frame(primary_frame, frame_cache)
     if img is None:
         return None
 
@@ -145,7 +148,8 @@ def _create_annotated_composite(
 
     # --- Also create a multi-frame grid if multiple frames ---
     if len(frame_paths) > 1:
-        _create_multi_frame_grid(frame_paths, damage_items, masks_dir, output_dir)
+        _create_multi_frame_grid(frame_paths, damage_items, masks_dir, output_dir,
+                                 frame_cache=frame_cache)
 
     return output_path
 
@@ -157,6 +161,7 @@ def _create_multi_frame_grid(
     output_dir: Path,
     max_cols: int = 3,
     thumb_size: int = 480,
+    frame_cache: FrameCache | None = None,
 ):
     """Create a grid of annotated frames."""
     n = min(len(frame_paths), 9)  # Max 3x3 grid
@@ -165,7 +170,7 @@ def _create_multi_frame_grid(
 
     thumbs = []
     for i in range(n):
-        img = load_image(frame_paths[i])
+        img = load_frame(frame_paths[i], frame_cache)
         if img is None:
             continue
 
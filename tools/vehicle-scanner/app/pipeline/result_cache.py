@@ -0,0 +1,354 @@
+"""Content-addressed cache of scan results, for inputs that are uploaded again.
+
+Two kinds of entries live under RESULT_CACHE_DIR:
+
+- ``scans/<key>/`` — the frame, preprocessing, detection and mask artifacts
+  plus the final damage items of a scan, keyed on the input file digests.
+  A hit lets a repeated upload skip stages 1-5 entirely.
+- ``frames/<key>.json`` — raw detections of one frame, keyed on its pixels,
+  so a scan that shares only some frames with earlier ones reruns detection
+  on the new frames alone.
+
+Keys include a fingerprint of the models and of every setting that changes
+the output, so changing either misses instead of serving stale results.
+Entries are evicted least-recently-used first once the cache grows past
+RESULT_CACHE_MB.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.config import (
+    ANOMALY_MAX_SIDE,
+    FINE_TUNED_DAMAGE_CLASSES,
+    FINE_TUNED_INT8_MODEL_PATH,
+    FINE_TUNED_MODEL_PATH,
+    FRAME_DEDUP_METHOD,
+    HASH_DEDUP_MAX_DISTANCE,
+    MAX_FRAMES,
+    MODELS_DIR,
+    REMBG_MODEL,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MB,
+    SAM_ENABLED,
+    SAM_MODEL,
+    SEVERITY_THRESHOLDS,
+    SSIM_DEDUP_THRESHOLD,
+    UPLOAD_HASH_ALGORITHM,
+    VIDEO_SAMPLE_FPS,
+    YOLO_BACKEND,
+    YOLO_CONF_THRESHOLD,
+    YOLO_EXPORT_IMGSZ,
+    YOLO_FINE_TUNED,
+    YOLO_IOU_THRESHOLD,
+    YOLO_MODEL,
+)
+from app.models import DamageItem
+
+logger = logging.getLogger(__name__)
+
+# Bump when the pipeline's output changes for the same input and settings
+CACHE_VERSION = 3
+
+# Scan artifacts reused on a hit; comparison, history and renders are per scan
+SCAN_ARTIFACT_DIRS = ("frames", "nobg", "showroom", "thumbnails", "detections", "masks")
+
+_SCAN_ITEMS = "items.json"
+
+_evict_lock = threading.Lock()
+_usage_bytes: Optional[int] = None  # Estimated cache size, computed on first store
+
+
+def enabled() -> bool:
+    return RESULT_CACHE_MB > 0
+
+
+# --- Keys ---
+
+
+def _file_identity(name: str) -> str:
+    """Name, size and mtime of a model file, or just the name if not on disk."""
+    for path in (Path(name), MODELS_DIR / name):
+        if path.is_file():
+            stat = path.stat()
+            return f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}"
+    return name
+
+
+@lru_cache(maxsize=1)
+def detection_fingerprint() -> str:
+    """Hash of the detection model and the settings that shape its output."""
+    if YOLO_FINE_TUNED and FINE_TUNED_MODEL_PATH.exists():
+        weights = str(FINE_TUNED_MODEL_PATH)
+    else:
+        weights = YOLO_MODEL
+    if YOLO_BACKEND == "onnx_int8":
+        weights = str(FINE_TUNED_INT8_MODEL_PATH)
+    settings = {
+        "version": CACHE_VERSION,
+        "weights": _file_identity(weights),
+        "backend": YOLO_BACKEND,
+        "imgsz": YOLO_EXPORT_IMGSZ,
+        "fine_tuned": YOLO_FINE_TUNED,
+        "conf": YOLO_CONF_THRESHOLD,
+        "iou": YOLO_IOU_THRESHOLD,
+        "anomaly_max_side": ANOMALY_MAX_SIDE,
+        "severity": SEVERITY_THRESHOLDS,
+        "classes": FINE_TUNED_DAMAGE_CLASSES,
+    }
+    return _hash_json(settings)
+
+
+@lru_cache(maxsize=1)
+def scan_fingerprint() -> str:
+    """Hash of everything besides the inputs that determines stages 1-5."""
+    settings = {
+        "detection": detection_fingerprint(),
+        "max_frames": MAX_FRAMES,
+        "ssim_threshold": SSIM_DEDUP_THRESHOLD,
+        "dedup_method": FRAME_DEDUP_METHOD,
+        "hash_distance": HASH_DEDUP_MAX_DISTANCE,
+        "sample_fps": VIDEO_SAMPLE_FPS,
+        "rembg": REMBG_MODEL,
+        "sam": SAM_MODEL if SAM_ENABLED else None,
+    }
+    return _hash_json(settings)
+
+
+def scan_key(input_paths: list[Path], digests: list[str] | None = None) -> str:
+    """Key of a scan: its input contents (in upload order) and the fingerprint.
+
+    ``digests`` are the upload-time hex digests (UPLOAD_HASH_ALGORITHM) of
+    ``input_paths``; files are hashed here when they are not given.
+    """
+    if digests is None or len(digests) != len(input_paths):
+        algorithm = "sha256"
+        digests = []
+        for path in input_paths:
+            with open(path, "rb") as f:
+                digests.append(hashlib.file_digest(f, algorithm).hexdigest())
+    else:
+        algorithm = UPLOAD_HASH_ALGORITHM
+    return _hash_json({
+        "inputs": [f"{algorithm}:{d}:{p.suffix.lower()}" for p, d in zip(input_paths, digests)],
+        "fingerprint": scan_fingerprint(),
+    })
+
+
+def frame_key(img: np.ndarray) -> str:
+    """Key of one decoded frame's detections: its pixels and the model fingerprint."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(img.shape).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    digest.update(detection_fingerprint().encode())
+    return digest.hexdigest()
+
+
+def _hash_json(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# --- Whole scans ---
+
+
+def restore_scan(key: str, results_dir: Path) -> Optional[tuple[list[Path], list[DamageItem]]]:
+    """Link a cached scan's artifacts into ``results_dir``.
+
+    Returns (frame paths, damage items) on a hit, None on a miss.
+    """
+    if not enabled():
+        return None
+    entry = RESULT_CACHE_DIR / "scans" / key
+    try:
+        data = json.loads((entry / _SCAN_ITEMS).read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Dropping unreadable scan cache entry %s: %s", key[:12], e)
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+
+    try:
+        for name in SCAN_ARTIFACT_DIRS:
+            if (entry / name).is_dir():
+                _link_tree(entry / name, results_dir / name)
+    except OSError as e:
+        logger.warning("Failed to restore scan cache entry %s: %s", key[:12], e)
+        return None
+
+    _touch(entry)
+    frame_paths = [results_dir / "frames" / name for name in data["frames"]]
+    items = [DamageItem.model_validate(item) for item in data["items"]]
+    return frame_paths, items
+
+
+def store_scan(
+    key: str,
+    results_dir: Path,
+    frame_paths: list[Path],
+    damage_items: list[DamageItem],
+) -> None:
+    """Save a finished scan's stage 1-5 artifacts under ``key``."""
+    if not enabled():
+        return
+    entry = RESULT_CACHE_DIR / "scans" / key
+    if entry.exists():
+        _touch(entry)
+        return
+
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=entry.parent, prefix=".tmp-"))
+    try:
+        for name in SCAN_ARTIFACT_DIRS:
+            if (results_dir / name).is_dir():
+                _link_tree(results_dir / name, tmp / name)
+        (tmp / _SCAN_ITEMS).write_text(json.dumps({
+            "frames": [p.name for p in frame_paths],
+            "items": [item.model_dump(mode="json") for item in damage_items],
+        }))
+        size = _tree_size(tmp)
+        os.rename(tmp, entry)
+    except OSError as e:
+        # Another worker may have stored the same scan first
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not entry.exists():
+            logger.warning("Failed to cache scan results: %s", e)
+        return
+
+    logger.info("Cached scan results %s (%.1f MB)", key[:12], size / (1024 * 1024))
+    _account(size)
+
+
+# --- Per-frame detections ---
+
+
+def load_frame_detections(key: str, frame_idx: int) -> Optional[list[DamageItem]]:
+    """Cached raw detections of a frame, with fresh ids and ``frame_idx``."""
+    if not enabled():
+        return None
+    path = _frame_entry(key)
+    try:
+        raw = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Dropping unreadable detection cache entry %s: %s", key[:12], e)
+        path.unlink(missing_ok=True)
+        return None
+
+    _touch(path)
+    return [
+        DamageItem.model_validate({**item, "id": str(uuid.uuid4())[:8], "frame_index": frame_idx})
+        for item in raw
+    ]
+
+
+def store_frame_detections(key: str, items: list[DamageItem]) -> None:
+    """Save the raw (pre-dedup, unsegmented) detections of a frame."""
+    if not enabled():
+        return
+    path = _frame_entry(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = json.dumps([item.model_dump(mode="json", exclude={"id", "frame_index"}) for item in items])
+    try:
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with open(fd, "w") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Failed to cache frame detections: %s", e)
+        return
+    _account(len(payload))
+
+
+def _frame_entry(key: str) -> Path:
+    return RESULT_CACHE_DIR / "frames" / key[:2] / f"{key}.json"
+
+
+# --- Disk LRU ---
+
+
+def _touch(path: Path) -> None:
+    """Mark an entry as recently used (its mtime orders eviction)."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _account(added_bytes: int) -> None:
+    """Track cache growth and evict once it passes RESULT_CACHE_MB."""
+    global _usage_bytes
+    with _evict_lock:
+        if _usage_bytes is None:
+            _usage_bytes = sum(size for _, size, _ in _entries())
+        else:
+            _usage_bytes += added_bytes
+        if _usage_bytes > RESULT_CACHE_MB * 1024 * 1024:
+            _usage_bytes = _evict(int(RESULT_CACHE_MB * 1024 * 1024 * 0.9))
+
+
+def _entries() -> list[tuple[float, int, Path]]:
+    """Every cache entry as (last use, size in bytes, path)."""
+    entries = []
+    scans_dir = RESULT_CACHE_DIR / "scans"
+    if scans_dir.is_dir():
+        for entry in scans_dir.iterdir():
+            if entry.is_dir() and not entry.name.startswith(".tmp-"):
+                entries.append((entry.stat().st_mtime, _tree_size(entry), entry))
+    frames_dir = RESULT_CACHE_DIR / "frames"
+    if frames_dir.is_dir():
+        for path in frames_dir.glob("*/*.json"):
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _evict(target_bytes: int) -> int:
+    """Delete least recently used entries until the cache fits; returns the new size."""
+    entries = sorted(_entries())
+    usage = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in entries:
+        if usage <= target_bytes:
+            break
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        usage -= size
+        evicted += 1
+    if evicted:
+        logger.info("Result cache: evicted %d entries (now %.1f MB)", evicted, usage / (1024 * 1024))
+    return usage
+
+
+def _tree_size(root: Path) -> int:
+    return sum(f.stat().st_size for f in root.rglob("*") if f.is_file())
+
+
+def _link_tree(src: Path, dst: Path) -> None:
+    """Hard-link every file of ``src`` into ``dst`` (copying across filesystems)."""
+    dst.mkdir(parents=True, exist_ok=True)
+    for path in src.iterdir():
+        if path.is_file():
+            target = dst / path.name
+            if target.exists():
+                continue
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
@@ -0,0 +1,98 @@
+"""Fail scans whose owning process died before they finished.
+
+Queued and running scans live only in their process's scheduler, so a
+restart (or a replica that went away) leaves them ``queued``/``processing``
+in a persistent store until the TTL. Each unfinished scan records its
+owner instance; every instance refreshes a heartbeat lease in the store.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, Optional
+
+from app.config import SCAN_INSTANCE_ID, SCAN_OWNER_LEASE_SECONDS
+from app.models import ScanStatus
+from app.pipeline.scan_store import ScanStore
+from app.pipeline.status_stream import TERMINAL_STAGES
+
+logger = logging.getLogger(__name__)
+
+
+class ScanOwnership:
+    """Claims this instance's scans and fails the ones nobody can finish.
+
+    On ``start`` every unfinished scan owned by this instance is failed
+    (nothing queued before a restart survives it). A background thread then
+    refreshes this instance's heartbeat every third of the lease and fails
+    the unfinished scans of instances whose heartbeat has lapsed.
+    ``on_interrupted`` receives the last status of each failed scan.
+    """
+
+    def __init__(
+        self,
+        store: ScanStore,
+        on_interrupted: Callable[[ScanStatus], None],
+        instance_id: str = SCAN_INSTANCE_ID,
+        lease_seconds: float = SCAN_OWNER_LEASE_SECONDS,
+    ):
+        self.store = store
+        self.on_interrupted = on_interrupted
+        self.instance_id = instance_id
+        self.lease_seconds = max(lease_seconds, 3)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Fail this instance's leftover scans and start the heartbeat (idempotent)."""
+        if self._thread is not None:
+            return
+        self.store.heartbeat(self.instance_id, self.lease_seconds)
+        self.fail_interrupted(include_own=True)
+        self._thread = threading.Thread(target=self._run, name="scan-heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def claim(self, scan_id: str) -> None:
+        self.store.set_owner(scan_id, self.instance_id)
+
+    def release(self, scan_id: str) -> None:
+        self.store.clear_owner(scan_id)
+
+    def fail_interrupted(self, include_own: bool = False) -> list[str]:
+        """Fail unfinished scans of dead instances (and this one's, if asked).
+
+        Returns the ids of the scans marked as failed.
+        """
+        alive: dict[str, bool] = {}
+        failed = []
+        for scan_id, owner in self.store.owned_scans().items():
+            if owner == self.instance_id:
+                if not include_own:
+                    continue
+            else:
+                if owner not in alive:
+                    alive[owner] = self.store.is_alive(owner)
+                if alive[owner]:
+                    continue
+
+            status = self.store.get_status(scan_id)
+            if status is not None and status.status not in TERMINAL_STAGES:
+                self.on_interrupted(status)
+                failed.append(scan_id)
+            self.store.clear_owner(scan_id)
+
+        if failed:
+            logger.warning("Failed %d scans interrupted by a restart", len(failed))
+        return failed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.store.heartbeat(self.instance_id, self.lease_seconds)
+                self.fail_interrupted()
+            except Exception as e:
+                logger.warning("Scan heartbeat failed: %s", e)
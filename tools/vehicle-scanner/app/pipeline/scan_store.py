@@ -0,0 +1,295 @@
+"""Scan state storage — status, results, damages and frame paths per scan.
+
+Backends share one interface so the orchestrator does not care where state
+lives: ``memory`` (single process), ``sqlite`` (survives restarts, one host)
+and ``redis`` (shared between replicas). Every record expires after a TTL.
+
+Unfinished scans also record the instance that owns them, and instances
+keep a heartbeat record alive, so scans whose process died can be failed
+(see ``scan_ownership.py``).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+from pydantic import TypeAdapter
+
+from app.config import SCAN_STATE_TTL_SECONDS, SCAN_STORE_BACKEND, SCAN_STORE_URL
+from app.models import DamageItem, ScanResults, ScanStatus
+
+logger = logging.getLogger(__name__)
+
+_damage_list = TypeAdapter(list[DamageItem])
+
+# Record kinds stored per scan
+STATUS = "status"
+RESULTS = "results"
+DAMAGES = "damages"
+FRAMES = "frames"
+OWNER = "owner"  # Instance running the scan, while it is queued or running
+HEARTBEAT = "heartbeat"  # Per instance, under ``_instance_key``; expires with its lease
+
+
+def _instance_key(instance_id: str) -> str:
+    return f"instance:{instance_id}"
+
+
+class ScanStore(ABC):
+    """Key/value store of serialized scan state, keyed by (scan_id, kind)."""
+
+    def __init__(self, ttl_seconds: float = SCAN_STATE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+
+    # --- Backend primitives ---
+
+    @abstractmethod
+    def _get(self, scan_id: str, kind: str) -> Optional[str]:
+        """Return the stored JSON for (scan_id, kind), or None if missing/expired."""
+
+    @abstractmethod
+    def _set(self, scan_id: str, kind: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        """Store JSON for (scan_id, kind), resetting its TTL (default: the store's)."""
+
+    @abstractmethod
+    def _delete(self, scan_id: str, kind: str) -> None:
+        """Remove one record."""
+
+    @abstractmethod
+    def _scan_ids(self, kind: str) -> list[str]:
+        """Ids of all scans with an unexpired record of ``kind``."""
+
+    @abstractmethod
+    def delete(self, scan_id: str) -> None:
+        """Remove every record for a scan."""
+
+    def purge_expired(self) -> int:
+        """Drop expired records; returns how many were removed (if known)."""
+        return 0
+
+    # --- Typed accessors ---
+
+    def get_status(self, scan_id: str) -> Optional[ScanStatus]:
+        raw = self._get(scan_id, STATUS)
+        return ScanStatus.model_validate_json(raw) if raw else None
+
+    def set_status(self, status: ScanStatus) -> None:
+        self._set(status.scan_id, STATUS, status.model_dump_json())
+
+    def get_results(self, scan_id: str) -> Optional[ScanResults]:
+        raw = self._get(scan_id, RESULTS)
+        return ScanResults.model_validate_json(raw) if raw else None
+
+    def set_results(self, results: ScanResults) -> None:
+        self._set(results.scan_id, RESULTS, results.model_dump_json())
+
+    def get_damages(self, scan_id: str) -> list[DamageItem]:
+        raw = self._get(scan_id, DAMAGES)
+        return _damage_list.validate_json(raw) if raw else []
+
+    def set_damages(self, scan_id: str, items: list[DamageItem]) -> None:
+        self._set(scan_id, DAMAGES, _damage_list.dump_json(items).decode())
+
+    def get_frames(self, scan_id: str) -> list[Path]:
+        raw = self._get(scan_id, FRAMES)
+        return [Path(p) for p in json.loads(raw)] if raw else []
+
+    def set_frames(self, scan_id: str, frames: list[Path]) -> None:
+        self._set(scan_id, FRAMES, json.dumps([str(p) for p in frames]))
+
+    # --- Ownership of unfinished scans ---
+
+    def set_owner(self, scan_id: str, instance_id: str) -> None:
+        self._set(scan_id, OWNER, instance_id)
+
+    def clear_owner(self, scan_id: str) -> None:
+        self._delete(scan_id, OWNER)
+
+    def owned_scans(self) -> dict[str, str]:
+        """Scan id → owning instance, for every scan that has an owner."""
+        owners = {}
+        for scan_id in self._scan_ids(OWNER):
+            owner = self._get(scan_id, OWNER)
+            if owner is not None:
+                owners[scan_id] = owner
+        return owners
+
+    def heartbeat(self, instance_id: str, lease_seconds: float) -> None:
+        """Mark ``instance_id`` alive for the next ``lease_seconds``."""
+        self._set(_instance_key(instance_id), HEARTBEAT, str(time.time()), ttl_seconds=lease_seconds)
+
+    def is_alive(self, instance_id: str) -> bool:
+        return self._get(_instance_key(instance_id), HEARTBEAT) is not None
+
+
+class MemoryScanStore(ScanStore):
+    """Process-local store (state is lost on restart)."""
+
+    def __init__(self, ttl_seconds: float = SCAN_STATE_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self._data: dict[tuple[str, str], tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, scan_id: str, kind: str) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get((scan_id, kind))
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[(scan_id, kind)]
+                return None
+            return value
+
+    def _set(self, scan_id: str, kind: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[(scan_id, kind)] = (time.time() + (ttl_seconds or self.ttl_seconds), value)
+
+    def _delete(self, scan_id: str, kind: str) -> None:
+        with self._lock:
+            self._data.pop((scan_id, kind), None)
+
+    def _scan_ids(self, kind: str) -> list[str]:
+        now = time.time()
+        with self._lock:
+            return [k[0] for k, (expires_at, _) in self._data.items()
+                    if k[1] == kind and expires_at >= now]
+
+    def delete(self, scan_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._data if k[0] == scan_id]:
+                del self._data[key]
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (expires_at, _) in self._data.items() if expires_at < now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+
+class SQLiteScanStore(ScanStore):
+    """Single-file SQLite store (WAL mode); survives restarts on one host."""
+
+    def __init__(self, path: Path, ttl_seconds: float = SCAN_STATE_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scan_state ("
+                " scan_id TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " PRIMARY KEY (scan_id, kind))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS scan_state_expires ON scan_state (expires_at)"
+            )
+
+    def _get(self, scan_id: str, kind: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM scan_state WHERE scan_id = ? AND kind = ? AND expires_at >= ?",
+                (scan_id, kind, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, scan_id: str, kind: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO scan_state (scan_id, kind, value, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (scan_id, kind) DO UPDATE SET "
+                "value = excluded.value, expires_at = excluded.expires_at",
+                (scan_id, kind, value, time.time() + (ttl_seconds or self.ttl_seconds)),
+            )
+
+    def _delete(self, scan_id: str, kind: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM scan_state WHERE scan_id = ? AND kind = ?", (scan_id, kind)
+            )
+
+    def _scan_ids(self, kind: str) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT scan_id FROM scan_state WHERE kind = ? AND expires_at >= ?",
+                (kind, time.time()),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, scan_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM scan_state WHERE scan_id = ?", (scan_id,))
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM scan_state WHERE expires_at < ?", (time.time(),))
+        return cur.rowcount
+
+
+class RedisScanStore(ScanStore):
+    """Redis store shared by all replicas; TTL is enforced by Redis itself."""
+
+    def __init__(self, url: str, ttl_seconds: float = SCAN_STATE_TTL_SECONDS, client=None):
+        super().__init__(ttl_seconds)
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self._redis = client
+
+    @staticmethod
+    def _key(scan_id: str, kind: str) -> str:
+        return f"scan:{scan_id}:{kind}"
+
+    def _get(self, scan_id: str, kind: str) -> Optional[str]:
+        value = self._redis.get(self._key(scan_id, kind))
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    def _set(self, scan_id: str, kind: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        self._redis.set(self._key(scan_id, kind), value, ex=max(int(ttl_seconds or self.ttl_seconds), 1))
+
+    def _delete(self, scan_id: str, kind: str) -> None:
+        self._redis.delete(self._key(scan_id, kind))
+
+    def _scan_ids(self, kind: str) -> list[str]:
+        ids = []
+        for key in self._redis.scan_iter(match=self._key("*", kind), count=500):
+            if isinstance(key, bytes):
+                key = key.decode()
+            ids.append(key[len("scan:"):-len(f":{kind}")])
+        return ids
+
+    def delete(self, scan_id: str) -> None:
+        self._redis.delete(*(self._key(scan_id, k) for k in (STATUS, RESULTS, DAMAGES, FRAMES, OWNER)))
+
+
+def create_scan_store(
+    backend: str = SCAN_STORE_BACKEND, url: str = SCAN_STORE_URL
+) -> ScanStore:
+    """Build the configured scan store backend."""
+    if backend == "memory":
+        store = MemoryScanStore()
+    elif backend == "sqlite":
+        store = SQLiteScanStore(Path(url))
+    elif backend == "redis":
+        store = RedisScanStore(url)
+    else:
+        raise ValueError(f"Unknown SCAN_STORE_BACKEND: {backend}. Allowed: memory, sqlite, redis")
+    logger.info("Scan state store: %s", backend)
+    return store
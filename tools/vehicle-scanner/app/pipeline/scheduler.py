@@ -0,0 +1,125 @@
+"""Bounded scan scheduler — a fixed pool of pipeline workers behind a priority queue."""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a scan is submitted while the queue is at capacity."""
+
+
+class ScanScheduler:
+    """Run scan jobs on ``workers`` threads, at most ``max_queue`` waiting.
+
+    Jobs are ordered by priority (lower runs first), then FIFO. Average job
+    duration is tracked so queued scans can be given a wait-time estimate.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = max(workers, 1)
+        self.max_queue = max(max_queue, 0)
+        self._queue: list[tuple[int, int, str, Callable[..., Any], tuple]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running: set[str] = set()
+        self._avg_duration: Optional[float] = None
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start the worker threads (idempotent)."""
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"scan-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        logger.info("Scan scheduler started: %d workers, queue limit %d", self.workers, self.max_queue)
+
+    def is_full(self) -> bool:
+        """Return True if a new submission would be rejected."""
+        with self._cond:
+            return len(self._queue) >= self.max_queue
+
+    def submit(self, scan_id: str, fn: Callable[..., Any], *args: Any, priority: int = 0) -> int:
+        """Queue ``fn(*args)`` and return its 0-based queue position.
+
+        Raises QueueFullError if ``max_queue`` scans are already waiting.
+        """
+        self.start()
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(f"Scan queue is full ({self.max_queue} waiting)")
+            heapq.heappush(self._queue, (priority, next(self._seq), scan_id, fn, args))
+            self._cond.notify()
+            return self._position_locked(scan_id)
+
+    def position(self, scan_id: str) -> Optional[int]:
+        """Number of scans ahead of ``scan_id``, or None if it is not queued."""
+        with self._cond:
+            return self._position_locked(scan_id)
+
+    def estimate_wait(self, scan_id: str) -> Optional[float]:
+        """Estimated seconds until ``scan_id`` starts, once a duration is known."""
+        with self._cond:
+            ahead = self._position_locked(scan_id)
+            if ahead is None or self._avg_duration is None:
+                return None
+            # Running jobs are assumed to be half done on average
+            busy = ahead + 0.5 * len(self._running)
+            if ahead == 0 and len(self._running) < self.workers:
+                return 0.0
+            return busy / self.workers * self._avg_duration
+
+    @property
+    def queued(self) -> int:
+        """Number of scans waiting for a worker."""
+        with self._cond:
+            return len(self._queue)
+
+    @property
+    def running(self) -> int:
+        """Number of scans currently running."""
+        with self._cond:
+            return len(self._running)
+
+    @property
+    def average_duration(self) -> Optional[float]:
+        """Exponential moving average of job run time in seconds."""
+        return self._avg_duration
+
+    def _position_locked(self, scan_id: str) -> Optional[int]:
+        for position, entry in enumerate(sorted(self._queue)):
+            if entry[2] == scan_id:
+                return position
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, scan_id, fn, args = heapq.heappop(self._queue)
+                self._running.add(scan_id)
+
+            start = time.time()
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("[%s] Scan job raised", scan_id)
+            finally:
+                elapsed = time.time() - start
+                with self._cond:
+                    self._running.discard(scan_id)
+                    self._avg_duration = (
+                        elapsed if self._avg_duration is None
+                        else 0.8 * self._avg_duration + 0.2 * elapsed
+                    )
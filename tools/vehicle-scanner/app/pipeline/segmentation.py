@@ -3,54 +3,90 @@
 from __future__ import annotations
 
 import logging
+import threading
+from collections import defaultdict
 from pathlib import Path
 
 import cv2
 import numpy as np
 
 from app.models import DamageItem
-from app.utils.image_utils import load_image, save_image
+from app.utils.frame_cache import FrameCache, load_frame
+from app.utils.image_utils import save_image
 from app.utils.model_loader import load_sam2
 
 logger = logging.getLogger(__name__)
 
+_sam_lock = threading.Lock()
+
 
 def segment_damages(
     frame_paths: list[Path],
     damage_items: list[DamageItem],
     output_dir: Path,
     on_progress: callable = None,
+    frame_cache: FrameCache | None = None,
 ) -> list[DamageItem]:
     """
     Generate pixel-precise masks for each damage detection.
 
-    If SAM2 is available: uses point prompts at bbox centers to generate masks.
+    If SAM2 is available: encodes each frame once and prompts all of its
+    detections together (bbox + bbox-center point) to generate masks.
     Fallback: uses YOLO bounding boxes as approximate rectangular masks.
 
+    Frames are read through ``frame_cache`` when one is given.
+
     Updates each DamageItem with mask_url and area_percent.
     Returns the updated items.
     """
-    masks_dir = output_dir / "masks"
-    masks_dir.mkdir(parents=True, exist_ok=True)
-
     sam_predictor = load_sam2()
     total = len(damage_items)
 
-    for i, item in enumerate(damage_items):
-        # Get the frame this detection belongs to
-        frame_idx = item.frame_index
-        if frame_idx >= len(frame_paths):
-            continue
+    # Group items by frame so each frame is decoded and encoded only once
+    items_by_frame: dict[int, list[DamageItem]] = defaultdict(list)
+    for item in damage_items:
+        if item.frame_index < len(frame_paths):
+            items_by_frame[item.frame_index].append(item)
 
-        frame_path = frame_paths[frame_idx]
-        img = load_image(frame_path)
-        h, w = img.shape[:2]
+    done = 0
+    for frame_idx in sorted(items_by_frame):
+        items = items_by_frame[frame_idx]
+        segment_frame(frame_paths[frame_idx], items, output_dir, frame_cache)
 
-        if sam_predictor is not None:
-            mask = _segment_with_sam2(sam_predictor, img, item)
-        else:
-            mask = _segment_with_bbox(img, item)
+        done += len(items)
+        if on_progress:
+            on_progress(done / max(total, 1) * 100)
 
+    logger.info("Segmented %d damage items in %d frames (%s)",
+                total, len(items_by_frame), "SAM2" if sam_predictor else "bbox fallback")
+    return damage_items
+
+
+def segment_frame(
+    frame_path: Path,
+    items: list[DamageItem],
+    output_dir: Path,
+    frame_cache: FrameCache | None = None,
+) -> None:
+    """Mask every damage item of one frame and save the masks.
+
+    Sets ``mask_url`` and ``area_percent`` on each item in place.
+    """
+    if not items:
+        return
+    masks_dir = output_dir / "masks"
+    masks_dir.mkdir(parents=True, exist_ok=True)
+
+    sam_predictor = load_sam2()
+    img = load_frame(frame_path, frame_cache)
+    h, w = img.shape[:2]
+
+    if sam_predictor is not None:
+        masks = _segment_frame_with_sam2(sam_predictor, img, items)
+    else:
+        masks = [_segment_with_bbox(img, item) for item in items]
+
+    for item, mask in zip(items, masks):
         if mask is not None:
             # Save mask
             mask_path = masks_dir / f"mask_{item.id}.png"
@@ -63,48 +99,65 @@ def segment_damages(
             total_pixels = h * w
             item.area_percent = round((mask_pixels / total_pixels) * 100, 3)
 
-        if on_progress:
-            on_progress((i + 1) / max(total, 1) * 100)
-
-    logger.info("Segmented %d damage items (%s)",
-                total, "SAM2" if sam_predictor else "bbox fallback")
-    return damage_items
 
+def _segment_frame_with_sam2(
+    predictor, img: np.ndarray, items: list[DamageItem]
+) -> list[np.ndarray | None]:
+    """Use SAM2 to mask every item of one frame from a single image embedding.
 
-def _segment_with_sam2(predictor, img: np.ndarray, item: DamageItem) -> np.ndarray | None:
-    """Use SAM2 to generate a precise mask from bbox center point."""
-    try:
-        # Convert BGR to RGB for SAM2
-        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        predictor.set_image(rgb)
-
-        # Use bbox center as point prompt
-        cx = (item.bbox.x1 + item.bbox.x2) / 2
-        cy = (item.bbox.y1 + item.bbox.y2) / 2
-        input_point = np.array([[cx, cy]])
-        input_label = np.array([1])  # Foreground
-
-        # Also use bbox as box prompt for better results
-        input_box = np.array([item.bbox.x1, item.bbox.y1, item.bbox.x2, item.bbox.y2])
-
-        masks, scores, _ = predictor.predict(
-            point_coords=input_point,
-            point_labels=input_label,
-            box=input_box,
-            multimask_output=True,
-        )
-
-        # Take the highest-scoring mask
-        best_idx = np.argmax(scores)
-        mask = masks[best_idx]
-
-        # Convert boolean mask to uint8 image
-        mask_img = (mask * 255).astype(np.uint8)
-        return mask_img
-
-    except Exception as e:
-        logger.warning("SAM2 segmentation failed for item %s: %s — falling back to bbox", item.id, e)
-        return _segment_with_bbox(img, item)
+    The image encoder runs once (``set_image``); all items are then prompted
+    together with their bbox plus bbox-center point. Falls back to one
+    prompt at a time if batched prediction fails, and to bbox masks if SAM2
+    fails entirely.
+    """
+    # Use bbox center as point prompt, and the bbox as box prompt
+    boxes = np.array([[it.bbox.x1, it.bbox.y1, it.bbox.x2, it.bbox.y2] for it in items])
+    points = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+
+    # The predictor holds the current image embedding, so concurrent scans
+    # must not interleave set_image/predict calls
+    with _sam_lock:
+        try:
+            # Convert BGR to RGB for SAM2
+            predictor.set_image(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        except Exception as e:
+            logger.warning("SAM2 image encoding failed: %s — falling back to bbox", e)
+            return [_segment_with_bbox(img, item) for item in items]
+
+        try:
+            masks, scores, _ = predictor.predict(
+                point_coords=points[:, None, :],
+                point_labels=np.ones((len(items), 1)),  # Foreground
+                box=boxes,
+                multimask_output=True,
+            )
+            masks = np.asarray(masks).reshape(len(items), -1, *img.shape[:2])
+            scores = np.asarray(scores).reshape(len(items), -1)
+            return [_best_mask(m, sc) for m, sc in zip(masks, scores)]
+        except Exception as e:
+            logger.debug("Batched SAM2 prompts failed (%s) — prompting per item", e)
+
+        results: list[np.ndarray | None] = []
+        for item, point, box in zip(items, points, boxes):
+            try:
+                masks, scores, _ = predictor.predict(
+                    point_coords=point[None, :],
+                    point_labels=np.array([1]),
+                    box=box,
+                    multimask_output=True,
+                )
+                results.append(_best_mask(masks, scores))
+            except Exception as e:
+                logger.warning("SAM2 segmentation failed for item %s: %s — falling back to bbox",
+                               item.id, e)
+                results.append(_segment_with_bbox(img, item))
+        return results
+
+
+def _best_mask(masks: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    """Take the highest-scoring mask and convert it to a uint8 image."""
+    mask = masks[int(np.argmax(scores))]
+    return (mask * 255).astype(np.uint8)
 
 
 def _segment_with_bbox(img: np.ndarray, item: DamageItem) -> np.ndarray | None:
@@ -0,0 +1,149 @@
+"""Push scan status changes to server-sent event clients, coalesced and throttled."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+from app.config import (
+    STATUS_PUSH_INTERVAL_SECONDS,
+    STATUS_PUSH_MIN_PROGRESS,
+    STATUS_STREAM_POLL_SECONDS,
+)
+from app.models import ScanStage, ScanStatus
+
+TERMINAL_STAGES = (ScanStage.complete, ScanStage.error)
+
+
+class _Subscriber:
+    """One client's view of a scan: only the newest status is kept."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.latest: Optional[ScanStatus] = None
+        self._event = asyncio.Event()
+
+    def push(self, status: ScanStatus) -> None:
+        """Called from any thread; replaces whatever has not been sent yet."""
+        self.latest = status
+        try:
+            self.loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass  # Event loop already closed
+
+    async def wait(self, timeout: float) -> Optional[ScanStatus]:
+        """The newest pushed status, or None if nothing arrived in time."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._event.clear()
+        return self.latest
+
+
+class StatusBroadcaster:
+    """Fans status updates out to the subscribers of each scan in this process.
+
+    ``publish`` is cheap and safe to call from pipeline threads: it only
+    overwrites each subscriber's pending status and wakes its event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, set[_Subscriber]] = {}
+
+    def publish(self, status: ScanStatus) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(status.scan_id, ()))
+        for subscriber in subscribers:
+            subscriber.push(status)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    @contextmanager
+    def subscribe(self, scan_id: str) -> Iterator[_Subscriber]:
+        """Register a subscriber for ``scan_id``; must run inside an event loop."""
+        subscriber = _Subscriber()
+        with self._lock:
+            self._subscribers.setdefault(scan_id, set()).add(subscriber)
+        try:
+            yield subscriber
+        finally:
+            with self._lock:
+                subs = self._subscribers.get(scan_id)
+                if subs is not None:
+                    subs.discard(subscriber)
+                    if not subs:
+                        del self._subscribers[scan_id]
+
+
+async def stream_status(
+    broadcaster: StatusBroadcaster,
+    scan_id: str,
+    get_status: Callable[[str], Optional[ScanStatus]],
+    keepalive: float = 15.0,
+) -> AsyncIterator[Optional[ScanStatus]]:
+    """Yield a scan's status as it changes, until it completes or fails.
+
+    The current status is yielded first. After that a status is yielded when
+    the stage changes straight away, and otherwise at most once every
+    STATUS_PUSH_INTERVAL_SECONDS and only once progress has moved by
+    STATUS_PUSH_MIN_PROGRESS points (or the queue position changed); ticks
+    in between are coalesced into the next one. Pushes from this process
+    wake the stream immediately; the store is also re-read every
+    STATUS_STREAM_POLL_SECONDS so scans running on other replicas are
+    followed too. None is yielded after ``keepalive`` seconds without an
+    update so callers can ping the client.
+    """
+    with broadcaster.subscribe(scan_id) as subscriber:
+        sent = get_status(scan_id)
+        if sent is None:
+            return
+        yield sent
+        sent_at = wrote_at = time.monotonic()
+        pending: Optional[ScanStatus] = None
+
+        while sent.status not in TERMINAL_STAGES:
+            now = time.monotonic()
+            if pending is not None:
+                # Hold a throttled update until its interval is up
+                timeout = max(sent_at + STATUS_PUSH_INTERVAL_SECONDS - now, 0.0)
+            else:
+                timeout = min(STATUS_STREAM_POLL_SECONDS, max(wrote_at + keepalive - now, 0.0))
+
+            status = await subscriber.wait(timeout)
+            if status is None or status.status == ScanStage.queued:
+                # Nothing pushed (or a queued scan, whose position is computed
+                # on read): fall back to the store
+                status = get_status(scan_id)
+                if status is None and pending is None:
+                    return  # Scan state expired or was deleted
+
+            if status is not None and (pending is not None or _is_update(sent, status)):
+                pending = status
+            now = time.monotonic()
+            if pending is not None and (
+                pending.status != sent.status
+                or now - sent_at >= STATUS_PUSH_INTERVAL_SECONDS
+            ):
+                sent, pending = pending, None
+                sent_at = wrote_at = now
+                yield sent
+            elif now - wrote_at >= keepalive:
+                wrote_at = now
+                yield None
+
+
+def _is_update(sent: ScanStatus, status: ScanStatus) -> bool:
+    """Whether ``status`` is worth sending after ``sent``."""
+    return (
+        status.status != sent.status
+        or status.queue_position != sent.queue_position
+        or abs(status.progress - sent.progress) >= STATUS_PUSH_MIN_PROGRESS
+    )
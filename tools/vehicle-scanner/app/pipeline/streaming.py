@@ -0,0 +1,377 @@
+"""Streamed frame stages: extract → preprocess / detect, frame by frame, then segment.
+
+Each extracted frame is handed to preprocessing and detection as soon as it
+is saved, through bounded queues. Stages run in their own threads, so
+extraction, preprocessing and detection take roughly as long as the slowest
+of them instead of the sum. Only frames that can survive the MAX_FRAMES cap
+enter the stages. Segmentation needs the cross-frame detection dedup, so it
+runs once the stream has drained, on the surviving items only.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from app.config import MAX_FRAMES, PREPROCESS_WORKERS, STREAM_QUEUE_SIZE, YOLO_BATCH_SIZE
+from app.models import DamageItem, StageMetrics
+from app.utils.frame_cache import FrameCache, load_frame
+
+logger = logging.getLogger(__name__)
+
+# Per-frame stages, in pipeline order (segment runs after the stream)
+STREAMED_STAGES = ("extract", "preprocess", "detect", "segment")
+
+_DONE = object()
+
+
+@dataclass
+class StreamResult:
+    frame_paths: list[Path]  # After the MAX_FRAMES cap, renumbered from 0
+    damage_items: list[DamageItem]  # Deduplicated, with masks
+    preprocess_results: dict
+    streamed_frames: int  # Frames that went through preprocessing and detection
+    stage_metrics: list[StageMetrics]  # Busy time per stage (stages overlap)
+
+
+def run_streaming_stages(
+    input_paths: list[Path],
+    results_dir: Path,
+    frame_cache: FrameCache | None = None,
+    on_progress: Optional[Callable[[dict[str, int], dict[str, int]], None]] = None,
+    queue_size: int = STREAM_QUEUE_SIZE,
+) -> StreamResult:
+    """Run extraction, preprocessing and detection as a stream, then segmentation.
+
+    ``on_progress(counts, totals)`` receives the number of frames each stage
+    has finished and, once known, the number each stage will handle; calls
+    are serialised.
+
+    The first MAX_FRAMES extracted frames are streamed straight away: with
+    no more than that, the cap keeps them all. Once extraction goes past
+    MAX_FRAMES, later frames are held back and only those ``select_frames``
+    keeps are streamed after extraction ends; the few early frames the cap
+    then drops are the only wasted work, and their outputs are removed.
+    Segmentation runs after the cap and dedup, on the frames whose items
+    survived.
+    """
+    from app.pipeline.detection import detect_batch
+    from app.pipeline.frame_extraction import iter_frames, select_frames
+    from app.pipeline.preprocessing import frame_result, submit_frame
+
+    frames_dir = results_dir / "frames"
+    detections_dir = results_dir / "detections"
+    detections_dir.mkdir(parents=True, exist_ok=True)
+
+    abort = threading.Event()
+    preprocess_q: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+    detect_q: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+
+    extracted: list[Path] = []
+    streamed: list[int] = []  # Positions in ``extracted`` sent down the stages
+    preprocessed: dict[int, dict] = {}
+    detected: dict[int, list[DamageItem]] = {}
+
+    counts = {stage: 0 for stage in STREAMED_STAGES}
+    totals: dict[str, int] = {}
+    progress_lock = threading.Lock()
+
+    def advance(stage: str, n: int = 1) -> None:
+        with progress_lock:
+            counts[stage] += n
+            if on_progress:
+                on_progress(dict(counts), dict(totals))
+
+    def stream(idx: int) -> bool:
+        streamed.append(idx)
+        return (_put(preprocess_q, (idx, extracted[idx]), abort)
+                and _put(detect_q, (idx, extracted[idx]), abort))
+
+    # --- Preprocessing: keep up to two frames per pool worker in flight ---
+    inflight: deque = deque()
+    max_inflight = max(PREPROCESS_WORKERS, 1) * 2
+
+    def collect_preprocessed() -> None:
+        idx, path, future = inflight.popleft()
+        preprocessed[idx] = frame_result(future, path, results_dir)
+        advance("preprocess")
+
+    def preprocess(batch: list[tuple[int, Path]]) -> None:
+        for idx, path in batch:
+            inflight.append((idx, path, submit_frame(path, results_dir)))
+        while inflight and (len(inflight) >= max_inflight or inflight[0][2].done()):
+            collect_preprocessed()
+
+    def drain_preprocess() -> None:
+        while inflight:
+            collect_preprocessed()
+
+    # --- Detection: batch whatever frames are already waiting ---
+    def detect(batch: list[tuple[int, Path]]) -> None:
+        frames = []
+        for idx, path in batch:
+            try:
+                frames.append((idx, load_frame(path, frame_cache)))
+            except ValueError:
+                logger.warning("Failed to load frame for detection: %s", path)
+        for idx, items in detect_batch(frames, detections_dir) if frames else []:
+            detected[idx] = items
+        advance("detect", len(batch))
+
+    workers = [
+        _StageWorker("preprocess", preprocess_q, preprocess, abort, finish=drain_preprocess),
+        _StageWorker("detect", detect_q, detect, abort, batch_size=YOLO_BATCH_SIZE),
+    ]
+    for worker in workers:
+        worker.start()
+
+    # --- Extraction runs in the calling thread and feeds the others ---
+    extract_busy = 0.0
+    extract_cpu_start = time.thread_time()
+    frame_iter = iter_frames(input_paths, frames_dir)
+    try:
+        while not abort.is_set():
+            start = time.perf_counter()
+            frame_path = next(frame_iter, None)
+            extract_busy += time.perf_counter() - start
+            if frame_path is None:
+                break
+            extracted.append(frame_path)
+            advance("extract")
+            if len(extracted) <= MAX_FRAMES and not stream(len(extracted) - 1):
+                break
+
+        if len(extracted) > MAX_FRAMES and not abort.is_set():
+            # Past the cap: stream the held-back frames it keeps
+            position = {path: i for i, path in enumerate(extracted)}
+            late = [position[path] for path in select_frames(extracted)
+                    if position[path] >= MAX_FRAMES]
+            logger.info("Extracted %d frames; streaming the first %d and %d held back",
+                        len(extracted), MAX_FRAMES, len(late))
+            with progress_lock:
+                totals.update(preprocess=MAX_FRAMES + len(late), detect=MAX_FRAMES + len(late))
+            for idx in late:
+                if not stream(idx):
+                    break
+    except BaseException:
+        abort.set()
+        raise
+    finally:
+        frame_iter.close()
+        with progress_lock:
+            totals["extract"] = len(extracted)
+            totals.setdefault("preprocess", len(streamed))
+            totals.setdefault("detect", len(streamed))
+        _put(preprocess_q, _DONE, abort)
+        _put(detect_q, _DONE, abort)
+        for worker in workers:
+            worker.join()
+    extract_cpu = time.thread_time() - extract_cpu_start
+
+    errors = [w.error for w in workers if w.error is not None]
+    if errors:
+        raise errors[0]
+
+    frame_paths, damage_items, preprocess_results = _finish_stream(
+        extracted, streamed, preprocessed, detected, results_dir,
+    )
+
+    # --- Segmentation of the items that survived the cap and dedup ---
+    from app.pipeline.segmentation import segment_frame
+
+    items_by_frame: dict[int, list[DamageItem]] = {}
+    for item in damage_items:
+        items_by_frame.setdefault(item.frame_index, []).append(item)
+    with progress_lock:
+        totals["segment"] = len(items_by_frame)
+        if on_progress:
+            on_progress(dict(counts), dict(totals))
+
+    segment_busy = 0.0
+    segment_cpu_start = time.thread_time()
+    for frame_idx in sorted(items_by_frame):
+        start = time.perf_counter()
+        segment_frame(frame_paths[frame_idx], items_by_frame[frame_idx], results_dir, frame_cache)
+        segment_busy += time.perf_counter() - start
+        advance("segment")
+    segment_cpu = time.thread_time() - segment_cpu_start
+
+    n = len(streamed)
+    busy = {w.stage: w for w in workers}
+    stage_metrics = [
+        _stage_metrics("extract", extract_busy, extract_cpu, len(extracted), len(extracted)),
+        _stage_metrics("preprocess", busy["preprocess"].busy, busy["preprocess"].cpu,
+                       n, len(preprocessed)),
+        _stage_metrics("detect", busy["detect"].busy, busy["detect"].cpu,
+                       n, sum(len(items) for items in detected.values())),
+        _stage_metrics("segment", segment_busy, segment_cpu, len(items_by_frame),
+                       sum(1 for item in damage_items if item.mask_url)),
+    ]
+    return StreamResult(
+        frame_paths=frame_paths,
+        damage_items=damage_items,
+        preprocess_results=preprocess_results,
+        streamed_frames=n,
+        stage_metrics=stage_metrics,
+    )
+
+
+def _finish_stream(
+    extracted: list[Path],
+    streamed: list[int],
+    preprocessed: dict[int, dict],
+    detected: dict[int, list[DamageItem]],
+    results_dir: Path,
+) -> tuple[list[Path], list[DamageItem], dict]:
+    """Apply the frame cap, renumber frames and deduplicate detections.
+
+    Matches what the sequential stages produce: frame indices refer to the
+    capped frame list. Outputs of streamed frames the cap drops are removed.
+    """
+    from app.pipeline.detection import merge_detections
+    from app.pipeline.frame_extraction import select_frames
+    from app.pipeline.preprocessing import merge_preprocess_results
+
+    detections_dir = results_dir / "detections"
+    position = {path: i for i, path in enumerate(extracted)}
+    frame_paths = select_frames(extracted)
+    kept = [position[path] for path in frame_paths]
+
+    per_frame: list[list[DamageItem]] = []
+    for new_idx, old_idx in enumerate(kept):
+        items = detected.get(old_idx, [])
+        for item in items:
+            item.frame_index = new_idx
+        per_frame.append(items)
+        if new_idx != old_idx:
+            # Indices only shrink, so renaming in order never clobbers a kept frame
+            old_path = detections_dir / f"frame_{old_idx:04d}_detections.jpg"
+            if old_path.exists():
+                os.replace(old_path, detections_dir / f"frame_{new_idx:04d}_detections.jpg")
+
+    if len(kept) < len(extracted):
+        kept_set = set(kept)
+        dropped = [idx for idx in streamed if idx not in kept_set]
+        logger.info("Capped %d extracted frames to %d (%d streamed frames dropped)",
+                    len(extracted), len(kept), len(dropped))
+        for old_idx in dropped:
+            for path in (preprocessed.get(old_idx) or {}).values():
+                if path is not None:
+                    path.unlink(missing_ok=True)
+        for stale in range(len(kept), max(streamed, default=-1) + 1):
+            (detections_dir / f"frame_{stale:04d}_detections.jpg").unlink(missing_ok=True)
+
+    damage_items = merge_detections(per_frame)
+
+    preprocess_results = merge_preprocess_results(
+        [preprocessed[i] for i in kept if i in preprocessed]
+    )
+    return frame_paths, damage_items, preprocess_results
+
+
+class _StageWorker(threading.Thread):
+    """Runs one streamed stage over the items arriving in ``inbox``.
+
+    ``handle`` gets up to ``batch_size`` items at a time: it blocks for the
+    first and takes whatever else is already queued. ``finish`` runs once
+    the upstream stage is done. Any error sets ``abort`` so the other stages
+    stop too.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        inbox: queue.Queue,
+        handle: Callable[[list], None],
+        abort: threading.Event,
+        batch_size: int = 1,
+        finish: Optional[Callable[[], object]] = None,
+    ):
+        super().__init__(name=f"stream-{stage}", daemon=True)
+        self.stage = stage
+        self.inbox = inbox
+        self.handle = handle
+        self.abort = abort
+        self.batch_size = max(batch_size, 1)
+        self.finish = finish
+        self.busy = 0.0  # Seconds spent working (not waiting for input)
+        self.cpu = 0.0  # CPU time of this thread (pool processes not included)
+        self.error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        cpu_start = time.thread_time()
+        try:
+            done = False
+            while not done:
+                batch, done = _take(self.inbox, self.batch_size, self.abort)
+                if batch:
+                    start = time.perf_counter()
+                    self.handle(batch)
+                    self.busy += time.perf_counter() - start
+            if self.finish is not None and not self.abort.is_set():
+                start = time.perf_counter()
+                self.finish()
+                self.busy += time.perf_counter() - start
+        except BaseException as e:  # re-raised by run_streaming_stages
+            logger.exception("Streamed %s stage failed", self.stage)
+            self.error = e
+            self.abort.set()
+        finally:
+            self.cpu = time.thread_time() - cpu_start
+
+
+def _put(q: queue.Queue, item, abort: threading.Event) -> bool:
+    """Put ``item`` on a bounded queue, giving up if the stream is aborted."""
+    while not abort.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _take(q: queue.Queue, max_items: int, abort: threading.Event) -> tuple[list, bool]:
+    """Wait for one item, then take up to ``max_items`` already queued.
+
+    Returns (items, finished); finished is True once the end marker arrived
+    or the stream was aborted.
+    """
+    items: list = []
+    while not abort.is_set():
+        try:
+            item = q.get(timeout=0.1)
+            break
+        except queue.Empty:
+            continue
+    else:
+        return items, True
+
+    while True:
+        if item is _DONE:
+            return items, True
+        items.append(item)
+        if len(items) >= max_items:
+            return items, False
+        try:
+            item = q.get_nowait()
+        except queue.Empty:
+            return items, False
+
+
+def _stage_metrics(stage: str, busy: float, cpu: float, frames: int, items: int) -> StageMetrics:
+    return StageMetrics(
+        stage=stage,
+        wall_seconds=round(busy, 4),
+        cpu_seconds=round(cpu, 4),
+        frames=frames,
+        items=items,
+        frames_per_second=round(frames / busy, 3) if frames and busy > 0 else None,
+    )
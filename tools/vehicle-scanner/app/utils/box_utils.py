@@ -0,0 +1,28 @@
+"""Vectorized bounding-box helpers."""
+
+from __future__ import annotations
+
+import numpy as np
+
+from app.models import BoundingBox
+
+
+def boxes_to_array(boxes: list[BoundingBox]) -> np.ndarray:
+    """Stack BoundingBoxes into an (N, 4) float array of x1, y1, x2, y2."""
+    if not boxes:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.array([[b.x1, b.y1, b.x2, b.y2] for b in boxes], dtype=np.float64)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise Intersection over Union of (N, 4) and (M, 4) boxes → (N, M)."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-6)
@@ -0,0 +1,135 @@
+"""Serve files with validators, conditional requests and byte ranges."""
+
+from __future__ import annotations
+
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+_RANGE_CHUNK_SIZE = 256 * 1024
+
+
+def file_response(
+    request: Request,
+    path: Path,
+    media_type: str,
+    immutable: bool = False,
+    headers: Optional[dict[str, str]] = None,
+) -> Response:
+    """Serve ``path`` with ETag/Last-Modified, 304s and single byte ranges.
+
+    ``immutable`` marks files that never change once written, so browsers
+    keep them for a year without revalidating; everything else is cached
+    but revalidated on each use. Multi-range requests are left to
+    FileResponse (multipart on newer Starlette, the whole file on older).
+    """
+    stat = path.stat()
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        **(headers or {}),
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if range_header and _if_range_matches(request, etag, stat.st_mtime):
+        byte_range = _parse_range(range_header, stat.st_size)
+        if byte_range == "unsatisfiable":
+            headers["Content-Range"] = f"bytes */{stat.st_size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _read_range(path, start, end),
+                status_code=206,
+                media_type=media_type,
+                headers=headers,
+            )
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Evaluate If-None-Match, or If-Modified-Since when no ETag was sent."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    since = _parse_http_date(request.headers.get("if-modified-since"))
+    return since is not None and int(mtime) <= since
+
+
+def _if_range_matches(request: Request, etag: str, mtime: float) -> bool:
+    """Whether a Range should be honoured given If-Range (absent = always)."""
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    since = _parse_http_date(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def _parse_range(header: str, size: int):
+    """Parse a single ``bytes=`` range into inclusive (start, end).
+
+    Returns None to ignore the header (malformed or multiple ranges) and
+    "unsatisfiable" when the range lies past the end of the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if end < start:
+                return None
+        else:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                return "unsatisfiable"
+            start, end = max(size - length, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+def _read_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(_RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError):
+        return None
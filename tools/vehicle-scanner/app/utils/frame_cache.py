@@ -0,0 +1,79 @@
+"""Per-scan cache of decoded frames shared across pipeline stages."""
+
+from __future__ import annotations
+
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.utils.image_utils import load_image
+
+logger = logging.getLogger(__name__)
+
+
+class FrameCache:
+    """LRU cache of decoded BGR frames bounded by total array bytes.
+
+    Cached arrays are read-only and shared between callers; copy before
+    drawing on them. Thread-safe, so prefetch threads can fill it.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._frames: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str | Path) -> np.ndarray:
+        """Return the decoded frame at ``path``, decoding it on first use.
+
+        Raises ValueError if the image cannot be loaded (like ``load_image``).
+        """
+        key = str(path)
+        with self._lock:
+            img = self._frames.get(key)
+            if img is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return img
+            self.misses += 1
+
+        # Decode outside the lock so threads can decode different frames at once
+        img = load_image(path)
+        img.flags.writeable = False
+
+        with self._lock:
+            if key in self._frames:
+                return self._frames[key]
+            if img.nbytes <= self.max_bytes:
+                self._frames[key] = img
+                self._bytes += img.nbytes
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._frames.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+        return img
+
+    def clear(self) -> None:
+        """Drop all cached frames."""
+        with self._lock:
+            if self.hits or self.misses:
+                logger.debug("Frame cache: %d hits, %d misses, %.1f MB held",
+                             self.hits, self.misses, self._bytes / (1024 * 1024))
+            self._frames.clear()
+            self._bytes = 0
+
+
+def load_frame(path: str | Path, cache: Optional[FrameCache] = None) -> np.ndarray:
+    """Load a frame through ``cache`` if given, else decode it directly.
+
+    Treat the result as read-only either way.
+    """
+    if cache is not None:
+        return cache.get(path)
+    return load_image(path)
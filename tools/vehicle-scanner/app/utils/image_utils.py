@@ -4,6 +4,7 @@ from __future__ import annotations
 
 import base64
 import io
+from functools import lru_cache
 from pathlib import Path
 
 import cv2
@@ -63,15 +64,19 @@ def from_pil(pil_img: Image.Image) -> np.ndarray:
     return cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
 
 
+@lru_cache(maxsize=8)
 def create_studio_background(width: int, height: int) -> np.ndarray:
-    """Create a vertical gradient background matching the showroom aesthetic."""
-    bg = np.zeros((height, width, 3), dtype=np.uint8)
-    for y in range(height):
-        ratio = y / max(height - 1, 1)
-        bg[y, :] = [
-            int(STUDIO_BG_TOP[i] * (1 - ratio) + STUDIO_BG_BOTTOM[i] * ratio)
-            for i in range(3)
-        ]
+    """Create a vertical gradient background matching the showroom aesthetic.
+
+    Cached per (width, height). The returned array is read-only and shared
+    between callers — copy it before drawing on it.
+    """
+    ratio = (np.arange(height, dtype=np.float64) / max(height - 1, 1))[:, None]
+    top = np.asarray(STUDIO_BG_TOP, dtype=np.float64)
+    bottom = np.asarray(STUDIO_BG_BOTTOM, dtype=np.float64)
+    column = (top * (1 - ratio) + bottom * ratio).astype(np.uint8)  # (height, 3)
+    bg = np.ascontiguousarray(np.broadcast_to(column[:, None, :], (height, width, 3)))
+    bg.flags.writeable = False
     return bg
 
 
@@ -80,7 +85,7 @@ def composite_on_studio_bg(
 ) -> np.ndarray:
     """Composite an RGBA image onto the studio gradient background."""
     bg = create_studio_background(target_width, target_height)
-    bg_pil = Image.fromarray(bg)
+    bg_pil = Image.fromarray(bg.copy())
 
     # Resize image to fit within background (80% of width, maintain aspect)
     img_w, img_h = rgba_img.size
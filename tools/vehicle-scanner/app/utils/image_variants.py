@@ -0,0 +1,119 @@
+"""Downscaled WebP/AVIF derivatives of scan images, generated on first request."""
+
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import cv2
+
+from app.config import IMAGE_VARIANT_QUALITY, IMAGE_VARIANT_WIDTHS
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SOURCE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+VARIANT_MEDIA_TYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpg": "image/jpeg",
+    "png": "image/png",
+}
+
+# Per-output locks so concurrent requests encode each variant once
+_variant_locks: dict[str, threading.Lock] = {}
+_variant_locks_guard = threading.Lock()
+
+
+def variant_width(requested: int) -> int:
+    """Round a requested width up to the nearest IMAGE_VARIANT_WIDTHS entry."""
+    return next((w for w in sorted(IMAGE_VARIANT_WIDTHS) if w >= requested), max(IMAGE_VARIANT_WIDTHS))
+
+
+def variant_format(source: Path, accept: str) -> str:
+    """Best format the client accepts: AVIF, then WebP, then the source's own."""
+    accept = accept.lower()
+    if "image/avif" in accept and _can_write("avif"):
+        return "avif"
+    if "image/webp" in accept and _can_write("webp"):
+        return "webp"
+    return "png" if source.suffix.lower() == ".png" else "jpg"
+
+
+def get_image_variant(results_dir: Path, source: Path, width: int, fmt: str) -> Optional[Path]:
+    """Return ``source`` scaled down to ``width`` pixels wide and encoded as ``fmt``.
+
+    Variants are cached under ``results_dir/variants/<dir>/`` and rebuilt if
+    the source is newer. Images are never upscaled. Returns None if the
+    source cannot be decoded.
+    """
+    output_path = results_dir / "variants" / source.parent.name / f"{source.stem}_w{width}.{fmt}"
+    if _is_fresh(output_path, source):
+        return output_path
+
+    with _variant_locks_guard:
+        lock = _variant_locks.setdefault(str(output_path), threading.Lock())
+    try:
+        with lock:
+            if not _is_fresh(output_path, source):
+                if not _write_variant(source, output_path, width, fmt):
+                    return None
+    finally:
+        with _variant_locks_guard:
+            _variant_locks.pop(str(output_path), None)
+    return output_path
+
+
+def _write_variant(source: Path, output_path: Path, width: int, fmt: str) -> bool:
+    img = cv2.imread(str(source), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        logger.warning("Failed to load image for variant: %s", source)
+        return False
+
+    h, w = img.shape[:2]
+    if w > width:
+        img = cv2.resize(img, (width, max(round(h * width / w), 1)), interpolation=cv2.INTER_AREA)
+
+    params = {
+        "avif": [cv2.IMWRITE_AVIF_QUALITY, IMAGE_VARIANT_QUALITY],
+        "webp": [cv2.IMWRITE_WEBP_QUALITY, IMAGE_VARIANT_QUALITY],
+        "jpg": [cv2.IMWRITE_JPEG_QUALITY, 90],
+        "png": [],
+    }[fmt]
+    ok, encoded = cv2.imencode(f".{fmt}", img, params)
+    if not ok:
+        logger.warning("Failed to encode %s variant of %s", fmt, source)
+        return False
+
+    # Write-then-rename so readers never see a partial file
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=output_path.parent, suffix=".tmp")
+    try:
+        with open(fd, "wb") as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp, output_path)
+    except OSError:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return True
+
+
+def _is_fresh(output_path: Path, source: Path) -> bool:
+    try:
+        return output_path.stat().st_mtime_ns >= source.stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+@lru_cache(maxsize=None)
+def _can_write(fmt: str) -> bool:
+    """Whether this OpenCV build has an encoder for ``fmt``."""
+    try:
+        return cv2.haveImageWriter(f"variant.{fmt}")
+    except cv2.error:
+        return False
@@ -2,16 +2,31 @@
 
 from __future__ import annotations
 
+import inspect
 import logging
+import shutil
+from pathlib import Path
 from typing import Any, Optional
 
 from app.config import (
     DEVICE,
     YOLO_MODEL,
+    YOLO_BACKEND,
+    YOLO_EXPORT_IMGSZ,
+    EXPORTS_DIR,
     SAM_ENABLED,
     ESRGAN_ENABLED,
+    ESRGAN_SCALE,
+    ESRGAN_TILE_SIZE,
+    ESRGAN_TILE_PAD,
+    ESRGAN_MAX_MEMORY_MB,
     YOLO_FINE_TUNED,
     FINE_TUNED_MODEL_PATH,
+    FINE_TUNED_INT8_MODEL_PATH,
+    REMBG_MODEL,
+    ORT_INTRA_OP_THREADS,
+    ORT_INTER_OP_THREADS,
+    ORT_PROVIDERS,
 )
 
 logger = logging.getLogger(__name__)
@@ -30,6 +45,9 @@ def load_yolo() -> Any:
 
     If YOLO_FINE_TUNED is True and the fine-tuned weights exist at
     FINE_TUNED_MODEL_PATH, loads those instead of the default pre-trained model.
+    With YOLO_BACKEND set to "onnx" or "openvino" the weights are exported
+    once (cached under EXPORTS_DIR) and the exported model is served instead;
+    "onnx_int8" serves the quantized fine-tuned model.
     """
     if "yolo" not in _models:
         from ultralytics import YOLO
@@ -53,6 +71,20 @@ def load_yolo() -> Any:
             else:
                 logger.info("Loading YOLOv8 model: %s on %s", YOLO_MODEL, DEVICE)
 
+        if YOLO_BACKEND != "pytorch":
+            try:
+                if YOLO_BACKEND == "onnx_int8":
+                    exported = _int8_model_path()
+                else:
+                    exported = export_yolo(model_path, YOLO_BACKEND)
+                model = YOLO(str(exported), task="detect")
+                _models["yolo"] = model
+                logger.info("YOLOv8 loaded successfully (%s backend: %s)", YOLO_BACKEND, exported.name)
+                return model
+            except Exception as e:
+                logger.warning("YOLO %s backend unavailable: %s — falling back to PyTorch",
+                               YOLO_BACKEND, e)
+
         model = YOLO(model_path)
         if DEVICE == "cuda":
             model.to("cuda")
@@ -61,6 +93,58 @@ def load_yolo() -> Any:
     return _models["yolo"]
 
 
+def _int8_model_path() -> Path:
+    """Path of the quantized fine-tuned model, if it can be served."""
+    if not YOLO_FINE_TUNED:
+        raise ValueError("onnx_int8 backend requires YOLO_FINE_TUNED=true")
+    if not FINE_TUNED_INT8_MODEL_PATH.exists():
+        raise FileNotFoundError(
+            f"{FINE_TUNED_INT8_MODEL_PATH} not found — run scripts/quantize_damage_model.py"
+        )
+    return FINE_TUNED_INT8_MODEL_PATH
+
+
+def export_yolo(model_path: str | Path, backend: str, imgsz: int = YOLO_EXPORT_IMGSZ) -> Path:
+    """Export YOLO weights to ONNX or OpenVINO IR, reusing a cached export.
+
+    Exports live in EXPORTS_DIR as ``{stem}-{imgsz}.onnx`` or
+    ``{stem}-{imgsz}_openvino_model/`` and are rebuilt when the source
+    weights are newer than the export. ONNX is exported with a dynamic batch
+    axis so batched detection keeps working.
+    """
+    from ultralytics import YOLO
+
+    if backend not in ("onnx", "openvino"):
+        raise ValueError(f"Unknown YOLO backend: {backend}. Allowed: pytorch, onnx, openvino")
+
+    source = Path(model_path)
+    EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    name = f"{source.stem}-{imgsz}"
+    target = EXPORTS_DIR / (f"{name}.onnx" if backend == "onnx" else f"{name}_openvino_model")
+
+    # Hub names like "yolov8n.pt" are downloaded by Ultralytics and have no local mtime
+    source_mtime = source.stat().st_mtime if source.exists() else 0.0
+    if target.exists() and target.stat().st_mtime >= source_mtime:
+        return target
+
+    logger.info("Exporting %s to %s (imgsz=%d) — one-time cost", source.name, backend, imgsz)
+    exported = Path(YOLO(str(model_path)).export(
+        format=backend,
+        imgsz=imgsz,
+        dynamic=backend == "onnx",
+        half=False,
+    ))
+
+    # Ultralytics writes next to the weights; move the artifact into the cache
+    if target.is_dir():
+        shutil.rmtree(target)
+    elif target.exists():
+        target.unlink()
+    shutil.move(str(exported), str(target))
+    logger.info("Exported model cached at %s", target)
+    return target
+
+
 def load_sam2() -> Optional[Any]:
     """Load SAM2 model if enabled (lazy, cached)."""
     if not SAM_ENABLED:
@@ -96,20 +180,21 @@ def load_esrgan() -> Optional[Any]:
             from basicsr.archs.rrdbnet_arch import RRDBNet
 
             rrdb_model = RRDBNet(
-                num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4
+                num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=ESRGAN_SCALE
             )
+            tile = esrgan_tile_size()
             upsampler = RealESRGANer(
-                scale=4,
+                scale=ESRGAN_SCALE,
                 model_path="https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth",
                 model=rrdb_model,
-                tile=0,
-                tile_pad=10,
+                tile=tile,
+                tile_pad=ESRGAN_TILE_PAD,
                 pre_pad=0,
                 half=DEVICE == "cuda",
                 device=DEVICE,
             )
             _models["esrgan"] = upsampler
-            logger.info("Real-ESRGAN loaded successfully")
+            logger.info("Real-ESRGAN loaded successfully (tile=%d)", tile)
         except ImportError:
             logger.warning("Real-ESRGAN not installed — upscaling disabled")
             _models["esrgan"] = None
@@ -119,12 +204,87 @@ def load_esrgan() -> Optional[Any]:
     return _models["esrgan"]
 
 
+def load_rembg(intra_op_threads: int | None = None) -> Optional[Any]:
+    """Load a rembg (U2-Net) ONNX session (lazy, cached).
+
+    ``intra_op_threads`` overrides ORT_INTRA_OP_THREADS; preprocessing pool
+    workers use it to split the available cores between processes.
+    """
+    if "rembg" not in _models:
+        logger.info("Loading rembg session: %s", REMBG_MODEL)
+        try:
+            _models["rembg"] = _new_rembg_session(
+                REMBG_MODEL,
+                intra_op_threads if intra_op_threads is not None else ORT_INTRA_OP_THREADS,
+            )
+            logger.info("rembg session loaded successfully")
+        except ImportError:
+            logger.warning("rembg not installed — background removal disabled")
+            _models["rembg"] = None
+        except Exception as e:
+            logger.warning("rembg session failed to load: %s — background removal disabled", e)
+            _models["rembg"] = None
+    return _models["rembg"]
+
+
+def _new_rembg_session(model_name: str, intra_op_threads: int) -> Any:
+    """Create a rembg session with our ONNX Runtime thread/provider settings."""
+    import onnxruntime as ort
+    from rembg import new_session
+    from rembg.sessions import sessions_class
+
+    sess_opts = ort.SessionOptions()
+    if intra_op_threads > 0:
+        sess_opts.intra_op_num_threads = intra_op_threads
+    if ORT_INTER_OP_THREADS > 0:
+        sess_opts.inter_op_num_threads = ORT_INTER_OP_THREADS
+    providers = ORT_PROVIDERS or None
+
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return session_class(model_name, sess_opts, providers=providers)
+
+    # Unknown to this rembg version's registry: only new_session() knows how
+    # to build it, and released versions make their own SessionOptions
+    if "sess_opts" in inspect.signature(new_session).parameters:
+        return new_session(model_name, sess_opts=sess_opts, providers=providers)
+    logger.warning(
+        "rembg model %s is not in rembg's session registry; creating it without "
+        "ORT_INTRA_OP_THREADS/ORT_INTER_OP_THREADS (each process may use every core, "
+        "set OMP_NUM_THREADS to limit it)",
+        model_name,
+    )
+    return new_session(model_name, providers=providers)
+
+
+# Rough RRDBNet working-set per padded tile pixel: 64 float32 feature maps
+# with ~12 alive at once inside a residual dense block
+_ESRGAN_BYTES_PER_TILE_PIXEL = 64 * 4 * 12
+
+
+def esrgan_tile_size() -> int:
+    """ESRGAN_TILE_SIZE, shrunk if one tile would not fit ESRGAN_MAX_MEMORY_MB."""
+    budget = ESRGAN_MAX_MEMORY_MB * 1024 * 1024
+    fits = int((budget / _ESRGAN_BYTES_PER_TILE_PIXEL) ** 0.5) - 2 * ESRGAN_TILE_PAD
+    return max(min(ESRGAN_TILE_SIZE, fits), 32)
+
+
+def esrgan_max_input_pixels() -> int:
+    """Largest input (in pixels) whose float32 upscaled output fits the memory ceiling.
+
+    Half the budget is reserved for the output buffer, the rest for tiles.
+    """
+    budget = ESRGAN_MAX_MEMORY_MB * 1024 * 1024 / 2
+    return int(budget / (ESRGAN_SCALE * ESRGAN_SCALE * 3 * 4))
+
+
 def get_loaded_models() -> dict[str, bool]:
     """Return a dict of model names → whether they're loaded."""
     return {
         "yolo": "yolo" in _models,
         "sam2": "sam2" in _models and _models["sam2"] is not None,
         "esrgan": "esrgan" in _models and _models["esrgan"] is not None,
+        "rembg": "rembg" in _models and _models["rembg"] is not None,
     }
 
 
@@ -132,6 +292,7 @@ def preload_models() -> None:
     """Pre-load all enabled models at startup."""
     logger.info("Pre-loading models...")
     load_yolo()
+    load_rembg()
     if SAM_ENABLED:
         load_sam2()
     if ESRGAN_ENABLED:
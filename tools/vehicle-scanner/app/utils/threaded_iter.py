@@ -0,0 +1,57 @@
+"""Run an iterator in a background thread behind a bounded queue."""
+
+from __future__ import annotations
+
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+def threaded_iter(source: Iterable[T], maxsize: int = 8, name: str = "prefetch") -> Iterator[T]:
+    """Yield items from ``source``, producing them in a daemon thread.
+
+    At most ``maxsize`` items are buffered ahead of the consumer. If the
+    consumer stops early the producer is signalled to stop and joined
+    before returning; an exception raised by the producer is re-raised in
+    the consumer.
+    """
+    items: queue.Queue = queue.Queue(maxsize=max(maxsize, 1))
+    stop = threading.Event()
+    error: list[BaseException] = []
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce() -> None:
+        try:
+            for item in source:
+                if not _put(item):
+                    return
+        except BaseException as e:  # surfaced to the consumer below
+            error.append(e)
+        finally:
+            _put(_DONE)
+
+    producer = threading.Thread(target=_produce, name=name, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            yield item
+        if error:
+            raise error[0]
+    finally:
+        stop.set()
+        producer.join()
@@ -0,0 +1,238 @@
+"""Stream multipart uploads straight to disk with incremental limits."""
+
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import aiofiles
+from fastapi import Request
+
+try:
+    import python_multipart as multipart
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import parse_options_header
+
+# Text fields are small (ids, make/model); anything bigger is not a form we sent
+_MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the size limit."""
+
+    def __init__(self, size_bytes: int, max_bytes: int):
+        self.size_bytes = size_bytes
+        self.max_bytes = max_bytes
+        super().__init__(
+            f"File too large: {size_bytes / (1024 * 1024):.1f}MB "
+            f"(max: {max_bytes / (1024 * 1024):.0f}MB)"
+        )
+
+
+class UploadRejectedError(Exception):
+    """Raised for a malformed multipart body or a file that is not accepted."""
+
+
+@dataclass
+class ReceivedUpload:
+    """Files written by ``receive_upload`` and the text fields of the form."""
+
+    paths: list[Path] = field(default_factory=list)
+    digests: list[str] = field(default_factory=list)
+    size_bytes: int = 0
+    fields: dict[str, str] = field(default_factory=dict)
+
+
+async def receive_upload(
+    request: Request,
+    dest_dir: Path,
+    file_field: str,
+    allowed_extensions: set[str],
+    max_file_bytes: int,
+    max_files: int,
+    chunk_size: int = 1024 * 1024,
+    hash_algorithm: Optional[str] = None,
+) -> ReceivedUpload:
+    """Parse a multipart/form-data body as it arrives, writing files to ``dest_dir``.
+
+    Nothing is spooled first: each part of ``file_field`` is checked
+    (extension, file count) when its headers arrive and written as its data
+    does, so an unsupported or oversized file stops the request without the
+    rest of the body being read. Writes are coalesced into ``chunk_size``
+    blocks. If ``hash_algorithm`` is given (any hashlib name) a hex digest of
+    each file is computed while streaming.
+
+    Raises UploadRejectedError or UploadTooLargeError; files already written
+    are left in ``dest_dir`` for the caller to remove.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadRejectedError("Expected a multipart/form-data body")
+
+    events = _PartEvents()
+    parser = multipart.MultipartParser(boundary, events.callbacks())
+    received = ReceivedUpload()
+    writer: Optional[_FileWriter] = None
+    field_name: Optional[str] = None
+    field_data = bytearray()
+
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except MultipartParseError as e:
+                raise UploadRejectedError(f"Malformed multipart body: {e}") from None
+
+            for kind, value in events.take():
+                if kind == "part":
+                    name, filename = value
+                    if filename is None:
+                        field_name = name
+                        field_data.clear()
+                        continue
+                    if name != file_field:
+                        raise UploadRejectedError(f"Unexpected file field: {name}")
+                    if len(received.paths) >= max_files:
+                        raise UploadRejectedError(f"Too many files (max: {max_files})")
+                    ext = Path(filename or "unknown").suffix.lower()
+                    if ext not in allowed_extensions:
+                        raise UploadRejectedError(
+                            f"Unsupported file type: {ext}. Allowed: {', '.join(allowed_extensions)}"
+                        )
+                    path = dest_dir / (Path(filename).name or f"upload_{len(received.paths)}{ext}")
+                    writer = await _FileWriter.open(path, max_file_bytes, chunk_size, hash_algorithm)
+                    received.paths.append(path)
+                elif kind == "data":
+                    if writer is not None:
+                        await writer.write(value)
+                    elif len(field_data) + len(value) > _MAX_FIELD_BYTES:
+                        raise UploadRejectedError(f"Form field too large: {field_name}")
+                    else:
+                        field_data.extend(value)
+                elif writer is not None:  # end of a file part
+                    received.size_bytes += writer.size
+                    digest = await writer.close()
+                    if digest:
+                        received.digests.append(digest)
+                    writer = None
+                elif field_name is not None:  # end of a text field
+                    received.fields[field_name] = field_data.decode("utf-8", errors="replace")
+                    field_name = None
+        parser.finalize()
+    finally:
+        if writer is not None:
+            await writer.close()
+
+    return received
+
+
+class _PartEvents:
+    """Queues python-multipart callbacks so they can be handled with ``await``.
+
+    Yields ("part", (name, filename or None)) once a part's headers are in,
+    ("data", bytes) for its body and ("end", None) when it is complete.
+    """
+
+    def __init__(self):
+        self._events: list[tuple[str, object]] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        }
+
+    def take(self) -> list[tuple[str, object]]:
+        events, self._events = self._events, []
+        return events
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise UploadRejectedError('Multipart part without a Content-Disposition "name"')
+        filename = options.get(b"filename")
+        self._events.append((
+            "part",
+            (
+                options[b"name"].decode("utf-8", errors="replace"),
+                filename.decode("utf-8", errors="replace") if filename is not None else None,
+            ),
+        ))
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self._events.append(("data", data[start:end]))
+
+    def _on_part_end(self) -> None:
+        self._events.append(("end", None))
+
+
+class _FileWriter:
+    """One uploaded file being written: size limit, digest and write buffer."""
+
+    def __init__(self, path: Path, out, max_bytes: int, chunk_size: int, hash_algorithm: Optional[str]):
+        self.path = path
+        self.size = 0
+        self._out = out
+        self._max_bytes = max_bytes
+        self._chunk_size = chunk_size
+        self._digest = hashlib.new(hash_algorithm) if hash_algorithm else None
+        self._buffer = bytearray()
+
+    @classmethod
+    async def open(
+        cls, path: Path, max_bytes: int, chunk_size: int, hash_algorithm: Optional[str]
+    ) -> "_FileWriter":
+        return cls(path, await aiofiles.open(path, "wb"), max_bytes, chunk_size, hash_algorithm)
+
+    async def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > self._max_bytes:
+            raise UploadTooLargeError(self.size, self._max_bytes)
+        if self._digest is not None:
+            self._digest.update(data)
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            await self._out.write(bytes(self._buffer))
+            self._buffer.clear()
+
+    async def close(self) -> Optional[str]:
+        """Flush and close the file; returns its hex digest (or None)."""
+        if self._out is None:
+            return None
+        out, self._out = self._out, None
+        try:
+            if self._buffer:
+                await out.write(bytes(self._buffer))
+                self._buffer.clear()
+        finally:
+            await out.close()
+        return self._digest.hexdigest() if self._digest is not None else None
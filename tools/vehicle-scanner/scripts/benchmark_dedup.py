@@ -0,0 +1,148 @@
+"""
+Benchmark keyframe deduplication methods on sample videos.
+
+Decodes each video once at the pipeline's sampling rate, then runs every
+FrameDeduplicator method over the same sampled frames and reports:
+  - time per sampled frame
+  - number of keyframes kept
+  - keyframe recall against full 640 px SSIM (the reference method): the
+    fraction of reference keyframes with a kept frame within --tolerance
+    samples
+
+Usage:
+    python scripts/benchmark_dedup.py --videos data/samples/*.mp4 --tolerance 1
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import cv2
+
+# Allow running from the repo root without installing the app package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import VIDEO_SAMPLE_FPS  # noqa: E402
+from app.pipeline.frame_extraction import DEDUP_METHODS, FrameDeduplicator  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+REFERENCE_METHOD = "ssim"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare keyframe dedup methods (recall vs. time) on sample videos.",
+    )
+    parser.add_argument(
+        "--videos",
+        type=Path,
+        nargs="+",
+        required=True,
+        help="Video files to benchmark",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=int,
+        default=1,
+        help="Sampled-frame distance at which a keyframe counts as recalled (default: 1)",
+    )
+    parser.add_argument(
+        "--max-samples",
+        type=int,
+        default=600,
+        help="Maximum sampled frames decoded per video (default: 600)",
+    )
+    return parser.parse_args()
+
+
+def _sample_video(video_path: Path, max_samples: int) -> list:
+    """Decode the frames the pipeline would sample from a video."""
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        logger.error("Failed to open video: %s", video_path)
+        return []
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    sample_interval = max(int(fps / VIDEO_SAMPLE_FPS), 1)
+
+    frames = []
+    frame_idx = 0
+    while len(frames) < max_samples and cap.grab():
+        if frame_idx % sample_interval == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                frames.append(frame)
+        frame_idx += 1
+    cap.release()
+    return frames
+
+
+def _run_method(method: str, frames: list) -> tuple[list[int], float]:
+    """Return (kept sample indices, seconds per frame) for one method."""
+    dedup = FrameDeduplicator(method)
+    kept = []
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        if dedup.is_unique(frame):
+            kept.append(i)
+    elapsed = time.perf_counter() - start
+    return kept, elapsed / max(len(frames), 1)
+
+
+def _recall(reference: list[int], kept: list[int], tolerance: int) -> float:
+    """Fraction of reference keyframes with a kept frame within tolerance."""
+    if not reference:
+        return 1.0
+    hits = sum(1 for r in reference if any(abs(r - k) <= tolerance for k in kept))
+    return hits / len(reference)
+
+
+def benchmark(args: argparse.Namespace) -> None:
+    """Run every dedup method over each video and log a comparison table."""
+    totals = {m: {"time": 0.0, "kept": 0, "recall": 0.0} for m in DEDUP_METHODS}
+    n_videos = 0
+
+    for video_path in args.videos:
+        frames = _sample_video(video_path, args.max_samples)
+        if not frames:
+            continue
+        n_videos += 1
+
+        results = {m: _run_method(m, frames) for m in DEDUP_METHODS}
+        reference = results[REFERENCE_METHOD][0]
+
+        logger.info("%s: %d sampled frames, %d reference keyframes",
+                    video_path.name, len(frames), len(reference))
+        for method, (kept, per_frame) in results.items():
+            recall = _recall(reference, kept, args.tolerance)
+            totals[method]["time"] += per_frame
+            totals[method]["kept"] += len(kept)
+            totals[method]["recall"] += recall
+            logger.info("  %-10s %8.2f ms/frame  %4d kept  recall=%.3f",
+                        method, per_frame * 1000, len(kept), recall)
+
+    if not n_videos:
+        logger.error("No readable videos")
+        sys.exit(1)
+
+    logger.info("Average over %d video(s):", n_videos)
+    ref_time = totals[REFERENCE_METHOD]["time"] / n_videos
+    for method, t in totals.items():
+        avg_time = t["time"] / n_videos
+        logger.info("  %-10s %8.2f ms/frame  (%.1fx vs %s)  %6.1f kept  recall=%.3f",
+                    method, avg_time * 1000, ref_time / max(avg_time, 1e-9),
+                    REFERENCE_METHOD, t["kept"] / n_videos, t["recall"] / n_videos)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    benchmark(args)
@@ -0,0 +1,151 @@
+"""
+Benchmark YOLO inference backends (PyTorch vs. ONNX Runtime vs. OpenVINO).
+
+For each backend the weights are exported (cached under data/models/exports,
+same as the scanner) and evaluated on a fixture dataset:
+  - latency: mean / p95 milliseconds per image over the val images
+  - accuracy parity: mAP@50 and mAP@50-95 from Ultralytics validation,
+    reported as a delta against the PyTorch model
+
+Usage:
+    python scripts/benchmark_yolo_backends.py --data-dir data/damage-dataset \\
+        --weights data/models/fleet-damage-v1.pt --backends pytorch onnx openvino
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Allow running from the repo root without installing the app package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import YOLO_EXPORT_IMGSZ  # noqa: E402
+from app.utils.model_loader import export_yolo  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare YOLO backend latency and mAP parity on a fixture set.",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        required=True,
+        help="Dataset directory containing dataset.yaml (e.g. from convert_cardd.py)",
+    )
+    parser.add_argument(
+        "--weights",
+        type=str,
+        default="yolov8n.pt",
+        help="PyTorch weights to export and compare (default: yolov8n.pt)",
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=["pytorch", "onnx", "openvino"],
+        choices=["pytorch", "onnx", "openvino"],
+        help="Backends to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--max-images",
+        type=int,
+        default=200,
+        help="Maximum val images used for latency (default: 200)",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=5,
+        help="Warm-up inferences before timing (default: 5)",
+    )
+    return parser.parse_args()
+
+
+def _load_backend(weights: str, backend: str):
+    from ultralytics import YOLO
+
+    if backend == "pytorch":
+        return YOLO(weights)
+    return YOLO(str(export_yolo(weights, backend)), task="detect")
+
+
+def _latency(model, images: list[Path], warmup: int) -> tuple[float, float]:
+    """Mean and p95 milliseconds per single-image prediction."""
+    for img in images[:warmup]:
+        model(str(img), imgsz=YOLO_EXPORT_IMGSZ, verbose=False)
+
+    times = []
+    for img in images:
+        start = time.perf_counter()
+        model(str(img), imgsz=YOLO_EXPORT_IMGSZ, verbose=False)
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.mean(times)), float(np.percentile(times, 95))
+
+
+def benchmark(args: argparse.Namespace) -> None:
+    """Run latency + validation for each backend and log a comparison."""
+    dataset_yaml = args.data_dir / "dataset.yaml"
+    if not dataset_yaml.exists():
+        logger.error("dataset.yaml not found at %s", dataset_yaml)
+        sys.exit(1)
+
+    val_dir = args.data_dir / "images" / "val"
+    images = sorted(p for p in val_dir.glob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    images = images[:args.max_images]
+    if not images:
+        logger.error("No val images found in %s", val_dir)
+        sys.exit(1)
+
+    results = {}
+    for backend in args.backends:
+        logger.info("Benchmarking %s backend...", backend)
+        try:
+            model = _load_backend(args.weights, backend)
+        except Exception as e:
+            logger.error("Skipping %s: %s", backend, e)
+            continue
+
+        mean_ms, p95_ms = _latency(model, images, args.warmup)
+        metrics = model.val(
+            data=str(dataset_yaml), imgsz=YOLO_EXPORT_IMGSZ, batch=1, verbose=False,
+        )
+        results[backend] = {
+            "mean_ms": mean_ms,
+            "p95_ms": p95_ms,
+            "map50": float(metrics.box.map50),
+            "map50_95": float(metrics.box.map),
+        }
+
+    if not results:
+        logger.error("No backend could be benchmarked")
+        sys.exit(1)
+
+    base = results.get("pytorch")
+    logger.info("Results on %d images (imgsz=%d):", len(images), YOLO_EXPORT_IMGSZ)
+    for backend, r in results.items():
+        line = (f"  {backend:<9} {r['mean_ms']:8.1f} ms (p95 {r['p95_ms']:.1f})  "
+                f"mAP@50={r['map50']:.4f}  mAP@50-95={r['map50_95']:.4f}")
+        if base and backend != "pytorch":
+            line += (f"  speedup={base['mean_ms'] / max(r['mean_ms'], 1e-9):.2f}x  "
+                     f"ΔmAP@50={r['map50'] - base['map50']:+.4f}  "
+                     f"ΔmAP@50-95={r['map50_95'] - base['map50_95']:+.4f}")
+        logger.info(line)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    benchmark(args)
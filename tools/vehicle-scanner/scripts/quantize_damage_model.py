@@ -0,0 +1,236 @@
+"""
+Quantize the fine-tuned damage model to a static INT8 ONNX model.
+
+Exports the trained YOLOv8 weights to ONNX, calibrates activation ranges on
+a subset of the training images produced by convert_cardd.py, and writes a
+statically quantized (QDQ, INT8 weights and activations) model. The FP32 and
+INT8 models are then compared on the val split: mAP@50 / mAP@50-95 delta and
+per-image latency.
+
+Usage:
+    python scripts/quantize_damage_model.py --data-dir data/damage-dataset \\
+        --weights data/models/fleet-damage-v1.pt --calib-size 200
+
+The INT8 model is written to data/models/{output-name}.onnx
+(default fleet-damage-v1-int8.onnx). Serve it with YOLO_FINE_TUNED=true and
+YOLO_BACKEND=onnx_int8.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import random
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Statically quantize the fleet damage model to INT8 ONNX.",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        required=True,
+        help="Dataset directory from convert_cardd.py (contains dataset.yaml)",
+    )
+    parser.add_argument(
+        "--weights",
+        type=Path,
+        default=Path("data/models/fleet-damage-v1.pt"),
+        help="Trained weights (default: data/models/fleet-damage-v1.pt)",
+    )
+    parser.add_argument(
+        "--calib-size",
+        type=int,
+        default=200,
+        help="Number of training images used for calibration (default: 200)",
+    )
+    parser.add_argument(
+        "--imgsz",
+        type=int,
+        default=640,
+        help="Model input size (default: 640)",
+    )
+    parser.add_argument(
+        "--output-name",
+        type=str,
+        default="fleet-damage-v1-int8",
+        help="Name for the output model file (default: fleet-damage-v1-int8)",
+    )
+    parser.add_argument(
+        "--latency-images",
+        type=int,
+        default=100,
+        help="Val images used for latency measurement (default: 100)",
+    )
+    return parser.parse_args()
+
+
+def _letterbox(img: np.ndarray, size: int) -> np.ndarray:
+    """Resize with unchanged aspect ratio and pad to size x size (Ultralytics style)."""
+    import cv2
+
+    h, w = img.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top = (size - new_h) // 2
+    left = (size - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = resized
+    return canvas
+
+
+def _make_calibration_reader(images: list[Path], input_name: str, imgsz: int):
+    """Build an onnxruntime CalibrationDataReader over the calibration images."""
+    import cv2
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self):
+            self._images = iter(images)
+
+        def get_next(self):
+            for path in self._images:
+                img = cv2.imread(str(path))
+                if img is None:
+                    continue
+                rgb = cv2.cvtColor(_letterbox(img, imgsz), cv2.COLOR_BGR2RGB)
+                tensor = rgb.transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+                return {input_name: tensor}
+            return None
+
+    return _Reader()
+
+
+def _copy_metadata(src: Path, dst: Path) -> None:
+    """Carry Ultralytics metadata (class names, stride, imgsz) over to the INT8 model."""
+    import onnx
+
+    src_model = onnx.load(str(src))
+    dst_model = onnx.load(str(dst))
+    existing = {p.key for p in dst_model.metadata_props}
+    for prop in src_model.metadata_props:
+        if prop.key not in existing:
+            dst_model.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(dst_model, str(dst))
+
+
+def _evaluate(model_path: Path, dataset_yaml: Path, images: list[Path], imgsz: int) -> dict:
+    """mAP on the val split and mean per-image latency for an ONNX model."""
+    from ultralytics import YOLO
+
+    model = YOLO(str(model_path), task="detect")
+    metrics = model.val(data=str(dataset_yaml), imgsz=imgsz, batch=1, verbose=False)
+
+    for img in images[:5]:  # Warm-up
+        model(str(img), imgsz=imgsz, verbose=False)
+    times = []
+    for img in images:
+        start = time.perf_counter()
+        model(str(img), imgsz=imgsz, verbose=False)
+        times.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "map50": float(metrics.box.map50),
+        "map50_95": float(metrics.box.map),
+        "latency_ms": float(np.mean(times)) if times else 0.0,
+        "size_mb": model_path.stat().st_size / (1024 * 1024),
+    }
+
+
+def quantize(args: argparse.Namespace) -> None:
+    """Export, calibrate, quantize and evaluate."""
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from ultralytics import YOLO
+
+    dataset_yaml = args.data_dir / "dataset.yaml"
+    if not dataset_yaml.exists():
+        logger.error("dataset.yaml not found at %s", dataset_yaml)
+        sys.exit(1)
+    if not args.weights.exists():
+        logger.error("Trained weights not found at %s", args.weights)
+        sys.exit(1)
+
+    train_images = sorted(
+        p for p in (args.data_dir / "images" / "train").glob("*") if p.suffix.lower() in IMAGE_EXTENSIONS
+    )
+    val_images = sorted(
+        p for p in (args.data_dir / "images" / "val").glob("*") if p.suffix.lower() in IMAGE_EXTENSIONS
+    )
+    if not train_images or not val_images:
+        logger.error("Expected images under %s/images/{train,val}", args.data_dir)
+        sys.exit(1)
+
+    random.seed(0)
+    calib_images = random.sample(train_images, min(args.calib_size, len(train_images)))
+
+    # Resolve output directory
+    project_root = Path(__file__).resolve().parent.parent
+    models_dir = project_root / "data" / "models"
+    models_dir.mkdir(parents=True, exist_ok=True)
+
+    fp32_path = models_dir / f"{args.weights.stem}-fp32.onnx"
+    int8_path = models_dir / f"{args.output_name}.onnx"
+
+    # --- Export FP32 ONNX (dynamic batch so the scanner can batch frames) ---
+    logger.info("Exporting %s to ONNX (imgsz=%d)", args.weights, args.imgsz)
+    exported = Path(YOLO(str(args.weights)).export(format="onnx", imgsz=args.imgsz, dynamic=True))
+    shutil.move(str(exported), str(fp32_path))
+
+    # --- Static INT8 quantization ---
+    input_name = ort.InferenceSession(str(fp32_path), providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    logger.info("Calibrating on %d images and quantizing to INT8...", len(calib_images))
+    quantize_static(
+        str(fp32_path),
+        str(int8_path),
+        _make_calibration_reader(calib_images, input_name, args.imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    _copy_metadata(fp32_path, int8_path)
+    logger.info("INT8 model written to %s", int8_path)
+
+    # --- Compare FP32 vs INT8 on the val split ---
+    latency_images = val_images[:args.latency_images]
+    fp32 = _evaluate(fp32_path, dataset_yaml, latency_images, args.imgsz)
+    int8 = _evaluate(int8_path, dataset_yaml, latency_images, args.imgsz)
+
+    for name, r in (("FP32", fp32), ("INT8", int8)):
+        logger.info("%s: mAP@50=%.4f  mAP@50-95=%.4f  latency=%.1f ms  size=%.1f MB",
+                    name, r["map50"], r["map50_95"], r["latency_ms"], r["size_mb"])
+    logger.info(
+        "INT8 vs FP32: ΔmAP@50=%+.4f  ΔmAP@50-95=%+.4f  speedup=%.2fx",
+        int8["map50"] - fp32["map50"],
+        int8["map50_95"] - fp32["map50_95"],
+        fp32["latency_ms"] / max(int8["latency_ms"], 1e-9),
+    )
+
+    if fp32["map50"] - int8["map50"] > 0.02:
+        logger.warning(
+            "INT8 model loses more than 2 points of mAP@50. Consider a larger or "
+            "more representative calibration set before deploying it.",
+        )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    quantize(args)